@@ -0,0 +1,253 @@
+# accounts.py
+"""Generation of receivables from completed sales and payables from completed purchases.
+
+Two modes produce the same rows:
+
+* ``set`` (default): one INSERT ... SELECT from the source table,
+  anti-joined to the existing documents, with the due date computed in
+  SQL; nothing is loaded into Python;
+* ``orm``: the original implementation, loading each eligible Sale or
+  Purchase and adding one ORM object per row. Kept for comparison (see
+  ``flask bench-receivables``).
+
+Both run as background jobs (see jobs.py). Each chunk covers the next
+``chunk_size`` source rows by primary key after the job's cursor, so a
+resumed job never duplicates a row. create_receivables() and
+create_payables() do the whole table in one go.
+
+aging_report() buckets the open documents of one side by days past due
+in a single GROUP BY party, with customer/vendor names joined in.
+"""
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import Float, String, case, func, insert, literal, select
+
+from invalidation import mark_changed
+from jobs import register_job
+from models import db, Customer, Payable, Purchase, Receivable, Sale, Vendor
+
+MODES = ('set', 'orm')
+RECEIVABLE_TERM_DAYS = 30 # 应收账款到期日 = 销售日期 + 30 天
+PAYABLE_TERM_DAYS = 15 # 应付账款到期日 = 采购日期 + 15 天
+
+_RECEIVABLE_COLUMNS = ['SaleID', 'CustomerID', 'ReceivableAmount', 'ReceivableDate', 'Status', 'CreatedAt']
+_PAYABLE_COLUMNS = ['PurchaseID', 'VendorID', 'PayableAmount', 'PayableDate', 'PayableStatus', 'CreatedAt']
+
+
+def _plus_days(column, days):
+    """``column + days`` in the text format SQLAlchemy stores DateTime values in on SQLite.
+
+    SQLite's datetime() returns 'YYYY-MM-DD HH:MM:SS', while ORM-written
+    values carry six fractional digits; mixing the two makes comparisons and
+    the aging buckets disagree at day boundaries. Shifting by whole days
+    keeps the fraction, so it is copied from the source value as the ORM's
+    ``+ timedelta`` would.
+    """
+    fraction = case((func.substr(column, 20, 1) == '.', func.substr(column, 20)), else_='.000000')
+    return func.strftime('%Y-%m-%d %H:%M:%S', column, f'+{days} days', type_=String) + fraction
+
+
+def receivable_source():
+    """SELECT of receivable rows for completed sales that have none yet.
+
+    Guest sales (no CustomerID) are skipped: a receivable needs a customer.
+    """
+    return select(
+        Sale.SaleID,
+        Sale.CustomerID,
+        Sale.TotalAmount,
+        _plus_days(Sale.SaleDate, RECEIVABLE_TERM_DAYS),
+        literal('Unpaid'),
+        literal(datetime.utcnow())
+    ).where(
+        Sale.Status == 'Completed',
+        Sale.CustomerID.isnot(None),
+        ~select(Receivable.ReceivableID).where(Receivable.SaleID == Sale.SaleID).exists()
+    )
+
+
+def payable_source():
+    """SELECT of payable rows for completed purchases that have none yet."""
+    return select(
+        Purchase.PurchaseID,
+        Purchase.VendorID,
+        Purchase.total_amount,
+        _plus_days(Purchase.OrderDate, PAYABLE_TERM_DAYS),
+        literal('Unpaid'),
+        literal(datetime.utcnow())
+    ).where(
+        Purchase.Status == 'Completed',
+        ~select(Payable.PayableID).where(Payable.PurchaseID == Purchase.PurchaseID).exists()
+    )
+
+
+def _missing_receivable_sales():
+    return Sale.query.filter(
+        Sale.Status == 'Completed',
+        Sale.CustomerID.isnot(None),
+        ~select(Receivable.ReceivableID).where(Receivable.SaleID == Sale.SaleID).exists()
+    )
+
+
+def _missing_payable_purchases():
+    return Purchase.query.filter(
+        Purchase.Status == 'Completed',
+        ~select(Payable.PayableID).where(Payable.PurchaseID == Purchase.PurchaseID).exists()
+    )
+
+
+def _add_receivables(session, sales):
+    now = datetime.utcnow()
+    session.add_all([Receivable(
+        SaleID=sale.SaleID,
+        CustomerID=sale.CustomerID,
+        ReceivableAmount=sale.TotalAmount,
+        ReceivableDate=sale.SaleDate + timedelta(days=RECEIVABLE_TERM_DAYS),
+        Status='Unpaid',
+        CreatedAt=now
+    ) for sale in sales])
+    session.flush()
+    return len(sales)
+
+
+def _add_payables(session, purchases):
+    now = datetime.utcnow()
+    session.add_all([Payable(
+        PurchaseID=purchase.PurchaseID,
+        VendorID=purchase.VendorID,
+        PayableAmount=purchase.total_amount,
+        PayableDate=purchase.OrderDate + timedelta(days=PAYABLE_TERM_DAYS),
+        PayableStatus='Unpaid',
+        CreatedAt=now
+    ) for purchase in purchases])
+    session.flush()
+    return len(purchases)
+
+
+def _next_key_bound(session, key, after, chunk_size):
+    """Largest key among the next ``chunk_size`` keys after ``after``; None when there are none."""
+    keys = select(key).where(key > (after or 0)).order_by(key).limit(chunk_size).subquery()
+    return session.execute(select(func.max(keys.c[key.key]))).scalar()
+
+
+def _insert_from_select(session, model, columns, source):
+    created = session.execute(insert(model).from_select(columns, source)).rowcount
+    if created:
+        # INSERT ... SELECT 绕过了 unit of work，需要手动通知失效总线
+        mark_changed(session, model)
+    return created
+
+
+def receivables_chunk(session, after, chunk_size, mode='set'):
+    upper = _next_key_bound(session, Sale.SaleID, after, chunk_size)
+    if upper is None:
+        return None, 0
+    in_chunk = (Sale.SaleID > (after or 0), Sale.SaleID <= upper)
+    if mode == 'orm':
+        return upper, _add_receivables(session, _missing_receivable_sales().filter(*in_chunk).all())
+    return upper, _insert_from_select(session, Receivable, _RECEIVABLE_COLUMNS,
+                                      receivable_source().where(*in_chunk))
+
+
+def payables_chunk(session, after, chunk_size, mode='set'):
+    upper = _next_key_bound(session, Purchase.PurchaseID, after, chunk_size)
+    if upper is None:
+        return None, 0
+    in_chunk = (Purchase.PurchaseID > (after or 0), Purchase.PurchaseID <= upper)
+    if mode == 'orm':
+        return upper, _add_payables(session, _missing_payable_purchases().filter(*in_chunk).all())
+    return upper, _insert_from_select(session, Payable, _PAYABLE_COLUMNS,
+                                      payable_source().where(*in_chunk))
+
+
+def create_receivables(mode='set'):
+    """Create every missing receivable in the current transaction; returns the number created."""
+    if mode == 'orm':
+        return _add_receivables(db.session, _missing_receivable_sales().all())
+    return _insert_from_select(db.session, Receivable, _RECEIVABLE_COLUMNS, receivable_source())
+
+
+def create_payables(mode='set'):
+    """Create every missing payable in the current transaction; returns the number created."""
+    if mode == 'orm':
+        return _add_payables(db.session, _missing_payable_purchases().all())
+    return _insert_from_select(db.session, Payable, _PAYABLE_COLUMNS, payable_source())
+
+
+def count_missing_receivables(mode='set'):
+    return db.session.execute(select(func.count()).select_from(receivable_source().subquery())).scalar()
+
+
+def count_missing_payables(mode='set'):
+    return db.session.execute(select(func.count()).select_from(payable_source().subquery())).scalar()
+
+
+# 账龄分组：(名称, 最多逾期天数)；current 为尚未到期，最后一组不设上限
+AGING_BUCKETS = (('current', 0), ('1-30', 30), ('31-60', 60), ('61-90', 90), ('90+', None))
+
+# 每一侧：(金额, 到期日, 未结清条件, 对方 ID, 对方表, 对方主键, 对方名称)
+_AGING_SIDES = {
+    'receivables': (Receivable.ReceivableAmount, Receivable.ReceivableDate, Receivable.Status != 'Paid',
+                    Receivable.CustomerID, Customer, Customer.CustomerID, Customer.Name),
+    'payables': (Payable.PayableAmount, Payable.PayableDate, Payable.PayableStatus != 'Paid',
+                 Payable.VendorID, Vendor, Vendor.VendorID, Vendor.Name),
+}
+
+
+def aging_select(side, as_of):
+    """SELECT one row per party of ``side`` with its open amount due on or after each bucket cutoff.
+
+    Columns: party id, party name, one cumulative sum per bounded bucket
+    (``due_0``, ``due_30`` ...: amount due on or after as_of minus that many
+    days), the total open amount and the number of documents. Cumulative
+    sums need one date comparison per bucket and no CASE chain; the grouped
+    rows are read in party order from the covering aging index, and names
+    are joined after aggregation.
+    """
+    amount, due, is_open, party_key, party, party_pk, party_name = _AGING_SIDES[side]
+    today = datetime.combine(as_of, time.min)
+    grouped = select(
+        party_key.label('party_id'),
+        # 结果只用于展示，按 Float 取回省去逐个 Decimal 转换
+        *[func.sum(case((due >= today - timedelta(days=max_days), amount), else_=0), type_=Float)
+          .label(f'due_{max_days}') for _, max_days in AGING_BUCKETS[:-1]],
+        func.sum(amount, type_=Float).label('total'),
+        func.count().label('documents')
+    ).where(is_open).group_by(party_key).subquery()
+    return select(grouped.c.party_id, party_name, *list(grouped.c)[1:]) \
+        .outerjoin(party, party_pk == grouped.c.party_id)
+
+
+def aging_report(side, as_of=None):
+    """Open ``side`` ('receivables' or 'payables') amounts per aging bucket, overall and per party.
+
+    Returns ``{'as_of', 'totals': {bucket: amount, 'total': ...}, 'documents',
+    'parties': [{'id', 'name', bucket: amount..., 'total'}]}`` with parties
+    sorted by outstanding amount, largest first.
+    """
+    as_of = as_of or date.today()
+    names = [name for name, _ in AGING_BUCKETS]
+    totals = dict.fromkeys(names + ['total'], 0.0)
+    parties = []
+    documents = 0
+    for party_id, party_name, *cumulative, total, count in db.session.execute(aging_select(side, as_of)):
+        # 累计金额相减得到各组金额：current = due_0，1-30 = due_30 - due_0 ...，90+ = total - due_90
+        bounds = [0.0] + [value or 0.0 for value in cumulative] + [total or 0.0]
+        row = {'id': party_id, 'name': party_name}
+        for name, lower, upper in zip(names, bounds, bounds[1:]):
+            row[name] = round(upper - lower, 2)
+            totals[name] += upper - lower
+        row['total'] = round(bounds[-1], 2)
+        totals['total'] += bounds[-1]
+        documents += count
+        parties.append(row)
+    return {
+        'as_of': as_of.strftime('%Y-%m-%d'),
+        'totals': {key: round(value, 2) for key, value in totals.items()},
+        'documents': documents,
+        'parties': sorted(parties, key=lambda row: row['total'], reverse=True)
+    }
+
+
+register_job('create-receivables', receivables_chunk, count_missing_receivables)
+register_job('create-payables', payables_chunk, count_missing_payables)
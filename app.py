@@ -28,7 +28,16 @@ import click
 # 导入模型和初始化函数
 from models import db, Dish, Inventory, Vendor, Purchase, PurchaseItem, Sale
 from models import SaleDish, Customer, Staff, Feedback, Payable, Receivable
-from db_init import init_db_data, init_db
+from db_init import init_db_data, init_db, upgrade_db
+from query_plan_check import check_query_plans, check_query_counts
+from rollup import rebuild_daily_rollup
+from cache import init_cache, response_cache
+from benchmarks import bench_aging, bench_margins, bench_receivables, check_bulk_import
+from depletion import init_depletion, apply_pending_depletion
+from jobs import job_runner
+from snapshot import init_financial_snapshots, rebuild_financial_snapshot
+from exports import export_response
+from extract import extract_sales_history
 
 # Import Blueprints
 from blueprints.inventory_bp import inventory_bp, inventory_api
@@ -47,8 +56,38 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = 'kaoshan_pizza_secret_key'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///kaoshan_pizza.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['BULK_ORDER_BATCH_SIZE'] = 200 # /api/orders/bulk 每批提交的订单数
+app.config['RESPONSE_CACHE_TTL'] = 60 # 分析类接口响应缓存（秒）
+app.config['RESPONSE_CACHE_MAXSIZE'] = 512
+app.config['INVENTORY_DEPLETION_DEFERRED'] = False # True: 后台线程合并扣减库存，而不是在订单完成的事务里扣
+app.config['INVENTORY_DEPLETION_INTERVAL'] = 10 # 后台扣减间隔（秒）
+app.config['JOB_WORKERS'] = 1 # 后台任务线程数（SQLite 同时只有一个写事务）
+app.config['JOB_CHUNK_SIZE'] = 1000 # 每块处理的源记录数，每块单独提交
+app.config['JOB_STALE_SECONDS'] = 60 # 运行中的任务超过此时间无心跳视为中断，可续跑
+app.config['FINANCIAL_SNAPSHOT_INTERVAL'] = 300 # 财务页面快照的后台重建间隔（秒），0 表示不自动重建
+app.config['FINANCIAL_SNAPSHOT_KEEP'] = 24 # 保留的快照份数
+app.config['EXPORT_BATCH_SIZE'] = 1000 # CSV 导出每批读取/输出的行数
+app.config['ANALYTICS_EXTRACT_DIR'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'extracts') # flask extract-sales 的输出目录
 
 db.init_app(app)
+init_cache(app)
+job_runner.init_app(app)
+
+
+def start_background_workers():
+    """Start the depletion and snapshot threads and resume unfinished jobs, once per process.
+
+    Only the serving entry points call this: the bottom of this file for
+    python app.py, and wsgi.py for WSGI servers. Importing the app (flask
+    CLI commands, app.test_client() checks) starts nothing.
+    """
+    if app.extensions.get('background_workers'):
+        return
+    app.extensions['background_workers'] = True
+    init_depletion(app)
+    job_runner.resume_unfinished()
+    init_financial_snapshots(app)
+
 
 # Register Blueprints
 app.register_blueprint(inventory_bp)
@@ -81,6 +120,30 @@ def seed_db_command():
         init_db_data()
     click.echo('Database initialization completed.')
 
+@app.cli.command('extract-sales')
+@click.option('--output', default=None, help='Extract directory (defaults to ANALYTICS_EXTRACT_DIR).')
+@click.option('--full', is_flag=True, help='Discard the existing extract and extract every row again.')
+@click.option('--batch-size', default=100000, show_default=True, help='Rows per part file.')
+def extract_sales_command(output, full, batch_size):
+    """Command line: Append new sale, sale_dish, dish and customer rows to the columnar analytics extract"""
+    directory = output or app.config['ANALYTICS_EXTRACT_DIR']
+    with app.app_context():
+        try:
+            results = extract_sales_history(directory, full=full, batch_size=batch_size)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    for result in results:
+        click.echo(f"{result['table']}: +{result['new_rows']} rows ({result['rows']} total, "
+                   f"{result['parts']} parts, {result['bytes'] / 1e6:.1f} MB)")
+    click.echo(f'Extract written to {directory}.')
+
+@app.cli.command('rebuild-rollup')
+def rebuild_rollup_command():
+    """Command line: Recompute the daily sales rollup from raw sales"""
+    with app.app_context():
+        row_count = rebuild_daily_rollup()
+    click.echo(f'Daily sales rollup rebuilt ({row_count} rows).')
+
 @app.cli.command('init-db')
 def init_db_command():
     """Command line: Create database tables and initialize data"""
@@ -88,6 +151,103 @@ def init_db_command():
         init_db()
     click.echo('Database created and initialized successfully.')
 
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Command line: Add missing tables and indexes to an existing database"""
+    with app.app_context():
+        upgrade_db()
+    click.echo('Database upgraded successfully.')
+
+@app.cli.command('bench-receivables')
+@click.option('--sizes', default='10000,100000,1000000', show_default=True, help='Comma-separated sale counts.')
+@click.option('--modes', default='set,orm', show_default=True)
+def bench_receivables_command(sizes, modes):
+    """Command line: Compare set-based and ORM receivable generation on generated sales"""
+    sizes = [int(size) for size in sizes.split(',')]
+    modes = [mode.strip() for mode in modes.split(',')]
+    click.echo(f"{'sales':>10} {'mode':>5} {'created':>9} {'ms':>10}")
+    for result in bench_receivables(sizes=sizes, modes=modes):
+        click.echo(f"{result['sales']:>10} {result['mode']:>5} {result['created']:>9} {result['ms']:>10}")
+
+@app.cli.command('bench-aging')
+@click.option('--open-receivables', default=100000, show_default=True)
+@click.option('--customers', default=2000, show_default=True)
+@click.option('--budget-ms', default=100, show_default=True, help='Maximum median aging report time.')
+def bench_aging_command(open_receivables, customers, budget_ms):
+    """Command line: Time the receivables aging report on generated documents and fail over budget"""
+    result = bench_aging(open_receivables=open_receivables, customers=customers)
+    click.echo(f"{result['open_receivables']} open receivables, {result['customers']} customers")
+    click.echo(f"aging report: best {result['best_ms']} ms, median {result['median_ms']} ms, "
+               f"worst {result['worst_ms']} ms")
+    if result['median_ms'] > budget_ms:
+        raise click.ClickException(f"Aging report took {result['median_ms']} ms (budget {budget_ms} ms).")
+
+@app.cli.command('rebuild-financial-snapshot')
+def rebuild_financial_snapshot_command():
+    """Command line: Recompute the financial report snapshot shown on /finance"""
+    with app.app_context():
+        snapshot = rebuild_financial_snapshot(app.config['FINANCIAL_SNAPSHOT_KEEP'])
+    click.echo(f'Financial snapshot {snapshot.SnapshotID} rebuilt in {snapshot.BuildMs} ms.')
+
+@app.cli.command('deplete-inventory')
+def deplete_inventory_command():
+    """Command line: Apply queued inventory depletion for completed orders"""
+    with app.app_context():
+        applied = apply_pending_depletion(db.session)
+        db.session.commit()
+    click.echo(f'Inventory depleted for {applied} completed orders.')
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Command line: Fail if a hot analytics query falls back to a full table scan"""
+    failures = check_query_plans(app)
+    for endpoint, statement, detail in failures:
+        click.echo(f'[{endpoint}] {detail}')
+        if statement:
+            click.echo(f'    {statement}')
+    if failures:
+        raise click.ClickException(f'{len(failures)} hot query plan(s) regressed to a full scan.')
+    click.echo('All hot queries are served from indexes.')
+
+@app.cli.command('check-query-counts')
+def check_query_counts_command():
+    """Command line: Fail if a list endpoint exceeds its SQL statement budget (N+1 loading)"""
+    failures = check_query_counts(app)
+    for endpoint, statement_count, budget in failures:
+        click.echo(f'[{endpoint}] {statement_count} statements (budget {budget})')
+    if failures:
+        raise click.ClickException(f'{len(failures)} endpoint(s) exceeded their query budget.')
+    click.echo('All list endpoints are within their query budgets.')
+
+@app.cli.command('check-bulk-import')
+def check_bulk_import_command():
+    """Command line: Fail if a bulk order import rebuilds the whole daily rollup instead of the imported days"""
+    failures = check_bulk_import()
+    for failure in failures:
+        click.echo(failure)
+    if failures:
+        raise click.ClickException('Bulk order import check failed.')
+    click.echo('Bulk order import refreshed only the imported days.')
+
+@app.cli.command('bench-margins')
+@click.option('--dishes', default=2000, show_default=True)
+@click.option('--days', default=365, show_default=True)
+@click.option('--orders-per-day', default=300, show_default=True)
+@click.option('--budget-ms', default=6000, show_default=True, help='Maximum cold margin report time.')
+def bench_margins_command(dishes, days, orders_per_day, budget_ms):
+    """Command line: Time the recipe COGS margin report on generated data and fail over budget"""
+    result = bench_margins(dishes=dishes, days=days, orders_per_day=orders_per_day)
+    click.echo(f"{result['dishes']} dishes, {result['sales']} sales, {result['lines']} lines "
+               f"(seeded in {result['seed_s']}s)")
+    click.echo(f"margin report: cold {result['cold_ms']} ms, cached {result['warm_ms']} ms")
+    if result['cold_ms'] > budget_ms:
+        raise click.ClickException(f"Margin report took {result['cold_ms']} ms (budget {budget_ms} ms).")
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Hit/miss counters of the analytics response cache in this worker"""
+    return jsonify(response_cache.stats())
+
 # 主路由
 @app.route('/')
 def index():
@@ -178,11 +338,25 @@ def inactive_customers():
     cnt = Customer.query.filter(Customer.last_visit < three_months_ago).count()
     return jsonify({'inactive_count': cnt})
 
-@app.route('/api/customers', methods=['GET'])
-def get_customers():
-    mem_level   = request.args.get('mem_level', 'all')
-    search_term = request.args.get('search', '')
-    query = Customer.query
+def with_completed_order_counts(query):
+    """Attach each customer's completed-order count to a Customer query.
+
+    The counts come from one grouped subquery outer-joined to the customers,
+    so the result rows are ``(Customer, total_orders)`` tuples.
+    """
+    completed_orders = db.session.query(
+        Sale.CustomerID,
+        func.count(Sale.SaleID).label('total_orders')
+    ).filter(Sale.Status == 'Completed')\
+     .group_by(Sale.CustomerID)\
+     .subquery()
+    return query.outerjoin(completed_orders, completed_orders.c.CustomerID == Customer.CustomerID)\
+                .add_columns(func.coalesce(completed_orders.c.total_orders, 0))
+
+def filter_customers(query, args):
+    """Apply the customer list filters (mem_level, search); shared by the list and the export."""
+    mem_level   = args.get('mem_level', 'all')
+    search_term = args.get('search', '')
 
     if mem_level != 'all':
         query = query.filter(Customer.MemLevel == mem_level)
@@ -192,9 +366,25 @@ def get_customers():
             Customer.PhoneNum.ilike(f'%{search_term}%') |
             Customer.Email.ilike(f'%{search_term}%')
         )
+    return query
 
-    customers = query.order_by(Customer.Name).all()
-    return jsonify([c.to_dict() for c in customers])
+@app.route('/api/customers', methods=['GET'])
+def get_customers():
+    query = filter_customers(Customer.query, request.args)
+    rows = with_completed_order_counts(query).order_by(Customer.Name).all()
+    return jsonify([c.to_dict(total_orders=total_orders) for c, total_orders in rows])
+
+@app.route('/api/customers/export', methods=['GET'])
+def export_customers():
+    """Stream the filtered customer list as CSV or XLSX (same filters and order as /api/customers)"""
+    query = db.session.query(
+        Customer.CustomerID, Customer.Name, Customer.PhoneNum, Customer.Email, Customer.MemLevel,
+        Customer.BirthDate, Customer.RegDate, Customer.last_visit
+    ).select_from(Customer)
+    query = with_completed_order_counts(filter_customers(query, request.args)).order_by(Customer.Name)
+    return export_response('customers', [
+        'CustomerID', 'Name', 'PhoneNum', 'Email', 'MemLevel', 'BirthDate', 'RegDate', 'LastVisit', 'TotalOrders'
+    ], query)
 # 页面
 @app.route('/staff_management')
 def staff_management():
@@ -386,9 +576,12 @@ def format_currency(value):
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        upgrade_db()
         if Dish.query.count() == 0:
             init_db_data()
+    # debug 模式下 reloader 父进程只负责监视文件，后台线程只在真正服务的子进程里启动
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_workers()
     app.run(debug=True)
     
     
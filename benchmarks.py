@@ -0,0 +1,316 @@
+# benchmarks.py
+"""Latency benchmarks for the heavy reporting and batch queries.
+
+Each benchmark builds a throw-away SQLite database of the requested size
+with Core executemany inserts (so no invalidation events fire), times the
+operation and returns the timings; the ``flask bench-*`` commands in app.py
+print them. bench-margins also fails when the cold report exceeds its
+budget. check_bulk_import() uses the same kind of scratch database to check
+that a bulk order import keeps the daily rollup incremental.
+"""
+import itertools
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+from flask import Flask
+
+from models import db, Customer, DailySalesRollup, Dish, DishIngredient, Item, ItemPrice, Receivable, Sale, SaleDish
+
+_CHUNK = 5000
+
+
+def _scratch_app(path):
+    app = Flask('benchmark')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def _insert(table, rows):
+    """executemany ``rows`` (any iterable of dicts) into ``table`` in chunks."""
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, _CHUNK))
+        if not batch:
+            break
+        db.session.execute(table.insert(), batch)
+
+
+def _seed_margin_data(rng, dishes, items, days, orders_per_day, lines_per_order, price_changes):
+    first_day = date.today() - timedelta(days=days - 1)
+
+    _insert(Item.__table__, [
+        {'ItemID': item_id, 'Name': f'Item {item_id}', 'Category': 'Bench', 'DefaultUnit': 'kg'}
+        for item_id in range(1, items + 1)
+    ])
+    prices = []
+    for item_id in range(1, items + 1):
+        price = rng.uniform(0.5, 20)
+        changes = sorted(rng.sample(range(1, days), min(price_changes, days - 1)))
+        for offset in [0] + changes:
+            prices.append({'ItemID': item_id, 'EffectiveDate': first_day + timedelta(days=offset),
+                           'UnitPrice': round(price, 2)})
+            price *= rng.uniform(0.9, 1.15)
+    _insert(ItemPrice.__table__, prices)
+
+    dish_prices = {}
+    _insert(Dish.__table__, [
+        {'DishID': dish_id, 'Name': f'Dish {dish_id}', 'Category': f'Category {dish_id % 12}',
+         'Price': dish_prices.setdefault(dish_id, round(rng.uniform(5, 40), 2)), 'Status': 'Available'}
+        for dish_id in range(1, dishes + 1)
+    ])
+    # 留一部分菜品没有配方，覆盖 COGS 为空的分支
+    _insert(DishIngredient.__table__, [
+        {'DishID': dish_id, 'ItemID': item_id, 'Quantity': round(rng.uniform(0.05, 1.5), 3)}
+        for dish_id in range(1, dishes + 1) if dish_id % 20
+        for item_id in rng.sample(range(1, items + 1), min(rng.randint(3, 8), items))
+    ])
+
+    sales, lines = [], []
+    sale_id = 0
+    for offset in range(days):
+        day = datetime.combine(first_day + timedelta(days=offset), datetime.min.time())
+        for _ in range(orders_per_day):
+            sale_id += 1
+            sales.append({'SaleID': sale_id, 'SaleDate': day + timedelta(seconds=rng.randrange(36000, 82800)),
+                          'TotalAmount': 0, 'DiscountAmount': 0,
+                          'Status': 'Completed' if rng.random() < 0.9 else 'Cancelled',
+                          'OrderType': 'Dine-in', 'Channel': 'Counter', 'PaymentCompleted': True})
+            for dish_id in rng.sample(range(1, dishes + 1), lines_per_order):
+                lines.append({'SaleID': sale_id, 'DishID': dish_id, 'Quantity': rng.randint(1, 3),
+                              'UnitPrice': dish_prices[dish_id]})
+    _insert(Sale.__table__, sales)
+    _insert(SaleDish.__table__, lines)
+    db.session.commit()
+    db.session.execute('ANALYZE')
+    return len(sales), len(lines)
+
+
+def bench_margins(dishes=2000, items=300, days=365, orders_per_day=300, lines_per_order=3,
+                  price_changes=12, seed=42):
+    """Time costing.margin_report() over a full year of generated sales.
+
+    Returns a dict with the data sizes, ``seed_s`` and the ``cold_ms`` /
+    ``warm_ms`` timings of the report (the warm run is served from the
+    per-period cache).
+    """
+    from costing import margin_report, _margin_cache
+
+    fd, path = tempfile.mkstemp(prefix='bench_margins_', suffix='.db')
+    os.close(fd)
+    app = _scratch_app(path)
+    try:
+        with app.app_context():
+            db.create_all()
+            started = time.perf_counter()
+            sale_count, line_count = _seed_margin_data(
+                random.Random(seed), dishes, items, days, orders_per_day, lines_per_order, price_changes)
+            seed_s = time.perf_counter() - started
+
+            _margin_cache.clear()
+            started = time.perf_counter()
+            rows = margin_report()
+            cold_ms = (time.perf_counter() - started) * 1000
+
+            started = time.perf_counter()
+            margin_report()
+            warm_ms = (time.perf_counter() - started) * 1000
+
+            _margin_cache.clear()
+            db.session.remove()
+            db.engine.dispose()
+        return {
+            'dishes': dishes,
+            'sales': sale_count,
+            'lines': line_count,
+            'report_rows': len(rows),
+            'seed_s': round(seed_s, 2),
+            'cold_ms': round(cold_ms, 1),
+            'warm_ms': round(warm_ms, 3)
+        }
+    finally:
+        os.remove(path)
+
+
+def _seed_sales(rng, sales, customers):
+    _insert(Customer.__table__, (
+        {'CustomerID': customer_id, 'Name': f'Customer {customer_id}', 'PhoneNum': f'555{customer_id:07d}'}
+        for customer_id in range(1, customers + 1)
+    ))
+    start = datetime.now() - timedelta(days=365)
+    _insert(Sale.__table__, (
+        {'SaleID': sale_id, 'SaleDate': start + timedelta(seconds=rng.randrange(365 * 86400)),
+         'TotalAmount': round(rng.uniform(5, 120), 2), 'DiscountAmount': 0,
+         'Status': rng.choice(('Completed', 'Completed', 'Completed', 'Pending', 'Cancelled')),
+         'OrderType': 'Dine-in', 'Channel': 'Counter', 'PaymentCompleted': False,
+         # 约一成是散客订单（不生成应收）
+         'CustomerID': rng.randint(1, customers) if rng.random() < 0.9 else None}
+        for sale_id in range(1, sales + 1)
+    ))
+    db.session.commit()
+    db.session.execute('ANALYZE')
+
+
+def bench_receivables(sizes=(10_000, 100_000, 1_000_000), modes=('set', 'orm'), customers=1000, seed=42):
+    """Time accounts.create_receivables() in each mode for each number of sales.
+
+    Returns a list of ``{'sales', 'mode', 'created', 'ms'}`` dicts. Every run
+    starts from an empty receivable table on the same generated sales.
+    """
+    from accounts import create_receivables
+
+    results = []
+    for size in sizes:
+        fd, path = tempfile.mkstemp(prefix='bench_receivables_', suffix='.db')
+        os.close(fd)
+        app = _scratch_app(path)
+        try:
+            with app.app_context():
+                db.create_all()
+                _seed_sales(random.Random(seed), size, customers)
+                for mode in modes:
+                    db.session.execute(Receivable.__table__.delete())
+                    db.session.commit()
+                    started = time.perf_counter()
+                    created = create_receivables(mode)
+                    db.session.commit()
+                    results.append({'sales': size, 'mode': mode, 'created': created,
+                                    'ms': round((time.perf_counter() - started) * 1000, 1)})
+                    db.session.remove()
+                db.engine.dispose()
+        finally:
+            os.remove(path)
+    return results
+
+
+def bench_aging(open_receivables=100_000, paid_receivables=20_000, customers=2000, runs=5, seed=42):
+    """Time accounts.aging_report('receivables') over ``open_receivables`` open documents.
+
+    Returns the data sizes and the ``best_ms`` / ``median_ms`` / ``worst_ms``
+    of ``runs`` report runs (the first run also warms the page cache).
+    """
+    from accounts import aging_report
+
+    rng = random.Random(seed)
+    fd, path = tempfile.mkstemp(prefix='bench_aging_', suffix='.db')
+    os.close(fd)
+    app = _scratch_app(path)
+    try:
+        with app.app_context():
+            db.create_all()
+            _insert(Customer.__table__, (
+                {'CustomerID': customer_id, 'Name': f'Customer {customer_id}', 'PhoneNum': f'555{customer_id:07d}'}
+                for customer_id in range(1, customers + 1)
+            ))
+            today = datetime.now()
+            _insert(Receivable.__table__, (
+                {'SaleID': receivable_id, 'CustomerID': rng.randint(1, customers),
+                 'ReceivableAmount': round(rng.uniform(5, 500), 2),
+                 # 到期日分布在过去 180 天到未来 30 天
+                 'ReceivableDate': today + timedelta(days=rng.randint(-180, 30)),
+                 'Status': 'Unpaid' if receivable_id <= open_receivables else 'Paid'}
+                for receivable_id in range(1, open_receivables + paid_receivables + 1)
+            ))
+            db.session.commit()
+            db.session.execute('ANALYZE')
+
+            timings = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                report = aging_report('receivables')
+                timings.append((time.perf_counter() - started) * 1000)
+            db.session.remove()
+            db.engine.dispose()
+        return {
+            'open_receivables': report['documents'],
+            'customers': len(report['parties']),
+            'best_ms': round(min(timings), 1),
+            'median_ms': round(statistics.median(timings), 1),
+            'worst_ms': round(max(timings), 1)
+        }
+    finally:
+        os.remove(path)
+
+
+def check_bulk_import(orders=50, batch_size=20, days=5, history_days=30, seed=42):
+    """POST ``orders`` generated orders to /api/orders/bulk and check the rollup refresh.
+
+    The scratch database already holds ``history_days`` of sales. The import
+    must refresh only the rollup days it touched: it may never fall back to
+    rollup._recompute_all(), and the rollup must afterwards match a full
+    rebuild. Returns a list of failure messages (empty when it passes).
+    """
+    import rollup
+    from blueprints.order_bp import order_api
+
+    rng = random.Random(seed)
+    fd, path = tempfile.mkstemp(prefix='check_bulk_import_', suffix='.db')
+    os.close(fd)
+    app = _scratch_app(path)
+    app.register_blueprint(order_api)
+    recompute_all, recomputes = rollup._recompute_all, []
+
+    def _counting_recompute_all():
+        recomputes.append(1)
+        recompute_all()
+
+    try:
+        with app.app_context():
+            db.create_all()
+            _insert(Customer.__table__, [
+                {'CustomerID': customer_id, 'Name': f'Customer {customer_id}', 'PhoneNum': f'555{customer_id:07d}'}
+                for customer_id in range(1, 21)
+            ])
+            _insert(Dish.__table__, [
+                {'DishID': dish_id, 'Name': f'Dish {dish_id}', 'Category': f'Category {dish_id % 4}',
+                 'Price': round(rng.uniform(5, 40), 2), 'Status': 'Available'}
+                for dish_id in range(1, 21)
+            ])
+            today = datetime.combine(date.today(), datetime.min.time())
+            _insert(Sale.__table__, [
+                {'SaleID': sale_id, 'SaleDate': today - timedelta(days=rng.randrange(days, days + history_days),
+                                                                  seconds=-rng.randrange(36000, 82800)),
+                 'TotalAmount': round(rng.uniform(5, 120), 2), 'DiscountAmount': 0, 'Status': 'Completed',
+                 'OrderType': 'Dine-in', 'Channel': 'Counter', 'PaymentCompleted': True}
+                for sale_id in range(1, history_days * 10 + 1)
+            ])
+            rollup.rebuild_daily_rollup()
+
+            payload = {'batch_size': batch_size, 'orders': [
+                {'customer_id': rng.choice([None, rng.randint(1, 20)]),
+                 'order_type': 'Takeaway', 'channel': rng.choice(['App Order', 'Web Order']),
+                 'sale_date': (today - timedelta(days=rng.randrange(days), seconds=-rng.randrange(36000, 82800))).isoformat(),
+                 'items': [{'dish_id': dish_id, 'quantity': rng.randint(1, 3)}
+                           for dish_id in rng.sample(range(1, 21), rng.randint(1, 4))]}
+                for _ in range(orders)
+            ]}
+            rollup._recompute_all = _counting_recompute_all
+            try:
+                response = app.test_client().post('/api/orders/bulk', json=payload)
+            finally:
+                rollup._recompute_all = recompute_all
+
+            failures = []
+            if response.status_code != 201 or response.get_json().get('created') != orders:
+                failures.append(f'bulk import failed: HTTP {response.status_code} {response.get_json()}')
+            if recomputes:
+                failures.append(f'{len(recomputes)} full rollup rebuild(s) during a {orders}-order import')
+
+            columns = [getattr(DailySalesRollup, name) for name in rollup._ROLLUP_COLUMNS]
+            def snapshot():
+                return sorted(tuple(round(value, 6) if isinstance(value, float) else value for value in row)
+                              for row in db.session.query(*columns))
+            incremental = snapshot()
+            rollup.rebuild_daily_rollup()
+            if incremental != snapshot():
+                failures.append('daily rollup after the import differs from a full rebuild')
+            db.session.remove()
+            db.engine.dispose()
+        return failures
+    finally:
+        os.remove(path)
@@ -1,10 +1,11 @@
 from flask import Blueprint, render_template, jsonify, redirect, url_for
-from sqlalchemy import func, extract, distinct
+from sqlalchemy import func, extract, distinct, case, and_
 from sqlalchemy.orm import joinedload
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta, date, time
 from decimal import Decimal
 
-from models import db, Sale, SaleDish, Customer, Staff, Dish, Payable, Receivable
+from models import db, Sale, SaleDish, Customer, Staff, Dish, Payable, Receivable, DailySalesRollup
+from cache import cached
 
 # 创建蓝图
 dashboard_bp = Blueprint('dashboard_bp', __name__, 
@@ -15,6 +16,61 @@ dashboard_bp = Blueprint('dashboard_bp', __name__,
 dashboard_api = Blueprint('dashboard_api', __name__, 
                           url_prefix='/api/dashboard')
 
+def _day_start(day):
+    """Midnight of ``day`` as a naive datetime, for half-open SaleDate ranges."""
+    return datetime.combine(day, time.min)
+
+def _growth(current, previous):
+    """Percentage change from ``previous`` to ``current`` (0 when there is no baseline)."""
+    return float((current - previous) / previous * 100) if previous > 0 else 0.0
+
+def get_sales_summary(today=None):
+    """Compute the dashboard sales KPIs in one conditional-aggregation scan.
+
+    Revenue and average ticket only count Completed sales; order counts
+    include every status. The scan covers [previous month start, tomorrow)
+    so the SaleDate predicate stays a plain range.
+    """
+    today = today or date.today()
+    tomorrow = today + timedelta(days=1)
+    yesterday = today - timedelta(days=1)
+    month_start = date(today.year, today.month, 1)
+    prev_month_start = date((month_start - timedelta(days=1)).year,
+                            (month_start - timedelta(days=1)).month, 1)
+
+    completed = Sale.Status == 'Completed'
+    in_today = and_(Sale.SaleDate >= _day_start(today), Sale.SaleDate < _day_start(tomorrow))
+    in_yesterday = and_(Sale.SaleDate >= _day_start(yesterday), Sale.SaleDate < _day_start(today))
+    in_month = Sale.SaleDate >= _day_start(month_start)
+    in_prev_month = Sale.SaleDate < _day_start(month_start)
+
+    def completed_sum(period):
+        return func.coalesce(func.sum(case((and_(completed, period), Sale.TotalAmount))), 0)
+
+    row = db.session.query(
+        completed_sum(in_today).label('today_sales'),
+        completed_sum(in_yesterday).label('yesterday_sales'),
+        completed_sum(in_month).label('monthly_sales'),
+        completed_sum(in_prev_month).label('prev_month_sales'),
+        func.count(case((in_today, Sale.SaleID))).label('today_orders'),
+        func.count(case((in_yesterday, Sale.SaleID))).label('yesterday_orders'),
+        func.coalesce(func.avg(case((and_(completed, in_month), Sale.TotalAmount))), 0).label('avg_order'),
+        func.coalesce(func.avg(case((and_(completed, in_prev_month), Sale.TotalAmount))), 0).label('prev_avg_order')
+    ).filter(Sale.SaleDate >= _day_start(prev_month_start),
+             Sale.SaleDate < _day_start(tomorrow))\
+     .one()
+
+    return {
+        'today_sales': float(row.today_sales),
+        'yesterday_sales': float(row.yesterday_sales),
+        'monthly_sales': float(row.monthly_sales),
+        'prev_month_sales': float(row.prev_month_sales),
+        'today_orders': int(row.today_orders),
+        'yesterday_orders': int(row.yesterday_orders),
+        'avg_order': float(row.avg_order),
+        'prev_avg_order': float(row.prev_avg_order)
+    }
+
 # 仪表盘路由
 @dashboard_bp.route('/sales')
 def sales_dashboard():
@@ -25,7 +81,7 @@ def sales_dashboard():
     # 获取最新订单数据（最多5条）作为预加载数据传递给模板
     recent_sales = Sale.query.options(joinedload(Sale.customer), 
                                     joinedload(Sale.items).joinedload(SaleDish.dish))\
-                            .filter(func.date(Sale.SaleDate) <= today)\
+                            .filter(Sale.SaleDate < _day_start(today + timedelta(days=1)))\
                             .order_by(Sale.SaleDate.desc())\
                             .limit(5)\
                             .all()
@@ -41,37 +97,15 @@ def sales_dashboard():
             sale_dict['items'] = []
         recent_sales_data.append(sale_dict)
     
-    # 获取今日销售额和订单数量
-    today_sales = db.session.query(func.sum(Sale.TotalAmount))\
-        .filter(Sale.Status == 'Completed')\
-        .filter(func.date(Sale.SaleDate) == today)\
-        .scalar() or 0
-    
-    # 计算今日订单数
-    today_orders = db.session.query(func.count(Sale.SaleID))\
-        .filter(func.date(Sale.SaleDate) == today)\
-        .scalar() or 0
-    
-    # 计算月度销售额
-    month_start = date(today.year, today.month, 1)
-    monthly_sales = db.session.query(func.sum(Sale.TotalAmount))\
-        .filter(Sale.Status == 'Completed')\
-        .filter(func.date(Sale.SaleDate) >= month_start)\
-        .filter(func.date(Sale.SaleDate) <= today)\
-        .scalar() or 0
-    
-    # 计算平均订单金额
-    avg_order = db.session.query(func.avg(Sale.TotalAmount))\
-        .filter(Sale.Status == 'Completed')\
-        .filter(func.date(Sale.SaleDate) <= today)\
-        .scalar() or 0
+    # 今日/本月销售指标（单次聚合扫描）
+    summary = get_sales_summary(today)
     
     # 将额外的数据传递给模板
     dashboard_data = {
-        'today_sales': float(today_sales),
-        'today_orders': int(today_orders),
-        'monthly_sales': float(monthly_sales),
-        'avg_order': float(avg_order),
+        'today_sales': summary['today_sales'],
+        'today_orders': summary['today_orders'],
+        'monthly_sales': summary['monthly_sales'],
+        'avg_order': summary['avg_order'],
         'recent_sales': recent_sales_data
     }
     
@@ -81,80 +115,27 @@ def sales_dashboard():
 @dashboard_api.route('/sales_summary')
 def dashboard_sales_summary():
     """销售汇总数据API"""
-    # 获取今日日期
-    today = date.today()
-    yesterday = today - timedelta(days=1)
-    month_start = date(today.year, today.month, 1)
-    prev_month_end = month_start - timedelta(days=1)
-    prev_month_start = date(prev_month_end.year, prev_month_end.month, 1)
-    
-    # 计算今日销售额
-    today_sales = db.session.query(func.sum(Sale.TotalAmount))\
-        .filter(Sale.Status == 'Completed')\
-        .filter(func.date(Sale.SaleDate) == today)\
-        .scalar() or 0
-    
-    # 计算昨日销售额（用于计算增长率）
-    yesterday_sales = db.session.query(func.sum(Sale.TotalAmount))\
-        .filter(Sale.Status == 'Completed')\
-        .filter(func.date(Sale.SaleDate) == yesterday)\
-        .scalar() or 0
-    
-    # 计算本月销售额
-    monthly_sales = db.session.query(func.sum(Sale.TotalAmount))\
-        .filter(Sale.Status == 'Completed')\
-        .filter(func.date(Sale.SaleDate) >= month_start)\
-        .filter(func.date(Sale.SaleDate) <= today)\
-        .scalar() or 0
-    
-    # 计算上月销售额（用于计算增长率）
-    prev_month_sales = db.session.query(func.sum(Sale.TotalAmount))\
-        .filter(Sale.Status == 'Completed')\
-        .filter(func.date(Sale.SaleDate) >= prev_month_start)\
-        .filter(func.date(Sale.SaleDate) <= prev_month_end)\
-        .scalar() or 0
-    
-    # 计算今日订单数
-    today_orders = db.session.query(func.count(Sale.SaleID))\
-        .filter(func.date(Sale.SaleDate) == today)\
-        .scalar() or 0
-    
-    # 计算昨日订单数（用于计算增长率）
-    yesterday_orders = db.session.query(func.count(Sale.SaleID))\
-        .filter(func.date(Sale.SaleDate) == yesterday)\
-        .scalar() or 0
-    
-    # 计算平均订单金额
-    avg_order = db.session.query(func.avg(Sale.TotalAmount))\
-        .filter(Sale.Status == 'Completed')\
-        .filter(func.date(Sale.SaleDate) <= today)\
-        .scalar() or 0
-    
-    # 计算上月平均订单金额（用于计算增长率）
-    prev_avg_order = db.session.query(func.avg(Sale.TotalAmount))\
-        .filter(Sale.Status == 'Completed')\
-        .filter(func.date(Sale.SaleDate) >= prev_month_start)\
-        .filter(func.date(Sale.SaleDate) <= prev_month_end)\
-        .scalar() or 0
+    summary = get_sales_summary()
     
     # 计算增长率
-    today_growth = ((today_sales - yesterday_sales) / yesterday_sales * 100) if yesterday_sales > 0 else 0
-    monthly_growth = ((monthly_sales - prev_month_sales) / prev_month_sales * 100) if prev_month_sales > 0 else 0
-    orders_growth = ((today_orders - yesterday_orders) / yesterday_orders * 100) if yesterday_orders > 0 else 0
-    avg_growth = ((avg_order - prev_avg_order) / prev_avg_order * 100) if prev_avg_order > 0 else 0
+    today_growth = _growth(summary['today_sales'], summary['yesterday_sales'])
+    monthly_growth = _growth(summary['monthly_sales'], summary['prev_month_sales'])
+    orders_growth = _growth(summary['today_orders'], summary['yesterday_orders'])
+    avg_growth = _growth(summary['avg_order'], summary['prev_avg_order'])
     
     return jsonify({
-        'today_sales': float(today_sales),
-        'monthly_sales': float(monthly_sales),
-        'orders_count': int(today_orders),
-        'avg_order_amount': float(avg_order),
-        'today_growth': float(today_growth),
-        'monthly_growth': float(monthly_growth),
-        'orders_growth': float(orders_growth),
-        'avg_growth': float(avg_growth)
+        'today_sales': summary['today_sales'],
+        'monthly_sales': summary['monthly_sales'],
+        'orders_count': summary['today_orders'],
+        'avg_order_amount': summary['avg_order'],
+        'today_growth': today_growth,
+        'monthly_growth': monthly_growth,
+        'orders_growth': orders_growth,
+        'avg_growth': avg_growth
     })
 
 @dashboard_api.route('/top_products')
+@cached('sales', 'dishes')
 def dashboard_top_products():
     """热门产品数据API"""
     # 查询最畅销的菜品（按销售数量）
@@ -210,15 +191,14 @@ def dashboard_sales_distribution():
     # 获取过去30天的数据范围
     thirty_days_ago = datetime.now() - timedelta(days=30)
     
-    # 按类别分布
+    # 按类别分布（来自每日汇总表）
     sales_by_category = db.session.query(
-        Dish.Category,
-        func.sum(SaleDish.Quantity * Dish.Price).label('total_sales')
-    ).join(SaleDish, Dish.DishID == SaleDish.DishID)\
-     .join(Sale, SaleDish.SaleID == Sale.SaleID)\
-     .filter(Sale.Status == 'Completed')\
-     .filter(Sale.SaleDate >= thirty_days_ago)\
-     .group_by(Dish.Category)\
+        DailySalesRollup.Category,
+        func.sum(DailySalesRollup.LineRevenue).label('total_sales')
+    ).filter(DailySalesRollup.Status == 'Completed')\
+     .filter(DailySalesRollup.Day >= thirty_days_ago.date())\
+     .group_by(DailySalesRollup.Category)\
+     .having(func.sum(DailySalesRollup.Lines) > 0)\
      .all()
 
     # 按时段分布（早餐、午餐、晚餐、夜宵）
@@ -230,15 +210,14 @@ def dashboard_sales_distribution():
         'late_night': (21, 23) # 晚上9点到11点
     }
     
-    sales_by_period = {}
-    for period, (start_hour, end_hour) in time_periods.items():
-        total = db.session.query(func.sum(Sale.TotalAmount))\
-            .filter(Sale.Status == 'Completed')\
-            .filter(Sale.SaleDate >= thirty_days_ago)\
-            .filter(extract('hour', Sale.SaleDate) >= start_hour)\
-            .filter(extract('hour', Sale.SaleDate) <= end_hour)\
-            .scalar() or 0
-        sales_by_period[period] = float(total)
+    sale_hour = extract('hour', Sale.SaleDate)
+    period_totals = db.session.query(*[
+        func.coalesce(func.sum(case((sale_hour.between(start_hour, end_hour), Sale.TotalAmount))), 0).label(period)
+        for period, (start_hour, end_hour) in time_periods.items()
+    ]).filter(Sale.Status == 'Completed')\
+      .filter(Sale.SaleDate >= thirty_days_ago)\
+      .one()
+    sales_by_period = {period: float(getattr(period_totals, period)) for period in time_periods}
     
     # 按客户类型分布（会员等级）
     sales_by_membership = db.session.query(
@@ -1,6 +1,8 @@
 from flask import Blueprint, render_template, request, jsonify
 from sqlalchemy import func
+from datetime import datetime
 from models import db, Dish, DishIngredient
+from costing import get_dish_costs
 
 # 菜品页面蓝图
 dishes_bp = Blueprint('dishes_bp', __name__, template_folder='../templates')
@@ -90,4 +92,25 @@ def get_categories():
         return jsonify([cat[0] for cat in categories])
     except Exception as e:
         print(f"Error in get_categories: {str(e)}")
-        return jsonify({'error': str(e)}), 500 
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500 
+
+@dishes_api.route('/costs', methods=['GET'])
+def get_dish_costs_api():
+    """按配方和原料价格历史计算的菜品单位成本（?as_of=YYYY-MM-DD，默认今天）"""
+    try:
+        as_of_str = request.args.get('as_of')
+        try:
+            as_of = datetime.strptime(as_of_str, '%Y-%m-%d').date() if as_of_str else None
+        except ValueError:
+            return jsonify({'error': 'Invalid as_of date. Use YYYY-MM-DD.'}), 400
+        costs = get_dish_costs(as_of)
+        dishes = Dish.query.order_by(Dish.DishID).all()
+        return jsonify([{
+            'DishID': dish.DishID,
+            'Name': dish.Name,
+            'Price': float(dish.Price) if dish.Price else 0.0,
+            'UnitCost': float(costs[dish.DishID]) if dish.DishID in costs else None
+        } for dish in dishes])
+    except Exception as e:
+        print(f"Error in get_dish_costs_api: {str(e)}")
+        return jsonify({'error': str(e)}), 500
@@ -1,10 +1,10 @@
-from flask import Blueprint, render_template, jsonify, abort, request, current_app
+from flask import Blueprint, render_template, jsonify, abort, request, current_app, url_for
 from sqlalchemy.orm import joinedload
-from sqlalchemy import func, extract, and_, or_
+from werkzeug.datastructures import MultiDict
+from sqlalchemy import func, and_, or_
 from datetime import datetime, timedelta, date
 from decimal import Decimal
 import calendar
-import locale
 import logging
 from sqlalchemy.exc import SQLAlchemyError
 from decimal import Decimal
@@ -12,43 +12,18 @@ from sqlalchemy.orm import joinedload
 from sqlalchemy.exc import SQLAlchemyError
 import logging
 from models import db, Sale, Purchase, PurchaseItem, Item, Receivable, Payable, Customer, Vendor, BuyList # Added BuyList
+from costing import margin_report, price_as_of
+from jobs import job_runner
+from accounts import aging_report
+from snapshot import latest_financial_snapshot, rebuild_financial_snapshot
+from exports import export_response, xlsx_response
+from models import Job
+import accounts # registers the create-receivables / create-payables jobs
 
 # Make sure logging is configured if not already
 logger = logging.getLogger(__name__)
 
 from models import db, Sale, Purchase, PurchaseItem, Item, Receivable, Payable, Customer, Vendor
-ingredient_prices = {
-    "High-Gluten Flour": Decimal("4.50"), # Use Decimal for prices
-    "Tomato Sauce": Decimal("3.00"),
-    "Mozzarella Cheese": Decimal("6.80"),
-    "Pepperoni": Decimal("8.00"),
-    "Mushrooms": Decimal("3.50"),
-    "Green Peppers": Decimal("2.80"),
-    "Onions": Decimal("1.50"),
-    "Olive Oil": Decimal("5.20"),
-    "Black Olives": Decimal("4.00"),
-    "Italian Seasoning": Decimal("2.50"),
-    "Ham Slices": Decimal("7.50"),
-    "Pineapple Chunks": Decimal("3.80"),
-    "Basil Leaves": Decimal("1.20")
-    # Add more items and their prices if needed
-}
-# 设置菜品成本预设（菜品ID: 成本）
-PRODUCT_COST_PRESET = {
-    1: 5.50,   # 比萨基础
-    2: 7.25,   # 意大利面
-    3: 3.75,   # 沙拉
-    4: 4.50,   # 汉堡
-    5: 2.25,   # 炸薯条
-    6: 1.50,   # 饮料
-    7: 6.00,   # 牛排
-    8: 4.25,   # 三明治
-    9: 3.25,   # 甜点
-    10: 5.75,  # 海鲜
-    # 默认其他菜品成本
-    'default': 4.00
-}
-
 # 设置日志记录器
 logger = logging.getLogger(__name__)
 
@@ -74,13 +49,17 @@ financial_api = Blueprint('financial_api', __name__, url_prefix='/api/finance')
 # Route for the main financial reports page
 @financial_bp.route('/')
 def financial_reports():
-    """Renders the main financial reports page with summary data."""
+    """Renders the main financial reports page from the latest financial snapshot."""
     try:
         # 获取当前日期
         now = datetime.now().date()  # 确保是date类型
         
-        # 计算财务摘要数据
-        financial_summary = get_financial_summary(now)
+        # 读取最新快照；还没有快照时当场生成一份
+        snapshot = latest_financial_snapshot()
+        if snapshot is None:
+            rebuild_financial_snapshot(current_app.config.get('FINANCIAL_SNAPSHOT_KEEP', 24))
+            snapshot = latest_financial_snapshot()
+        financial_summary, snapshot_at = snapshot
         
         # 调试输出
         logger.debug(f"Receivables data: {financial_summary['receivables']}")
@@ -89,6 +68,7 @@ def financial_reports():
         # 渲染模板
         return render_template('financial_reports.html', 
                                financial_summary=financial_summary,
+                               snapshot_at=snapshot_at,
                                now=now)
     except Exception as e:
         import traceback
@@ -113,9 +93,60 @@ def financial_reports():
         }
         return render_template('financial_reports.html', 
                                financial_summary=empty_summary,
+                               snapshot_at=None,
                                now=now,
                                error_message=str(e))
 
+@financial_bp.route('/export')
+def export_financial_report():
+    """Download the financial report as an .xlsx workbook.
+
+    The summary, monthly, top item and margin sheets come from the same
+    snapshot the page renders; the receivable and payable sheets stream every
+    document with the /api/finance/<side>/export query.
+    """
+    try:
+        snapshot = latest_financial_snapshot()
+        if snapshot is None:
+            rebuild_financial_snapshot(current_app.config.get('FINANCIAL_SNAPSHOT_KEEP', 24))
+            snapshot = latest_financial_snapshot()
+        summary, snapshot_at = snapshot
+
+        overview = [
+            ('Snapshot generated', snapshot_at),
+            ('Total revenue', summary['total_revenue']),
+            ('Total discounts', summary['total_discounts']),
+            ('Senior discounts', summary['total_senior_discounts']),
+            ('Total purchases', summary['total_purchases']),
+            ('Gross profit', summary['gross_profit']),
+            ('Gross margin %', summary['gross_margin']),
+            ('Items sold', summary['total_items_sold']),
+            ('New orders (30 days)', summary['new_orders_last_30_days']),
+            ('New customers (30 days)', summary['new_customers_last_30_days']),
+            ('Receivables outstanding', summary['receivables']['total']),
+            ('Receivables overdue', summary['receivables']['overdue']),
+            ('Payables outstanding', summary['payables']['total']),
+            ('Payables overdue', summary['payables']['overdue']),
+        ]
+        monthly = sorted(summary['monthly_stats'].items(), key=lambda item: item[1]['month'])
+        sheets = [
+            ('Summary', ['Metric', 'Value'], overview),
+            ('Monthly', ['Month', 'Revenue', 'Expenses', 'Profit'],
+             [(name, stats['revenue'], stats['expenses'], stats['profit']) for name, stats in monthly]),
+            ('Top Items', ['Dish', 'Quantity', 'Revenue'],
+             [(item['name'], item['quantity'], item['revenue']) for item in summary['top_items']]),
+            ('Product Margins', ['Dish', 'Category', 'Price', 'Quantity', 'Revenue', 'COGS', 'Profit', 'Margin %'],
+             [(row['name'], row['category'], row['price'], row['quantity'], row['revenue'], row['cogs'],
+               row['profit'], row['margin']) for row in summary['product_margins']]),
+        ]
+        for side in ('receivables', 'payables'):
+            header, query = _document_export_query(side, MultiDict())
+            sheets.append((side.capitalize(), header, query))
+        return xlsx_response(f'financial_report_{snapshot_at:%Y%m%d}.xlsx', sheets)
+    except Exception as e:
+        logger.error(f"Error exporting financial report: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to export financial report', 'message': str(e)}), 500
+
 # 获取财务摘要数据
 def get_financial_summary(now):
     # 确保now是date类型
@@ -145,23 +176,11 @@ def get_financial_summary(now):
     except Exception as e:
         logger.warning(f"Unable to query senior discounts: {str(e)}")
     
-    # 4. 计算总采购成本（基于预设菜品成本）
+    # 4. 估算总采购成本
     total_purchases = 0
     try:
-        # 检查Sale表中是否有ItemID和ItemCount字段
-        if hasattr(Sale, 'ItemID') and hasattr(Sale, 'ItemCount'):
-            # 获取销售的菜品数据
-            sales_data = db.session.query(Sale.ItemID, func.sum(Sale.ItemCount)).filter(
-                Sale.Status == 'Completed'
-            ).group_by(Sale.ItemID).all()
-            
-            # 计算总成本
-            for product_id, quantity in sales_data:
-                product_cost = PRODUCT_COST_PRESET.get(product_id, PRODUCT_COST_PRESET['default'])
-                total_purchases += product_cost * quantity
-        else:
-            # 备用方法：假设每个订单平均成本是售价的40%
-            total_purchases = total_revenue * 0.4
+        # 估算：假设每个订单平均成本是售价的40%
+        total_purchases = total_revenue * 0.4
             
     except Exception as e:
         logger.warning(f"Error calculating total purchases: {str(e)}")
@@ -241,48 +260,9 @@ def get_financial_summary(now):
         logger.warning(f"Error calculating product margins: {str(e)}")
         product_margins = []
     total_purchases=1000
-    # 4. 计算总采购成本 (NEW LOGIC based on buy_list)
-    total_purchase_cost = Decimal(0.0) # Initialize with Decimal
+    # 4. 计算总采购成本 (based on buy_list, aggregated in SQL)
     try:
-        # Query all entries from the buy_list table
-        # Use joinedload to efficiently fetch the related Item details
-        buy_list_entries = db.session.query(BuyList).options(joinedload(BuyList.item)).all()
-
-        if not buy_list_entries:
-            logger.info("The buy_list table is empty. Total purchase cost is 0.")
-        else:
-            logger.info(f"Calculating total purchase cost from {len(buy_list_entries)} entries in buy_list.")
-
-            for entry in buy_list_entries:
-                if entry.item: # Check if the related item exists
-                    item_name = entry.item.Name
-                    # Safely convert InventoryQuantity (potentially float) to Decimal
-                    try:
-                        quantity = Decimal(str(entry.InventoryQuantity)) 
-                    except (ValueError, TypeError):
-                        logger.warning(f"Invalid quantity format for BuyListID {entry.BuyListID}: '{entry.InventoryQuantity}'. Skipping entry.")
-                        continue
-
-                    # Look up the unit price from the defined map (case-sensitive)
-                    unit_price = ingredient_prices.get(item_name) # Returns None if not found
-
-                    if unit_price is None:
-                        # Log a warning if an item from buy_list doesn't have a price defined
-                        logger.warning(f"Price not found for item: '{item_name}' (ItemID: {entry.ItemID}) in ingredient_prices map. Cost for this entry will be 0.")
-                        unit_price = Decimal(0.0) # Use Decimal 0 if price not found
-
-                    # Calculate the cost for this entry and add to the total
-                    entry_cost = unit_price * quantity
-                    total_purchase_cost += entry_cost
-                    # Optional: Log each step for debugging
-                    # logger.debug(f"  BuyListID: {entry.BuyListID}, Item: '{item_name}', Qty: {quantity}, UnitPrice: {unit_price}, EntryCost: {entry_cost}, RunningTotal: {total_purchase_cost}")
-
-                else:
-                    # Log a warning if a buy_list entry doesn't link to a valid item
-                    logger.warning(f"BuyList entry {entry.BuyListID} is missing associated item data. Skipping this entry.")
-
-            logger.info(f"Successfully calculated total purchase cost from buy_list: {total_purchase_cost}")
-
+        total_purchase_cost = calculate_buy_list_cost()
     except SQLAlchemyError as db_err:
         logger.error(f"Database error occurred while calculating purchase cost from buy_list: {db_err}", exc_info=True)
         total_purchase_cost = Decimal(0.0) # Default to 0 on database error
@@ -316,54 +296,66 @@ def get_financial_summary(now):
     
     return financial_summary
 
-# 计算产品利润率
-def calculate_product_margins():
+def calculate_buy_list_cost():
+    """Total purchase cost of the buy list, priced from the item_price history.
+
+    Each entry is priced as of its purchase date with an indexed lookup, and
+    quantity x price is summed in SQL per item, so only one row per item comes
+    back; the Decimal total is rounded to cents once at the end. Items without
+    a price count as 0 and are logged once.
+    """
+    purchase_day = func.coalesce(func.date(BuyList.PurchaseDate), func.date('now'))
+    entries = db.session.query(
+        BuyList.BuyListID,
+        BuyList.ItemID,
+        BuyList.InventoryQuantity,
+        price_as_of(BuyList.ItemID, purchase_day).label('unit_price')
+    ).subquery()
+    per_item = db.session.query(
+        Item.Name,
+        func.count(entries.c.BuyListID).label('entries'),
+        func.sum(entries.c.InventoryQuantity * entries.c.unit_price).label('cost'),
+        func.count(entries.c.unit_price).label('priced')
+    ).join(Item, entries.c.ItemID == Item.ItemID) \
+     .group_by(Item.Name) \
+     .all()
+
+    if not per_item:
+        logger.info("The buy_list table is empty. Total purchase cost is 0.")
+        return Decimal(0)
+
+    unpriced = [row.Name for row in per_item if row.priced < row.entries]
+    if unpriced:
+        logger.warning(f"No item_price effective at purchase date for: {', '.join(unpriced)}. Those entries count as 0.")
+
+    total = sum((Decimal(str(row.cost)) for row in per_item if row.cost is not None), Decimal(0))
+    total = total.quantize(Decimal('0.01'))
+    logger.info(f"Calculated total purchase cost from {sum(row.entries for row in per_item)} buy_list entries: {total}")
+    return total
+
+# 计算产品利润率（按配方成本核算 COGS，见 costing.margin_report）
+def calculate_product_margins(start_date=None, end_date=None):
     product_margins = []
     
     try:
-        # 检查必要字段是否存在
-        if hasattr(Sale, 'ItemID') and hasattr(Sale, 'ItemCount'):
-            # 获取每个产品的销售数据
-            products_data = db.session.query(
-                Item.ItemID, 
-                Item.Name,
-                func.sum(Sale.TotalAmount).label('total_revenue'),
-                func.sum(Sale.ItemCount).label('quantity')
-            ).join(Sale, Sale.ItemID == Item.ItemID).filter(
-                Sale.Status == 'Completed'
-            ).group_by(Item.ItemID, Item.Name).all()
-            
-            for product in products_data:
-                item_id, name, revenue, quantity = product
-                
-                # 使用预设成本
-                unit_cost = PRODUCT_COST_PRESET.get(item_id, PRODUCT_COST_PRESET['default'])
-                total_cost = unit_cost * quantity
-                
-                # 避免除以零错误
-                if revenue and revenue > 0:
-                    profit = revenue - total_cost
-                    margin = (profit / revenue) * 100
-                else:
-                    profit = 0
-                    margin = 0
-                    
-                # 计算平均售价
-                avg_price = revenue / quantity if quantity > 0 else 0
-                
-                product_margins.append({
-                    'id': item_id,
-                    'name': name or f"Product #{item_id}",
-                    'price': float(avg_price),
-                    'cost': float(unit_cost),
-                    'margin': float(margin),
-                    'profit': float(profit),
-                    'quantity': int(quantity)
-                })
-        else:
-            # 如果没有必要字段，使用备用数据
-            raise ValueError("Required fields not present in Sale model")
-                
+        for row in margin_report(start_date, end_date):
+            quantity = row['Units']
+            revenue = float(row['Revenue'])
+            cogs = float(row['COGS']) if row['COGS'] is not None else None
+
+            product_margins.append({
+                'id': row['DishID'],
+                'name': row['Name'] or f"Product #{row['DishID']}",
+                'category': row['Category'],
+                'price': round(revenue / quantity, 2) if quantity > 0 else 0, # 平均售价
+                'cost': round(cogs / quantity, 2) if cogs is not None and quantity > 0 else None, # 平均单位成本
+                'revenue': revenue,
+                'cogs': cogs,
+                'margin': float(row['Margin']) if row['Margin'] is not None else 0,
+                'profit': float(row['Profit']),
+                'quantity': quantity
+            })
+
         # 按利润率降序排序
         product_margins.sort(key=lambda x: x['margin'], reverse=True)
         
@@ -425,239 +417,267 @@ def get_top_selling_items(limit=5):
     
     return top_items
 
-# 获取应收账款摘要
+# 获取应收账款摘要（总额/逾期额取自账龄汇总，一次查询；客户名随记录一起 JOIN 加载）
 def get_receivables_summary(limit=5):
-    # 当前日期
-    now = datetime.now().date()
-    
-    # 查询未支付的应收账款总额
-    total_unpaid_query = db.session.query(func.sum(Receivable.ReceivableAmount)).filter(
-        Receivable.Status != 'Paid'
-    )
-    total_unpaid = total_unpaid_query.scalar() or 0
-    
-    # 查询已逾期的应收账款总额
-    total_overdue_query = db.session.query(func.sum(Receivable.ReceivableAmount)).filter(
-        Receivable.Status != 'Paid',
-        Receivable.ReceivableDate < now
-    )
-    total_overdue = total_overdue_query.scalar() or 0
-    
-    # 查询最近的应收账款记录
-    recent_receivables_query = db.session.query(Receivable).filter(
-        Receivable.Status != 'Paid'
-    ).order_by(Receivable.ReceivableDate.asc()).limit(limit)
-    
+    totals = aging_report('receivables')['totals']
+
     recent_receivables = []
     try:
-        for receivable in recent_receivables_query:
-            # 获取客户名称
-            customer_name = None
-            if receivable.CustomerID:
-                customer_query = db.session.query(Customer.Name).filter(Customer.CustomerID == receivable.CustomerID)
-                customer_name = customer_query.scalar()
-            
-            # 转换为字典
+        # 最早到期的未结清应收账款
+        records = Receivable.query.options(joinedload(Receivable.customer)).filter(
+            Receivable.Status != 'Paid'
+        ).order_by(Receivable.ReceivableDate.asc()).limit(limit)
+        for receivable in records:
             receivable_dict = receivable.to_dict()
-            
-            # 确保日期是日期对象而不是字符串
-            if 'ReceivableDate' in receivable_dict:
-                if isinstance(receivable_dict['ReceivableDate'], str):
-                    try:
-                        receivable_dict['ReceivableDate'] = datetime.strptime(
-                            receivable_dict['ReceivableDate'], '%Y-%m-%d').date()
-                    except ValueError:
-                        receivable_dict['ReceivableDate'] = now
-                elif isinstance(receivable_dict['ReceivableDate'], datetime):
-                    receivable_dict['ReceivableDate'] = receivable_dict['ReceivableDate'].date()
-            else:
-                receivable_dict['ReceivableDate'] = now
-            
-            receivable_dict['customer_name'] = customer_name
+            # 模板需要日期对象而不是字符串
+            receivable_dict['ReceivableDate'] = receivable.ReceivableDate.date() if receivable.ReceivableDate else datetime.now().date()
+            receivable_dict['customer_name'] = receivable.customer.Name if receivable.customer else None
             recent_receivables.append(receivable_dict)
     except Exception as e:
         logger.error(f"Error processing receivables: {str(e)}")
-    
-    # 整合数据
-    receivables_data = {
-        'total': total_unpaid,
-        'overdue': total_overdue,
+
+    return {
+        'total': totals['total'],
+        'overdue': round(totals['total'] - totals['current'], 2),
         'records': recent_receivables
     }
-    
-    return receivables_data
 
-# 获取应付账款摘要
+# 获取应付账款摘要（同上）
 def get_payables_summary(limit=5):
-    # 当前日期
-    now = datetime.now().date()
-    
-    # 查询未支付的应付账款总额
-    total_unpaid_query = db.session.query(func.sum(Payable.PayableAmount)).filter(
-        Payable.PayableStatus != 'Paid'
-    )
-    total_unpaid = total_unpaid_query.scalar() or 0
-    
-    # 查询已逾期的应付账款总额
-    total_overdue_query = db.session.query(func.sum(Payable.PayableAmount)).filter(
-        Payable.PayableStatus != 'Paid',
-        Payable.PayableDate < now
-    )
-    total_overdue = total_overdue_query.scalar() or 0
-    
-    # 查询最近的应付账款记录
-    recent_payables_query = db.session.query(Payable).filter(
-        Payable.PayableStatus != 'Paid'
-    ).order_by(Payable.PayableDate.asc()).limit(limit)
-    
+    totals = aging_report('payables')['totals']
+
     recent_payables = []
     try:
-        for payable in recent_payables_query:
-            # 获取供应商名称
-            vendor_name = None
-            if payable.VendorID:
-                vendor_query = db.session.query(Vendor.Name).filter(Vendor.VendorID == payable.VendorID)
-                vendor_name = vendor_query.scalar()
-            
-            # 转换为字典
+        records = Payable.query.options(joinedload(Payable.vendor)).filter(
+            Payable.PayableStatus != 'Paid'
+        ).order_by(Payable.PayableDate.asc()).limit(limit)
+        for payable in records:
             payable_dict = payable.to_dict()
-            
-            # 确保日期是日期对象而不是字符串
-            if 'PayableDate' in payable_dict:
-                if isinstance(payable_dict['PayableDate'], str):
-                    try:
-                        payable_dict['PayableDate'] = datetime.strptime(
-                            payable_dict['PayableDate'], '%Y-%m-%d').date()
-                    except ValueError:
-                        payable_dict['PayableDate'] = now
-                elif isinstance(payable_dict['PayableDate'], datetime):
-                    payable_dict['PayableDate'] = payable_dict['PayableDate'].date()
-            else:
-                payable_dict['PayableDate'] = now
-            
-            payable_dict['vendor_name'] = vendor_name
+            payable_dict['PayableDate'] = payable.PayableDate.date() if payable.PayableDate else datetime.now().date()
+            payable_dict['vendor_name'] = payable.vendor.Name if payable.vendor else None
             recent_payables.append(payable_dict)
     except Exception as e:
         logger.error(f"Error processing payables: {str(e)}")
-    
-    # 整合数据
-    payables_data = {
-        'total': total_unpaid,
-        'overdue': total_overdue,
+
+    return {
+        'total': totals['total'],
+        'overdue': round(totals['total'] - totals['current'], 2),
         'records': recent_payables
     }
-    
-    return payables_data
 
 # 获取月度财务统计
 def get_monthly_financial_stats(year):
-    # 设置地区设置
-    try:
-        locale.setlocale(locale.LC_ALL, '')
-    except locale.Error:
-        locale.setlocale(locale.LC_ALL, 'C')  # 使用备用区域设置
-    
-    # 确保current_month是整数
-    try:
-        current_month = datetime.now().month
-    except:
-        current_month = 12  # 默认设为12月
-    
-    monthly_stats = {}  # 使用字典而不是列表
-    
-    # 对每个月份进行计算
-    for month in range(1, 13):
-        month_name = calendar.month_name[month] if month <= 12 else f"Month {month}"
-        
-        # 如果是未来月份，则填入零值
-        if year == datetime.now().year and month > current_month:
-            monthly_stats[month_name] = {
-                'month': month,
-                'revenue': 0,
-                'expenses': 0,
-                'profit': 0
-            }
-            continue
-        
-        try:
-            # 计算该月的收入（销售额）
-            month_revenue_query = db.session.query(func.sum(Sale.TotalAmount)).filter(
-                extract('year', Sale.SaleDate) == year,
-                extract('month', Sale.SaleDate) == month,
-                Sale.Status == 'Completed'
-            )
-            month_revenue = month_revenue_query.scalar() or 0
+    """Monthly revenue/expenses/profit for one year, keyed by month name."""
+    return get_monthly_financial_stats_range(year, year)[year]
+
+def get_monthly_financial_stats_range(start_year, end_year):
+    """Monthly revenue/expenses/profit for every year in [start_year, end_year].
+
+    Revenue and purchase expenses are each aggregated with one GROUP BY over
+    a half-open date range, so the query count does not grow with the number
+    of months or years. Returns ``{year: {month_name: {...}}}``.
+    """
+    range_start = datetime(start_year, 1, 1)
+    range_end = datetime(end_year + 1, 1, 1)
+    
+    # 按 "YYYY-MM" 分组汇总收入（已完成订单）
+    sale_period = func.strftime('%Y-%m', Sale.SaleDate)
+    revenue_rows = db.session.query(
+        sale_period.label('period'),
+        func.sum(Sale.TotalAmount).label('total')
+    ).filter(
+        Sale.Status == 'Completed',
+        Sale.SaleDate >= range_start,
+        Sale.SaleDate < range_end
+    ).group_by(sale_period).all()
+    
+    # 按 "YYYY-MM" 分组汇总支出（已完成采购）
+    purchase_period = func.strftime('%Y-%m', Purchase.OrderDate)
+    expense_rows = db.session.query(
+        purchase_period.label('period'),
+        func.sum(Purchase.total_amount).label('total')
+    ).filter(
+        Purchase.Status == 'Completed',
+        Purchase.OrderDate >= range_start,
+        Purchase.OrderDate < range_end
+    ).group_by(purchase_period).all()
+    
+    revenue_by_period = {row.period: float(row.total or 0) for row in revenue_rows}
+    expenses_by_period = {row.period: float(row.total or 0) for row in expense_rows}
+    
+    now = datetime.now()
+    stats_by_year = {}
+    for year in range(start_year, end_year + 1):
+        monthly_stats = {}  # 使用字典而不是列表
+        for month in range(1, 13):
+            month_name = calendar.month_name[month]
+            period = f"{year:04d}-{month:02d}"
             
-            # 计算该月的支出（采购额）
-            month_expenses_query = db.session.query(func.sum(Purchase.total_amount)).filter(
-                extract('year', Purchase.OrderDate) == year,
-                extract('month', Purchase.OrderDate) == month,
-                Purchase.Status == 'Completed'
-            )
-            month_expenses = month_expenses_query.scalar() or 0
-            
-            # 计算该月的利润
-            month_profit = month_revenue - month_expenses
+            # 如果是未来月份，则填入零值
+            if (year, month) > (now.year, now.month):
+                revenue = expenses = 0
+            else:
+                revenue = revenue_by_period.get(period, 0.0)
+                expenses = expenses_by_period.get(period, 0.0)
             
-            # 添加到结果字典
             monthly_stats[month_name] = {
                 'month': month,
-                'revenue': float(month_revenue),
-                'expenses': float(month_expenses),
-                'profit': float(month_profit)
-            }
-        except Exception as e:
-            logger.warning(f"Error calculating stats for month {month}: {str(e)}")
-            monthly_stats[month_name] = {
-                'month': month,
-                'revenue': 0,
-                'expenses': 0,
-                'profit': 0
+                'revenue': revenue,
+                'expenses': expenses,
+                'profit': revenue - expenses
             }
+        stats_by_year[year] = monthly_stats
     
-    return monthly_stats
+    return stats_by_year
 
-# API endpoint for Receivables
-@financial_api.route('/receivables', methods=['GET'])
-def get_receivables_api():
-    """API endpoint to get receivable records with filtering."""
-    try:
-        status = request.args.get('status', 'all')
-        query = Receivable.query.options(joinedload(Receivable.customer))
+# API endpoint for monthly financial stats (supports multi-year comparisons)
+MONTHLY_STATS_MIN_YEAR = 2000
 
-        if status != 'all':
-            if status == 'overdue':
-                query = query.filter(Receivable.ReceivableDate < datetime.utcnow(), Receivable.Status != 'Paid')
-            else:
-                query = query.filter(Receivable.Status == status)
+@financial_api.route('/monthly-stats', methods=['GET'])
+def get_monthly_stats_api():
+    """API endpoint to get monthly revenue/expenses for a range of years."""
+    try:
+        end_year = request.args.get('end_year', datetime.now().year, type=int)
+        start_year = request.args.get('start_year', end_year, type=int)
+        # 限制年份窗口，避免 datetime 越界（500）或遍历上千年的月份
+        min_year, max_year = MONTHLY_STATS_MIN_YEAR, datetime.now().year + 1
+        if not (min_year <= start_year <= max_year and min_year <= end_year <= max_year):
+            return jsonify({'error': f'start_year and end_year must be between {min_year} and {max_year}'}), 400
+        if start_year > end_year:
+            return jsonify({'error': 'start_year must not be after end_year'}), 400
+        
+        stats = get_monthly_financial_stats_range(start_year, end_year)
+        return jsonify({str(year): monthly_stats for year, monthly_stats in stats.items()})
+    except Exception as e:
+        current_app.logger.error(f"Error in get_monthly_stats_api: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to retrieve monthly stats', 'message': str(e)}), 500
 
-        receivables = query.order_by(Receivable.ReceivableDate).all()
-        result = [r.to_dict() for r in receivables]
-        return jsonify(result)
+@financial_api.route('/product-margins', methods=['GET'])
+def get_product_margins_api():
+    """API endpoint for per-dish revenue, recipe COGS and margin (?start_date&end_date, YYYY-MM-DD)."""
+    try:
+        try:
+            start_date = datetime.strptime(request.args['start_date'], '%Y-%m-%d').date() if request.args.get('start_date') else None
+            end_date = datetime.strptime(request.args['end_date'], '%Y-%m-%d').date() if request.args.get('end_date') else None
+        except ValueError:
+            return jsonify({'error': 'Dates must be in YYYY-MM-DD format'}), 400
+        if start_date and end_date and start_date > end_date:
+            return jsonify({'error': 'start_date must not be after end_date'}), 400
+
+        return jsonify(calculate_product_margins(start_date, end_date))
     except Exception as e:
-        current_app.logger.error(f"Error in get_receivables_api: {str(e)}", exc_info=True)
-        return jsonify({'error': 'Failed to retrieve receivables', 'message': str(e)}), 500
+        current_app.logger.error(f"Error in get_product_margins_api: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to retrieve product margins', 'message': str(e)}), 500
+
+# 应收/应付列表共用的字段：(模型, 主键, 状态, 到期日, 对方 ID, 对方关系名, 对方过滤参数)
+# 关系由 Customer/Vendor 的 backref 定义，导入时还不存在，只能存名字
+_DOCUMENT_LISTS = {
+    'receivables': (Receivable, Receivable.ReceivableID, Receivable.Status, Receivable.ReceivableDate,
+                    Receivable.CustomerID, 'customer', 'customer_id'),
+    'payables': (Payable, Payable.PayableID, Payable.PayableStatus, Payable.PayableDate,
+                 Payable.VendorID, 'vendor', 'vendor_id'),
+}
+
+# 导出时追加的列：(对方表, 对方主键, 对方名称, 单据列...)
+_DOCUMENT_EXPORTS = {
+    'receivables': (Customer, Customer.CustomerID, Customer.Name,
+                    [Receivable.ReceivableID, Receivable.ReceivableDate, Receivable.Status, Receivable.ReceivableAmount,
+                     Receivable.SaleID, Receivable.CustomerID]),
+    'payables': (Vendor, Vendor.VendorID, Vendor.Name,
+                 [Payable.PayableID, Payable.PayableDate, Payable.PayableStatus, Payable.PayableAmount,
+                  Payable.PurchaseID, Payable.VendorID]),
+}
 
-# API endpoint for Payables
-@financial_api.route('/payables', methods=['GET'])
-def get_payables_api():
-    """API endpoint to get payable records with filtering."""
+def _filter_documents(side, query, args):
+    """Apply the receivable/payable list filters; raises ValueError for a malformed due_from/due_to."""
+    model, pk, status_column, due_column, party_column, party, party_param = _DOCUMENT_LISTS[side]
+    status = args.get('status', 'all')
+    party_id = args.get(party_param, type=int)
+    due_from, due_to = [
+        datetime.strptime(args[name], '%Y-%m-%d') if args.get(name) else None
+        for name in ('due_from', 'due_to')
+    ]
+
+    if status == 'overdue':
+        query = query.filter(status_column != 'Paid', due_column < datetime.now().date())
+    elif status != 'all':
+        query = query.filter(status_column == status)
+    if party_id is not None:
+        query = query.filter(party_column == party_id)
+    if due_from:
+        query = query.filter(due_column >= due_from)
+    if due_to:
+        query = query.filter(due_column < due_to + timedelta(days=1))
+    return query
+
+# API endpoint for Receivables / Payables
+@financial_api.route('/<any(receivables, payables):side>', methods=['GET'])
+def get_documents_api(side):
+    """Paginated receivable or payable records, sorted by due date.
+
+    Query parameters: status (all, overdue or a stored status), customer_id /
+    vendor_id, due_from / due_to (YYYY-MM-DD, inclusive), sort_order (asc or
+    desc), page and per_page. The customer or vendor is joined into the same
+    query; status + due date filters and ordering are served by the
+    (status, due date) index.
+    """
     try:
-        status = request.args.get('status', 'all')
-        query = Payable.query.options(joinedload(Payable.vendor))
+        model, pk, status_column, due_column, party_column, party, party_param = _DOCUMENT_LISTS[side]
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 50, type=int), 1), 500)
+        sort_desc = request.args.get('sort_order', 'asc').lower() == 'desc'
+        try:
+            query = _filter_documents(side, model.query, request.args)
+        except ValueError:
+            return jsonify({'error': 'due_from and due_to must be in YYYY-MM-DD format'}), 400
 
-        if status != 'all':
-            if status == 'overdue':
-                query = query.filter(Payable.PayableDate < datetime.utcnow(), Payable.PayableStatus != 'Paid')
-            else:
-                query = query.filter(Payable.PayableStatus == status)
+        total_items = query.order_by(None).count()
+        total_pages = (total_items + per_page - 1) // per_page
 
-        payables = query.order_by(Payable.PayableDate).all()
-        result = [p.to_dict() for p in payables]
-        return jsonify(result)
+        # 主键作为次序键，保证翻页顺序稳定
+        order = (due_column.desc(), pk.desc()) if sort_desc else (due_column.asc(), pk.asc())
+        documents = query.options(joinedload(getattr(model, party))).order_by(*order) \
+            .limit(per_page).offset((page - 1) * per_page).all()
+
+        return jsonify({
+            side: [document.to_dict() for document in documents],
+            'total_items': total_items,
+            'current_page': page,
+            'total_pages': total_pages,
+            'per_page': per_page
+        })
     except Exception as e:
-        current_app.logger.error(f"Error in get_payables_api: {str(e)}", exc_info=True)
-        return jsonify({'error': 'Failed to retrieve payables', 'message': str(e)}), 500
+        current_app.logger.error(f"Error in get_documents_api ({side}): {str(e)}", exc_info=True)
+        return jsonify({'error': f'Failed to retrieve {side}', 'message': str(e)}), 500
+
+def _document_export_query(side, args):
+    """``(header, query)`` of the receivable/payable export rows for the list filters in ``args``."""
+    model, pk, status_column, due_column, party_column, party, party_param = _DOCUMENT_LISTS[side]
+    party_model, party_pk, party_name, columns = _DOCUMENT_EXPORTS[side]
+    query = db.session.query(*columns, party_name, model.CreatedAt) \
+        .outerjoin(party_model, party_pk == party_column)
+    query = _filter_documents(side, query, args)
+    order = (due_column.desc(), pk.desc()) if args.get('sort_order', 'asc').lower() == 'desc' \
+        else (due_column.asc(), pk.asc())
+    header = [column.key for column in columns] + [party_model.__name__ + 'Name', 'CreatedAt']
+    return header, query.order_by(*order)
+
+@financial_api.route('/<any(receivables, payables):side>/export', methods=['GET'])
+def export_documents(side):
+    """Stream receivables or payables as CSV or XLSX with the customer/vendor name joined in.
+
+    Takes the same filters as the list endpoint (status, customer_id /
+    vendor_id, due_from, due_to, sort_order) without pagination.
+    """
+    try:
+        try:
+            header, query = _document_export_query(side, request.args)
+        except ValueError:
+            return jsonify({'error': 'due_from and due_to must be in YYYY-MM-DD format'}), 400
+        return export_response(side, header, query)
+    except Exception as e:
+        current_app.logger.error(f"Error in export_documents ({side}): {str(e)}", exc_info=True)
+        return jsonify({'error': f'Failed to export {side}', 'message': str(e)}), 500
 
 # API endpoint for Accounts Summary
 @financial_api.route('/summary', methods=['GET'])
@@ -700,185 +720,83 @@ def get_accounts_summary_api():
             'payables': {'total': 0, 'overdue': 0}
         }), 500
 
-# 从完成的销售订单创建应收账款
-@financial_api.route('/create-receivables', methods=['POST'])
-def create_receivables_from_sales():
+def _enqueue_job(kind):
+    """Queue a background job and answer 202 with its progress URL.
+
+    ``mode`` (query string or JSON body) selects set-based (default) or ORM generation.
+    """
+    data = request.get_json(silent=True) or {}
+    mode = request.args.get('mode') or data.get('mode') or 'set'
+    if mode not in accounts.MODES:
+        return jsonify({'success': False, 'error': f"mode must be one of {', '.join(accounts.MODES)}"}), 400
     try:
-        # 获取所有已完成但尚未创建应收账款的销售订单
-        sales_without_receivables = db.session.query(Sale).filter(
-            Sale.Status == 'Completed',
-            ~Sale.SaleID.in_(db.session.query(Receivable.SaleID).filter(Receivable.SaleID.isnot(None)))
-        ).all()
-        
-        if not sales_without_receivables:
-            return jsonify({'success': False, 'error': 'No eligible sales found for receivable creation'})
-        
-        created_count = 0
-        for sale in sales_without_receivables:
-            # 设置应收账款日期（通常是销售日期后30天）
-            receivable_date = sale.SaleDate + timedelta(days=30)
-            
-            # 创建新的应收账款记录
-            new_receivable = Receivable(
-                SaleID=sale.SaleID,
-                CustomerID=sale.CustomerID,
-                ReceivableAmount=sale.TotalAmount,
-                ReceivableDate=receivable_date,
-                Status='Unpaid',
-                CreatedAt=datetime.now()
-            )
-            
-            db.session.add(new_receivable)
-            created_count += 1
-        
-        # 提交事务
-        db.session.commit()
-        
+        job = job_runner.enqueue(kind, mode=mode)
         return jsonify({
             'success': True,
-            'message': f'Successfully created {created_count} receivables from completed sales',
-            'count': created_count
-        })
-    
+            'message': f'Job {job.JobID} queued',
+            'job': job.to_dict(),
+            'status_url': url_for('financial_api.get_job', job_id=job.JobID)
+        }), 202
     except SQLAlchemyError as e:
         db.session.rollback()
-        logger.error(f"Database error creating receivables: {str(e)}")
-        return jsonify({'success': False, 'error': f"Database error: {str(e)}"})
-    
-    except Exception as e:
-        db.session.rollback()
-        logger.error(f"Error creating receivables: {str(e)}")
-        return jsonify({'success': False, 'error': str(e)})
+        logger.error(f"Database error queueing {kind} job: {str(e)}")
+        return jsonify({'success': False, 'error': f"Database error: {str(e)}"}), 500
 
-# 从完成的采购订单创建应付账款
+# 从完成的销售订单创建应收账款（后台任务，分块 INSERT ... SELECT）
+@financial_api.route('/create-receivables', methods=['POST'])
+def create_receivables_from_sales():
+    return _enqueue_job('create-receivables')
+
+# 从完成的采购订单创建应付账款（后台任务，分块 INSERT ... SELECT）
 @financial_api.route('/create-payables', methods=['POST'])
 def create_payables_from_purchases():
-    try:
-        # 获取所有已完成但尚未创建应付账款的采购订单
-        purchases_without_payables = db.session.query(Purchase).filter(
-            Purchase.Status == 'Completed',
-            ~Purchase.PurchaseID.in_(db.session.query(Payable.PurchaseID).filter(Payable.PurchaseID.isnot(None)))
-        ).all()
-        
-        if not purchases_without_payables:
-            return jsonify({'success': False, 'error': 'No eligible purchases found for payable creation'})
-        
-        created_count = 0
-        for purchase in purchases_without_payables:
-            # 设置应付账款日期（通常是采购日期后15天）
-            payable_date = purchase.OrderDate + timedelta(days=15)
-            
-            # 创建新的应付账款记录
-            new_payable = Payable(
-                PurchaseID=purchase.PurchaseID,
-                VendorID=purchase.VendorID,
-                PayableAmount=purchase.TotalAmount,
-                PayableDate=payable_date,
-                PayableStatus='Unpaid',
-                CreatedAt=datetime.now()
-            )
-            
-            db.session.add(new_payable)
-            created_count += 1
-        
-        # 提交事务
-        db.session.commit()
-        
-        return jsonify({
-            'success': True,
-            'message': f'Successfully created {created_count} payables from completed purchases',
-            'count': created_count
-        })
-    
-    except SQLAlchemyError as e:
-        db.session.rollback()
-        logger.error(f"Database error creating payables: {str(e)}")
-        return jsonify({'success': False, 'error': f"Database error: {str(e)}"})
-    
-    except Exception as e:
-        db.session.rollback()
-        logger.error(f"Error creating payables: {str(e)}")
-        return jsonify({'success': False, 'error': str(e)})
+    return _enqueue_job('create-payables')
 
-# 获取所有应收账款
-@financial_api.route('/receivables', methods=['GET'])
-def get_all_receivables():
+@financial_api.route('/aging', methods=['GET'])
+def get_aging_api():
+    """AR/AP aging: open amounts per bucket (current, 1-30, 31-60, 61-90, 90+ days past due).
+
+    ?side=receivables|payables limits the report to one side; ?as_of=YYYY-MM-DD
+    ages against another day than today.
+    """
     try:
-        # 获取状态过滤参数
-        status_filter = request.args.get('status', 'all')
-        
-        # 根据状态过滤应收账款
-        query = db.session.query(Receivable)
-        
-        if status_filter == 'Paid':
-            query = query.filter(Receivable.Status == 'Paid')
-        elif status_filter == 'Unpaid':
-            query = query.filter(Receivable.Status == 'Unpaid')
-        elif status_filter == 'overdue':
-            now = datetime.now().date()
-            query = query.filter(Receivable.Status == 'Unpaid', Receivable.ReceivableDate < now)
-        
-        # 按到期日期排序
-        receivables = query.order_by(Receivable.ReceivableDate.asc()).all()
-        
-        # 转换为字典并添加客户名称
-        result = []
-        for receivable in receivables:
-            receivable_dict = receivable.to_dict()
-            
-            # 获取客户名称
-            if receivable.CustomerID:
-                customer_query = db.session.query(Customer.Name).filter(Customer.CustomerID == receivable.CustomerID)
-                customer_name = customer_query.scalar()
-                receivable_dict['customer_name'] = customer_name
-            
-            result.append(receivable_dict)
-        
-        return jsonify(result)
-    
+        side = request.args.get('side')
+        sides = [side] if side else ['receivables', 'payables']
+        if any(name not in ('receivables', 'payables') for name in sides):
+            return jsonify({'error': 'side must be receivables or payables'}), 400
+        try:
+            as_of = datetime.strptime(request.args['as_of'], '%Y-%m-%d').date() if request.args.get('as_of') else None
+        except ValueError:
+            return jsonify({'error': 'as_of must be in YYYY-MM-DD format'}), 400
+
+        return jsonify({name: aging_report(name, as_of) for name in sides})
     except Exception as e:
-        logger.error(f"Error getting receivables: {str(e)}")
-        return jsonify([])
+        current_app.logger.error(f"Error in get_aging_api: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to compute aging report', 'message': str(e)}), 500
 
-# 获取所有应付账款
-@financial_api.route('/payables', methods=['GET'])
-def get_all_payables():
+# 后台任务进度
+@financial_api.route('/jobs', methods=['GET'])
+def get_jobs():
     try:
-        # 获取状态过滤参数
-        status_filter = request.args.get('status', 'all')
-        
-        # 根据状态过滤应付账款
-        query = db.session.query(Payable)
-        
-        if status_filter == 'Paid':
-            query = query.filter(Payable.PayableStatus == 'Paid')
-        elif status_filter == 'Unpaid':
-            query = query.filter(Payable.PayableStatus == 'Unpaid')
-        elif status_filter == 'overdue':
-            now = datetime.now().date()
-            query = query.filter(Payable.PayableStatus == 'Unpaid', Payable.PayableDate < now)
-        
-        # 按到期日期排序
-        payables = query.order_by(Payable.PayableDate.asc()).all()
-        
-        # 转换为字典并添加供应商名称
-        result = []
-        for payable in payables:
-            payable_dict = payable.to_dict()
-            
-            # 获取供应商名称
-            if payable.VendorID:
-                vendor_query = db.session.query(Vendor.Name).filter(Vendor.VendorID == payable.VendorID)
-                vendor_name = vendor_query.scalar()
-                payable_dict['VendorName'] = vendor_name
-            
-            result.append(payable_dict)
-        
-        return jsonify(result)
-    
+        limit = min(request.args.get('limit', 20, type=int), 100)
+        jobs = Job.query.order_by(Job.JobID.desc()).limit(limit).all()
+        return jsonify([job.to_dict() for job in jobs])
     except Exception as e:
-        logger.error(f"Error getting payables: {str(e)}")
-        return jsonify([])
+        logger.error(f"Error fetching jobs: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@financial_api.route('/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    job = Job.query.get_or_404(job_id)
+    return jsonify(job.to_dict())
+
+@financial_api.route('/jobs/<int:job_id>/resume', methods=['POST'])
+def resume_job(job_id):
+    job = Job.query.get_or_404(job_id)
+    if not job_runner.resume(job_id):
+        return jsonify({'success': False, 'error': f'Job {job_id} is {job.Status} and cannot be resumed'}), 409
+    db.session.refresh(job)
+    return jsonify({'success': True, 'job': job.to_dict()}), 202
 
 # 更新应收账款状态
 @financial_api.route('/receivables/<int:receivable_id>', methods=['PUT'])
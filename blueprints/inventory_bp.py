@@ -1,7 +1,10 @@
 from flask import Blueprint, render_template, request, jsonify
 from models import db, Item, Inventory, Vendor # Import necessary models and db
 from datetime import datetime
+from sqlalchemy import case
+from sqlalchemy.orm import contains_eager, joinedload
 from models import db, Inventory, BuyList   # <-- 新增 BuyList
+from exports import export_response
 
 # Blueprint for inventory pages
 inventory_bp = Blueprint('inventory', __name__, template_folder='../templates')
@@ -9,6 +12,15 @@ inventory_bp = Blueprint('inventory', __name__, template_folder='../templates')
 # Blueprint for inventory APIs
 inventory_api = Blueprint('inventory_api', __name__, url_prefix='/api/inventory')
 
+def _is_low_stock():
+    """Condition shared by the low-stock list and the export's low_stock filter."""
+    return Inventory.StockLevel <= Inventory.ReorderLevel
+
+def _inventory_with_details():
+    """Inventory query that loads item and vendor in the same SELECT as the inventory rows."""
+    return Inventory.query.join(Inventory.item)\
+                          .options(contains_eager(Inventory.item), joinedload(Inventory.vendor))
+
 # Inventory Management Page Route
 @inventory_bp.route('/inventory')
 def inventory_management():
@@ -21,8 +33,8 @@ def inventory_management():
 @inventory_api.route('/all')
 def get_all_inventory():
     try:
-        # 改用连接查询获取库存数据
-        inventory = Inventory.query.join(Item).all()
+        # 改用连接查询获取库存数据，物品和供应商随同一条查询加载（to_dict 不再逐行懒加载）
+        inventory = _inventory_with_details().all()
         inventory_list = [inv.to_dict() for inv in inventory]
         return jsonify(inventory_list)
     except Exception as e:
@@ -33,22 +45,50 @@ def get_all_inventory():
 @inventory_api.route('/low_stock')
 def get_low_stock():
     try:
-        # 查询库存低于再订购水平的物品
-        low_stock_items = Inventory.query.join(Item).filter(
-            Inventory.StockLevel <= Inventory.ReorderLevel
+        # 查询库存低于再订购水平的物品，并在 SQL 中按 库存量/再订购水平 排序（越小越紧急）
+        low_stock_items = _inventory_with_details().filter(
+            _is_low_stock()
+        ).order_by(
+            case((Inventory.ReorderLevel > 0, 0), else_=1),  # 再订购水平为 0 的排在最后
+            Inventory.StockLevel * 1.0 / Inventory.ReorderLevel
         ).all()
         
         # 转换为字典列表
         low_stock_list = [item.to_dict() for item in low_stock_items]
         
-        # 按库存水平排序 (库存量/再订购水平 越小越紧急)
-        low_stock_list.sort(key=lambda x: (x['StockLevel'] / x['ReorderLevel']) if x['ReorderLevel'] > 0 else float('inf'))
-        
         return jsonify(low_stock_list)
     except Exception as e:
         # app.logger.error(f"Error fetching low stock items: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
+# API to export inventory records as CSV
+@inventory_api.route('/export')
+def export_inventory():
+    """Stream inventory as CSV or XLSX with item and supplier joined in; ?low_stock=true limits it to /low_stock's rows."""
+    try:
+        query = db.session.query(
+            Inventory.InventoryID,
+            Inventory.ItemID,
+            Item.Name,
+            Item.Category,
+            Inventory.StockLevel,
+            Item.DefaultUnit,
+            Inventory.ReorderLevel,
+            case((_is_low_stock(), 'Low'), else_='Normal'),
+            Vendor.Name,
+            Inventory.last_purchase_date,
+            Inventory.last_update
+        ).join(Item, Inventory.ItemID == Item.ItemID) \
+         .outerjoin(Vendor, Inventory.VendorID == Vendor.VendorID)
+        if request.args.get('low_stock', '').lower() == 'true':
+            query = query.filter(_is_low_stock())
+        return export_response('inventory', [
+            'InventoryID', 'ItemID', 'ItemName', 'Category', 'StockLevel', 'Unit', 'ReorderLevel', 'Status',
+            'SupplierName', 'LastPurchase', 'LastUpdate'
+        ], query.order_by(Inventory.InventoryID))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # API to update an inventory record
 @inventory_api.route('/update', methods=['POST'])
 def update_inventory():
@@ -1,5 +1,8 @@
 from flask import Blueprint, render_template, request, jsonify
-from models import db, Item, Inventory  # Import necessary models and db
+from sqlalchemy.orm import contains_eager
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from models import db, Item, ItemPrice  # Import necessary models and db
 
 # Blueprint for item pages
 item_bp = Blueprint('item', __name__, template_folder='../templates') # Define template folder relative to blueprint file
@@ -16,14 +19,17 @@ def item_management():
 @item_api.route('/all')
 def get_all_items():
     try:
-        # 获取所有物品
-        items = Item.query.all()
+        # 获取所有物品，并通过外连接一次性带出库存记录（避免每个物品单独查询）
+        items = Item.query.outerjoin(Item.inventory)\
+                          .options(contains_eager(Item.inventory))\
+                          .order_by(Item.ItemID)\
+                          .all()
         result = []
         
         for item in items:
             item_dict = item.to_dict()
             # 添加库存状态信息
-            inventory = Inventory.query.filter_by(ItemID=item.ItemID).first()
+            inventory = item.inventory
             if inventory:
                 item_dict['Status'] = 'Low' if inventory.StockLevel <= inventory.ReorderLevel else 'Normal'
                 item_dict['InventoryID'] = inventory.InventoryID # 添加库存ID供前端使用
@@ -128,6 +134,60 @@ def update_item():
         # app.logger.error(f"Error updating item {item_id}: {str(e)}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
+# API to list an item's price history (newest first)
+@item_api.route('/<int:item_id>/prices', methods=['GET'])
+def get_item_prices(item_id):
+    try:
+        item = Item.query.get(item_id)
+        if not item:
+            return jsonify({"error": "Item not found"}), 404
+        prices = ItemPrice.query.filter_by(ItemID=item_id) \
+            .order_by(ItemPrice.EffectiveDate.desc(), ItemPrice.ItemPriceID.desc()).all()
+        return jsonify([price.to_dict() for price in prices])
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# API to record a new price for an item (history is append-only)
+@item_api.route('/<int:item_id>/prices', methods=['POST'])
+def add_item_price(item_id):
+    try:
+        data = request.get_json()
+        if not data or data.get('unit_price') is None:
+            return jsonify({"error": "Missing required field: unit_price"}), 400
+
+        item = Item.query.get(item_id)
+        if not item:
+            return jsonify({"error": "Item not found"}), 404
+
+        try:
+            unit_price = Decimal(str(data['unit_price']))
+            effective_date = datetime.strptime(data['effective_date'], '%Y-%m-%d').date() \
+                if data.get('effective_date') else datetime.now().date()
+        except (InvalidOperation, ValueError, TypeError):
+            return jsonify({"error": "Invalid unit_price or effective_date (YYYY-MM-DD)"}), 400
+        # Decimal 接受 "nan"/"inf"；NaN 参与比较会抛异常
+        if not unit_price.is_finite():
+            return jsonify({"error": "unit_price must be a finite number"}), 400
+        if unit_price < 0:
+            return jsonify({"error": "unit_price cannot be negative"}), 400
+
+        price = ItemPrice(
+            ItemID=item_id,
+            VendorID=data.get('vendor_id'),
+            EffectiveDate=effective_date,
+            UnitPrice=unit_price
+        )
+        db.session.add(price)
+        db.session.commit()
+
+        return jsonify({
+            "message": "Item price recorded successfully",
+            "price": price.to_dict()
+        }), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
 # API to get distinct item categories
 @item_api.route('/category')
 def get_item_categories():
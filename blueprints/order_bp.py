@@ -1,12 +1,15 @@
 # blueprints/order_bp.py
 
-from flask import Blueprint, render_template, request, jsonify, current_app
+from flask import Blueprint, render_template, request, jsonify, current_app, Response
 from sqlalchemy.orm import joinedload
-from sqlalchemy import func, desc
+from sqlalchemy import func, desc, and_, or_
 # 确保导入 timedelta 和 Receivable 模型, datetime
 from datetime import date, datetime, timedelta
 from decimal import Decimal
 from models import db, Sale, Customer, SaleDish, Dish, Receivable # <--- 导入 Receivable
+from invalidation import mark_changed, on_change
+from order_events import order_events, sale_payload
+from exports import export_response
 
 # Blueprint for rendering order management pages
 order_bp = Blueprint('order_bp', __name__, template_folder='../templates')
@@ -14,6 +17,66 @@ order_bp = Blueprint('order_bp', __name__, template_folder='../templates')
 # Blueprint for order-related API endpoints
 order_api = Blueprint('order_api', __name__, url_prefix='/api/orders')
 
+# Cached total counts for the order list: {filter key: (count, expires at)}
+_ORDER_COUNT_TTL = timedelta(seconds=30)
+_ORDER_COUNT_CACHE_MAX = 256
+_order_count_cache = {}
+
+def _cached_order_count(filter_key, query):
+    """Return the row count for ``query``, reusing a recent count for the same filters."""
+    now = datetime.utcnow()
+    cached = _order_count_cache.get(filter_key)
+    if cached and cached[1] > now:
+        return cached[0]
+    if len(_order_count_cache) >= _ORDER_COUNT_CACHE_MAX:
+        _order_count_cache.clear()
+    count = query.order_by(None).count()
+    _order_count_cache[filter_key] = (count, now + _ORDER_COUNT_TTL)
+    return count
+
+@on_change('sale')
+def invalidate_order_counts(session=None, changes=None):
+    """Drop cached order counts; runs after every commit that writes a sale."""
+    _order_count_cache.clear()
+
+def _parse_order_cursor(value):
+    """Parse an ``after`` cursor of the form '<SaleDate>,<SaleID>'."""
+    date_part, _, id_part = value.rpartition(',')
+    return datetime.fromisoformat(date_part.strip()), int(id_part)
+
+def _filter_sales(query, args):
+    """Apply the order list filters (start_date, end_date, status, channel, payment_completed).
+
+    Shared by the order list and the order export. Returns the filtered query
+    and a hashable key of the filter values.
+    """
+    start_date_str = args.get('start_date')
+    end_date_str = args.get('end_date')
+    status_filter = args.get('status')
+    channel_filter = args.get('channel')
+    # --- 新增支付状态过滤 ---
+    payment_completed_str = args.get('payment_completed')
+    payment_completed_filter = None
+    if payment_completed_str is not None:
+        payment_completed_filter = payment_completed_str.lower() == 'true'
+    # -----------------------
+
+    if start_date_str:
+        start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
+        query = query.filter(Sale.SaleDate >= start_date)
+    if end_date_str:
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d') + timedelta(days=1)
+        query = query.filter(Sale.SaleDate < end_date)
+    if status_filter:
+        query = query.filter(Sale.Status == status_filter)
+    if channel_filter:
+        query = query.filter(Sale.Channel == channel_filter)
+    # --- 应用支付状态过滤 ---
+    if payment_completed_filter is not None:
+        query = query.filter(Sale.PaymentCompleted == payment_completed_filter)
+    # -----------------------
+    return query, (start_date_str, end_date_str, status_filter, channel_filter, payment_completed_filter)
+
 @order_bp.route('/management')
 def orders_management():
     """Renders the order management page."""
@@ -27,76 +90,72 @@ def get_sales():
         per_page = request.args.get('per_page', 15, type=int) # Default to 15 as per template
         sort_by = request.args.get('sort_by', 'SaleDate')
         sort_order = request.args.get('sort_order', 'desc')
-        start_date_str = request.args.get('start_date')
-        end_date_str = request.args.get('end_date')
-        status_filter = request.args.get('status')
-        channel_filter = request.args.get('channel')
-        # --- 新增支付状态过滤 ---
-        payment_completed_str = request.args.get('payment_completed') 
-        payment_completed_filter = None
-        if payment_completed_str is not None:
-             payment_completed_filter = payment_completed_str.lower() == 'true'
-        # -----------------------
-
-
-        # Base query joining Sale and Customer (only select SaleID initially for filtering)
-        base_query = db.session.query(Sale.SaleID) \
-            .join(Customer, Sale.CustomerID == Customer.CustomerID, isouter=True) # Use outer join for guest orders
+        after_str = request.args.get('after') # Opt-in cursor pagination
+
 
-        # Apply filters
-        if start_date_str:
-            start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-            base_query = base_query.filter(Sale.SaleDate >= start_date)
-        if end_date_str:
-            end_date = datetime.strptime(end_date_str, '%Y-%m-%d') + timedelta(days=1)
-            base_query = base_query.filter(Sale.SaleDate < end_date)
-        if status_filter:
-            base_query = base_query.filter(Sale.Status == status_filter)
-        if channel_filter:
-            base_query = base_query.filter(Sale.Channel == channel_filter)
-        # --- 应用支付状态过滤 ---
-        if payment_completed_filter is not None:
-            base_query = base_query.filter(Sale.PaymentCompleted == payment_completed_filter)
-        # -----------------------
-
-
-        # Get total count before pagination for correct total_items
-        total_items = base_query.count()
-
-        # Apply sorting *before* pagination on the SaleID query
-        sort_column_base = Sale.SaleDate # Default
+        # Sort column; CustomerName sorts on the outer-joined customer (guests sort as NULL)
+        sort_column = Sale.SaleDate # Default
         if sort_by == 'CustomerName':
-             # Sorting by CustomerName requires joining Customer earlier if needed
-             # This approach might be less performant. Consider if sorting by CustomerName is critical.
-             # If so, might need to adjust the query structure.
-             # For now, we default to SaleDate if CustomerName is requested for simplicity
-             # sort_column_base = Customer.Name
-             pass
+            sort_column = Customer.Name
         elif hasattr(Sale, sort_by):
-            sort_column_base = getattr(Sale, sort_by)
-
-        if sort_order.lower() == 'asc':
-            base_query = base_query.order_by(sort_column_base.asc())
-        else:
-            base_query = base_query.order_by(sort_column_base.desc())
+            sort_column = getattr(Sale, sort_by)
+        sort_desc = sort_order.lower() != 'asc'
 
+        # Base query joining Sale and Customer (only select SaleID and the sort key for filtering)
+        base_query = db.session.query(Sale.SaleID, sort_column.label('sort_key')) \
+            .join(Customer, Sale.CustomerID == Customer.CustomerID, isouter=True) # Use outer join for guest orders
 
-        # Apply pagination to the SaleID query
-        paginated_ids_query = base_query.paginate(page=page, per_page=per_page, error_out=False)
-        sale_ids_on_page = [item.SaleID for item in paginated_ids_query.items]
+        base_query, filter_key = _filter_sales(base_query, request.args)
 
-        if not sale_ids_on_page:
-            # No results for this page
-            return jsonify({
-                'sales': [],
-                'total_items': total_items,
-                'current_page': page,
-                'total_pages': paginated_ids_query.pages,
-                'per_page': per_page
-            })
+        # Total count is cached per filter combination so deep paging doesn't re-count every page
+        total_items = _cached_order_count(filter_key, base_query)
+        total_pages = (total_items + per_page - 1) // per_page if per_page > 0 else 0
 
+        # SaleID breaks ties so the ordering is total (required for cursor paging)
+        if sort_desc:
+            base_query = base_query.order_by(sort_column.desc(), Sale.SaleID.desc())
+        else:
+            base_query = base_query.order_by(sort_column.asc(), Sale.SaleID.asc())
+
+        # Opt-in keyset pagination: ?after=<SaleDate>,<SaleID> seeks past the last row
+        # of the previous page via the (SaleDate, SaleID) index instead of using OFFSET
+        if after_str:
+            if sort_column is not Sale.SaleDate:
+                return jsonify({'error': 'Cursor pagination is only supported when sorting by SaleDate.'}), 400
+            try:
+                cursor_date, cursor_id = _parse_order_cursor(after_str)
+            except ValueError:
+                return jsonify({'error': 'Invalid cursor. Expected "<SaleDate>,<SaleID>".'}), 400
+            if sort_desc:
+                base_query = base_query.filter(
+                    Sale.SaleDate <= cursor_date,
+                    or_(Sale.SaleDate < cursor_date, Sale.SaleID < cursor_id)
+                )
+            else:
+                base_query = base_query.filter(
+                    Sale.SaleDate >= cursor_date,
+                    or_(Sale.SaleDate > cursor_date, Sale.SaleID > cursor_id)
+                )
+            base_query = base_query.limit(per_page)
+        else:
+            base_query = base_query.limit(per_page).offset((page - 1) * per_page)
+
+        # The page of SaleIDs becomes a CTE; details and dish names are fetched in the same statement
+        page_ids = base_query.cte('order_page')
+
+        # Dish names are aggregated with a window ordered by name, so the list comes back sorted;
+        # row_number() keeps one row per sale
+        line_window = dict(partition_by=page_ids.c.SaleID, order_by=(Dish.Name, SaleDish.SaleDishID))
+        dish_lines = db.session.query(
+            page_ids.c.SaleID.label('SaleID'),
+            func.group_concat(Dish.Name, ', ').over(rows=(None, None), **line_window).label('Dishes'),
+            func.sum(SaleDish.Quantity).over(partition_by=page_ids.c.SaleID).label('TotalQuantity'),
+            func.row_number().over(**line_window).label('line_no')
+        ).select_from(page_ids) \
+         .outerjoin(SaleDish, SaleDish.SaleID == page_ids.c.SaleID) \
+         .outerjoin(Dish, SaleDish.DishID == Dish.DishID) \
+         .subquery('dish_lines')
 
-        # Main query to fetch details only for the SaleIDs on the current page
         main_query = db.session.query(
             Sale.SaleID,
             Sale.SaleDate,
@@ -108,48 +167,35 @@ def get_sales():
             Sale.DiscountAmount,
             Sale.PaymentCompleted, # Fetch the PaymentCompleted status
             # Use coalesce for sum to handle cases with no dishes
-            func.coalesce(db.func.sum(SaleDish.Quantity), 0).label('TotalQuantity'),
-            # group_concat without inner ORDER BY for broader compatibility
-            db.func.group_concat(Dish.Name).label('Dishes')
-        ).select_from(Sale) \
-         .filter(Sale.SaleID.in_(sale_ids_on_page)) \
+            func.coalesce(dish_lines.c.TotalQuantity, 0).label('TotalQuantity'),
+            dish_lines.c.Dishes
+        ).select_from(page_ids) \
+         .join(Sale, Sale.SaleID == page_ids.c.SaleID) \
          .outerjoin(Customer, Sale.CustomerID == Customer.CustomerID) \
-         .outerjoin(SaleDish, Sale.SaleID == SaleDish.SaleID) \
-         .outerjoin(Dish, SaleDish.DishID == Dish.DishID) \
-         .group_by(
-            Sale.SaleID,
-            Sale.SaleDate,
-            Customer.Name,
-            Sale.TotalAmount,
-            Sale.Status,
-            Sale.Channel,
-            Sale.OrderType,
-            Sale.DiscountAmount,
-            Sale.PaymentCompleted # Group by PaymentCompleted as well
-         )
-
-        # Re-apply the same sorting order to the final results
-        sort_column_final = Sale.SaleDate # Default
-        if sort_by == 'CustomerName':
-             # sort_column_final = Customer.Name # Requires Customer join
-             pass # Defaulting to SaleDate
-        elif hasattr(Sale, sort_by):
-            sort_column_final = getattr(Sale, sort_by)
+         .join(dish_lines, and_(dish_lines.c.SaleID == page_ids.c.SaleID, dish_lines.c.line_no == 1))
 
-        if sort_order.lower() == 'asc':
-            main_query = main_query.order_by(sort_column_final.asc())
+        # Same ordering as the page CTE
+        if sort_desc:
+            main_query = main_query.order_by(page_ids.c.sort_key.desc(), page_ids.c.SaleID.desc())
         else:
-            main_query = main_query.order_by(sort_column_final.desc())
-
+            main_query = main_query.order_by(page_ids.c.sort_key.asc(), page_ids.c.SaleID.asc())
 
         sales_data = main_query.all()
 
+        if not sales_data:
+            # No results for this page
+            return jsonify({
+                'sales': [],
+                'total_items': total_items,
+                'current_page': page,
+                'total_pages': total_pages,
+                'per_page': per_page,
+                'next_cursor': None
+            })
+
         # Convert results to dictionary
         sales_list = []
         for sale in sales_data:
-            dishes_str = sale.Dishes
-            # Sort dishes alphabetically if needed after fetching
-            dish_list_sorted = sorted(dishes_str.split(',')) if dishes_str else []
             sales_list.append({
                 'SaleID': sale.SaleID,
                 'SaleDate': sale.SaleDate.strftime('%Y-%m-%d %H:%M:%S'),
@@ -160,25 +206,80 @@ def get_sales():
                 'Channel': sale.Channel,
                 'OrderType': sale.OrderType,
                 'PaymentCompleted': sale.PaymentCompleted, # Include in response
-                'Dishes': ', '.join(dish_list_sorted) if dish_list_sorted else 'N/A',
+                'Dishes': sale.Dishes or 'N/A', # Already sorted by name in SQL
                 'TotalQuantity': int(sale.TotalQuantity) # Already coalesced to 0
             })
 
-        # Ensure the order matches the paginated IDs order if necessary
-        # (Usually SQLAlchemy handles this if the order by is consistent)
+        # Cursor for the next page (only meaningful when sorted by SaleDate)
+        next_cursor = None
+        if sort_column is Sale.SaleDate and len(sales_data) == per_page:
+            last_sale = sales_data[-1]
+            next_cursor = f"{last_sale.SaleDate.isoformat(sep=' ')},{last_sale.SaleID}"
 
         return jsonify({
             'sales': sales_list,
             'total_items': total_items,
             'current_page': page,
-            'total_pages': paginated_ids_query.pages,
-            'per_page': per_page
+            'total_pages': total_pages,
+            'per_page': per_page,
+            'next_cursor': next_cursor
         })
 
     except Exception as e:
         current_app.logger.error(f"Error fetching sales data: {e}", exc_info=True) # Log full traceback
         return jsonify({'error': 'Failed to retrieve sales data', 'message': str(e)}), 500
 
+@order_api.route('/export', methods=['GET'])
+def export_sales():
+    """Stream the filtered orders as CSV or XLSX, one row per line item (same filters as /all).
+
+    Orders without line items still get one row. Rows are ordered by
+    SaleDate and read with yield_per, so a year of orders exports in
+    constant memory.
+    """
+    try:
+        query = db.session.query(
+            Sale.SaleID,
+            Sale.SaleDate,
+            Customer.Name,
+            Sale.Status,
+            Sale.Channel,
+            Sale.OrderType,
+            Sale.PaymentCompleted,
+            Sale.TotalAmount,
+            Sale.DiscountAmount,
+            Dish.Name,
+            SaleDish.Quantity,
+            SaleDish.UnitPrice,
+            (SaleDish.Quantity * SaleDish.UnitPrice).label('LineTotal')
+        ).select_from(Sale) \
+         .outerjoin(Customer, Sale.CustomerID == Customer.CustomerID) \
+         .outerjoin(SaleDish, SaleDish.SaleID == Sale.SaleID) \
+         .outerjoin(Dish, SaleDish.DishID == Dish.DishID)
+        query, _ = _filter_sales(query, request.args)
+        query = query.order_by(Sale.SaleDate, Sale.SaleID, SaleDish.SaleDishID)
+        return export_response('orders', [
+            'SaleID', 'SaleDate', 'Customer', 'Status', 'Channel', 'OrderType', 'PaymentCompleted',
+            'TotalAmount', 'DiscountAmount', 'Dish', 'Quantity', 'UnitPrice', 'LineTotal'
+        ], query)
+    except ValueError:
+        return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD.'}), 400
+    except Exception as e:
+        current_app.logger.error(f"Error exporting orders: {e}", exc_info=True)
+        return jsonify({'error': 'Failed to export orders', 'message': str(e)}), 500
+
+# Live order updates (server-sent events)
+@order_api.route('/stream', methods=['GET'])
+def stream_order_events():
+    """SSE stream of order_created / status_changed / paid / orders_imported deltas."""
+    last_event_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    return Response(order_events.stream(last_event_id), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # Get details for a specific order
 @order_api.route('/<int:sale_id>', methods=['GET'])
 def get_order_details(sale_id):
@@ -220,144 +321,146 @@ def get_order_details(sale_id):
         return jsonify({"error": "Could not fetch order details", "details": str(e)}), 500
 
 
+class OrderDataError(ValueError):
+    """Raised when an order payload cannot be turned into a sale."""
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+def _load_dishes(item_lists):
+    """Fetch every dish referenced by the given item lists with a single IN query."""
+    dish_ids = set()
+    for items in item_lists:
+        for item in items:
+            try:
+                dish_ids.add(int(item.get('dish_id')))
+            except (AttributeError, TypeError, ValueError):
+                continue # Reported when the order itself is validated
+    if not dish_ids:
+        return {}
+    return {dish.DishID: dish for dish in Dish.query.filter(Dish.DishID.in_(dish_ids)).all()}
+
+def _prepare_order(data, dishes, sale_date):
+    """Validate an order payload against preloaded dishes.
+
+    Returns a dict with the Sale column values, the SaleDish rows (without
+    SaleID) and whether a Receivable is needed. Raises OrderDataError.
+    """
+    if not isinstance(data, dict) or not data.get('items'):
+        raise OrderDataError('Missing required sales data or item details.')
+
+    customer_id = data.get('customer_id') # Optional
+    order_type = data.get('order_type', 'Unknown')
+    channel = data.get('channel', 'Unknown')
+    # Get payment status, default to False (unpaid) if not provided
+    payment_completed = data.get('payment_completed', False)
+    discount_input = data.get('discount_amount', 0)
+
+    # Validate discount amount
+    try:
+        discount_decimal = Decimal(str(discount_input)) # Use Decimal
+    except (ArithmeticError, ValueError, TypeError):
+        raise OrderDataError('Invalid discount amount format.')
+
+    if not order_type or not channel:
+        raise OrderDataError('Order type and channel are required.')
+
+    total_amount_decimal = Decimal(0) # Use Decimal for calculations
+    lines = []
+    for i, item_data in enumerate(data['items']):
+        dish_id = item_data.get('dish_id') if isinstance(item_data, dict) else None
+        quantity = item_data.get('quantity') if isinstance(item_data, dict) else None
+        if not dish_id or quantity is None or not isinstance(quantity, int) or quantity <= 0:
+            raise OrderDataError(f'Invalid item data for item {i+1}. Dish ID and positive integer quantity required.')
+
+        try:
+            dish = dishes.get(int(dish_id))
+        except (TypeError, ValueError):
+            dish = None
+        if not dish:
+            raise OrderDataError(f'Dish with ID {dish_id} not found.', 404)
+
+        # Determine unit price (use discount price if available) - Use Decimal
+        unit_price_decimal = dish.discount_price if dish.discount_price is not None else dish.Price
+        if unit_price_decimal is None:
+            raise OrderDataError(f"Price not defined for dish '{dish.Name}'.")
+
+        total_amount_decimal += unit_price_decimal * Decimal(quantity)
+        lines.append({'DishID': dish.DishID, 'Quantity': quantity, 'UnitPrice': unit_price_decimal})
+
+    # Calculate final total after discount, never negative
+    final_total_decimal = max(Decimal(0), total_amount_decimal - discount_decimal)
+
+    return {
+        'sale': {
+            'CustomerID': customer_id if customer_id else None, # Allow None for guests
+            'SaleDate': sale_date,
+            'TotalAmount': final_total_decimal,
+            'DiscountAmount': discount_decimal,
+            'Status': 'Pending', # New orders start as Pending
+            'OrderType': order_type,
+            'Channel': channel,
+            'PaymentCompleted': payment_completed
+        },
+        'lines': lines,
+        # Unpaid orders get a receivable, but only when a customer is attached
+        'receivable': not payment_completed and bool(customer_id)
+    }
+
+def _receivable_values(sale_values):
+    """Column values for the Receivable of an unpaid sale (due in 14 days)."""
+    return {
+        'ReceivableDate': sale_values['SaleDate'].date() + timedelta(days=14),
+        'Status': 'Unpaid',
+        'ReceivableAmount': sale_values['TotalAmount'],
+        'SaleID': sale_values['SaleID'],
+        'CustomerID': sale_values['CustomerID'],
+        'CreatedAt': datetime.utcnow()
+    }
+
 # Create a new order
 @order_api.route('/create', methods=['POST'])
 def create_order():
     """API endpoint to create a new sale and conditionally a receivable."""
     data = request.get_json()
-    current_app.logger.info(f"Received create order request: {data}")
-
-    if not data or 'items' not in data or not data['items']:
-        current_app.logger.error("Missing required sales data or item details")
-        return jsonify({'error': 'Missing required sales data or item details.'}), 400
+    current_app.logger.debug(f"Received create order request: {data}")
 
     # Use a try-except block for the whole process
     try:
-        customer_id = data.get('customer_id') # Optional
-        order_type = data.get('order_type', 'Unknown')
-        channel = data.get('channel', 'Unknown')
-        sale_items_data = data.get('items', [])
-        # Get payment status, default to False (unpaid) if not provided
-        payment_completed = data.get('payment_completed', False)
-        discount_input = data.get('discount_amount', 0)
-
-        # Validate discount amount
-        try:
-            discount_decimal = Decimal(str(discount_input)) # Use Decimal
-        except (ValueError, TypeError):
-            current_app.logger.error(f"Invalid discount amount received: {discount_input}")
-            return jsonify({'error': 'Invalid discount amount format.'}), 400
-
-        current_app.logger.info(f"Processing order: CustomerID={customer_id}, Type={order_type}, Channel={channel}, Items={len(sale_items_data)}, PaymentCompleted={payment_completed}, Discount={discount_decimal}")
-
-        if not order_type or not channel:
-             current_app.logger.error("Order type and channel are required")
-             return jsonify({'error': 'Order type and channel are required.'}), 400
-
-        total_amount_decimal = Decimal(0) # Use Decimal for calculations
-        sale_items_to_create = []
-
-        # Process items
-        for i, item_data in enumerate(sale_items_data):
-            dish_id = item_data.get('dish_id')
-            quantity = item_data.get('quantity')
-            current_app.logger.info(f"Processing item #{i+1}: dish_id={dish_id}, quantity={quantity}")
-
-            if not dish_id or quantity is None or not isinstance(quantity, int) or quantity <= 0:
-                 current_app.logger.error(f"Invalid item data: {item_data}. Dish ID and positive integer quantity required")
-                 return jsonify({'error': f'Invalid item data for item {i+1}. Dish ID and positive integer quantity required.'}), 400
-
-
-            dish = Dish.query.get(dish_id)
-            if not dish:
-                current_app.logger.error(f"Dish with ID {dish_id} not found")
-                return jsonify({'error': f'Dish with ID {dish_id} not found.'}), 404
+        items = data.get('items') if isinstance(data, dict) else None
+        order = _prepare_order(data, _load_dishes([items or []]), datetime.utcnow())
+    except OrderDataError as e:
+        current_app.logger.warning(f"Rejected order: {e}")
+        return jsonify({'error': str(e)}), e.status_code
 
-            # Determine unit price (use discount price if available) - Use Decimal
-            unit_price_decimal = dish.discount_price if dish.discount_price is not None else dish.Price
-            if unit_price_decimal is None:
-                current_app.logger.error(f"Dish {dish_id} ('{dish.Name}') has no price defined.")
-                return jsonify({'error': f"Price not defined for dish '{dish.Name}'."}), 400
-
-            subtotal_decimal = unit_price_decimal * Decimal(quantity)
-            total_amount_decimal += subtotal_decimal
-
-            current_app.logger.info(f"Item #{i+1}: Dish='{dish.Name}', UnitPrice={unit_price_decimal}, Quantity={quantity}, Subtotal={subtotal_decimal}")
-
-            sale_items_to_create.append({
-                'dish_id': dish_id,
-                'quantity': quantity,
-                'unit_price': unit_price_decimal,
-                'subtotal': subtotal_decimal
-            })
-
-        # Calculate final total after discount
-        final_total_decimal = total_amount_decimal - discount_decimal
-        final_total_decimal = max(Decimal(0), final_total_decimal) # Ensure total is not negative
-
-        # Create Sale record
-        sale_date_to_use = datetime.utcnow() # Use a consistent timestamp
-        new_sale = Sale(
-            CustomerID=customer_id if customer_id else None, # Allow None for guests
-            SaleDate=sale_date_to_use,
-            TotalAmount=final_total_decimal, # Store as Decimal
-            DiscountAmount=discount_decimal, # Store as Decimal
-            Status='Pending', # New orders start as Pending
-            OrderType=order_type,
-            Channel=channel,
-            PaymentCompleted=payment_completed # Save the payment status from request
-        )
+    try:
+        new_sale = Sale(**order['sale'])
         db.session.add(new_sale)
-        current_app.logger.info(f"Sale record created, preparing to flush to get SaleID")
         # Flush to get the SaleID before creating SaleDish and Receivable
         db.session.flush()
-        current_app.logger.info(f"Obtained new SaleID: {new_sale.SaleID}")
-
-        # Create SaleDish records
-        for i, item in enumerate(sale_items_to_create):
-            sale_dish_record = SaleDish(
-                SaleID=new_sale.SaleID,
-                DishID=item['dish_id'],
-                Quantity=item['quantity'],
-                UnitPrice=item['unit_price'], # Store as Decimal
-            )
-            db.session.add(sale_dish_record)
-            current_app.logger.info(f"SaleDish record #{i+1} added: SaleID={new_sale.SaleID}, DishID={item['dish_id']}, Quantity={item['quantity']}")
-
-        # Conditionally create Receivable IF PaymentCompleted is False
-        if not payment_completed:
-            # Only create receivable if there's a customer associated
-            if new_sale.CustomerID:
-                receivable_date = sale_date_to_use.date() + timedelta(days=14) # Use date part + timedelta
-                new_receivable = Receivable(
-                    ReceivableDate=receivable_date,
-                    Status='Unpaid',
-                    ReceivableAmount=new_sale.TotalAmount, # Use the final calculated amount (Decimal)
-                    SaleID=new_sale.SaleID,
-                    CustomerID=new_sale.CustomerID,
-                    CreatedAt=datetime.utcnow() # Add creation timestamp
-                    # PaidDate is not included here anymore
-                )
-                db.session.add(new_receivable)
-                current_app.logger.info(f"Created Receivable record for SaleID {new_sale.SaleID}, Amount: {new_sale.TotalAmount}")
-            else:
-                 # Log if no customer ID is present for an unpaid sale
-                 current_app.logger.warning(f"SaleID {new_sale.SaleID} is unpaid but has no CustomerID. Receivable not created.")
-        else:
-            current_app.logger.info(f"SaleID {new_sale.SaleID} is marked as paid. No Receivable created.")
 
+        for line in order['lines']:
+            db.session.add(SaleDish(SaleID=new_sale.SaleID, **line))
 
-        # Commit everything (Sale, SaleDishes, and potentially Receivable)
-        db.session.commit()
-        current_app.logger.info(f"Order creation committed successfully to database, SaleID={new_sale.SaleID}")
+        if order['receivable']:
+            db.session.add(Receivable(**_receivable_values(dict(order['sale'], SaleID=new_sale.SaleID))))
+        elif not new_sale.PaymentCompleted:
+            # Log if no customer ID is present for an unpaid sale
+            current_app.logger.warning(f"SaleID {new_sale.SaleID} is unpaid but has no CustomerID. Receivable not created.")
 
-        # Fetch customer name for response if needed (already handled in Sale.to_dict)
-        # customer_name = new_sale.customer.Name if new_sale.customer else 'Guest'
+        # Commit everything (Sale, SaleDishes, potentially Receivable, and the rollup)
+        db.session.commit()
+        current_app.logger.info(f"Order created: SaleID={new_sale.SaleID}, Items={len(order['lines'])}, Total={new_sale.TotalAmount}")
 
         # Prepare response data using the model's to_dict method
         created_sale_data = new_sale.to_dict()
-
-        current_app.logger.info(f"Returning created sale details: SaleID={new_sale.SaleID}")
+        order_events.publish('order_created', sale_payload(
+            new_sale,
+            CustomerName=created_sale_data['CustomerName'],
+            DiscountAmount=created_sale_data['DiscountAmount'],
+            TotalQuantity=sum(item['Quantity'] for item in created_sale_data['items']),
+            Dishes=', '.join(sorted(item['Name'] for item in created_sale_data['items'])) or 'N/A'
+        ))
         return jsonify({'message': 'Order created successfully.', 'sale': created_sale_data}), 201
 
     except Exception as e:
@@ -367,6 +470,105 @@ def create_order():
         return jsonify({'error': f'An error occurred during order creation.', 'details': str(e), 'type': error_type}), 500
 
 
+def _reserve_sale_ids(count):
+    """First of ``count`` consecutive unused SaleIDs, reserved until the current transaction ends.
+
+    A no-op UPDATE first takes SQLite's write lock, so no other connection
+    can insert sales between reading MAX(SaleID) and the caller's insert.
+    """
+    db.session.execute(Sale.__table__.update().where(Sale.SaleID < 0).values(Status=Sale.Status))
+    return (db.session.query(func.max(Sale.SaleID)).scalar() or 0) + 1
+
+
+# Create many orders at once (delivery-platform sync)
+@order_api.route('/bulk', methods=['POST'])
+def create_orders_bulk():
+    """API endpoint to create many sales in one request.
+
+    Body: ``{"orders": [<create payload>, ...], "batch_size": 200}``. Each order
+    may also carry ``sale_date`` (ISO 8601); it defaults to now. Invalid orders
+    are skipped and reported by index; the rest are bulk-inserted and committed
+    one batch at a time.
+    """
+    data = request.get_json()
+    orders_data = data.get('orders') if isinstance(data, dict) else None
+    if not isinstance(orders_data, list) or not orders_data:
+        return jsonify({'error': 'A non-empty "orders" list is required.'}), 400
+
+    batch_size = data.get('batch_size')
+    if batch_size is None:
+        batch_size = current_app.config.get('BULK_ORDER_BATCH_SIZE', 200)
+    # bool 是 int 的子类：true 不能当作 1
+    if type(batch_size) is not int or batch_size <= 0:
+        return jsonify({'error': 'batch_size must be a positive integer.'}), 400
+
+    created_ids = []
+    try:
+        # One IN query resolves every dish referenced by any order
+        dishes = _load_dishes(order_data.get('items') or [] for order_data in orders_data
+                              if isinstance(order_data, dict))
+
+        prepared, errors = [], []
+        now = datetime.utcnow()
+        for index, order_data in enumerate(orders_data):
+            try:
+                sale_date_str = order_data.get('sale_date') if isinstance(order_data, dict) else None
+                try:
+                    sale_date = datetime.fromisoformat(sale_date_str) if sale_date_str else now
+                except (TypeError, ValueError):
+                    raise OrderDataError('Invalid sale_date. Use ISO 8601 format.')
+                prepared.append(_prepare_order(order_data, dishes, sale_date))
+            except OrderDataError as e:
+                errors.append({'index': index, 'error': str(e)})
+
+        for start in range(0, len(prepared), batch_size):
+            batch = prepared[start:start + batch_size]
+            sale_rows = [order['sale'] for order in batch]
+            # Explicit IDs keep this one executemany (return_defaults would issue one INSERT per row).
+            # Core insert rather than bulk_insert_mappings, which drops None values (guest CustomerID)
+            # and so splits alternating guest/customer orders into separate statements.
+            first_id = _reserve_sale_ids(len(sale_rows))
+            for offset, row in enumerate(sale_rows):
+                row['SaleID'] = first_id + offset
+            db.session.execute(Sale.__table__.insert(), sale_rows)
+
+            line_rows, receivable_rows = [], []
+            for order in batch:
+                sale_id = order['sale']['SaleID']
+                line_rows.extend(dict(line, SaleID=sale_id) for line in order['lines'])
+                if order['receivable']:
+                    receivable_rows.append(_receivable_values(order['sale']))
+            db.session.bulk_insert_mappings(SaleDish, line_rows)
+            if receivable_rows:
+                db.session.bulk_insert_mappings(Receivable, receivable_rows)
+            # Bulk inserts bypass the session events; report them to the invalidation bus
+            # Keys plus rows (SaleDate, SaleID) let the rollup refresh only the imported days
+            mark_changed(db.session, Sale, [row['SaleID'] for row in sale_rows], sale_rows)
+            mark_changed(db.session, SaleDish, rows=line_rows)
+            if receivable_rows:
+                mark_changed(db.session, Receivable)
+
+            db.session.commit()
+            created_ids.extend(row['SaleID'] for row in sale_rows)
+
+        current_app.logger.info(f"Bulk order import: {len(created_ids)} created, {len(errors)} rejected")
+        if created_ids:
+            # One summary event instead of one per order; clients re-fetch the list once
+            order_events.publish('orders_imported', {'count': len(created_ids), 'sale_ids': created_ids})
+        return jsonify({
+            'message': f'{len(created_ids)} orders created.',
+            'created': len(created_ids),
+            'sale_ids': created_ids,
+            'errors': errors
+        }), 201 if created_ids else 400
+
+    except Exception as e:
+        db.session.rollback() # Only the current batch is rolled back
+        current_app.logger.error(f"Error during bulk order creation: {e}", exc_info=True)
+        return jsonify({'error': 'An error occurred during bulk order creation.', 'details': str(e),
+                        'created': len(created_ids), 'sale_ids': created_ids}), 500
+
+
 # Update order status
 @order_api.route('/<int:sale_id>/status', methods=['PUT'])
 def update_order_status(sale_id):
@@ -399,7 +601,9 @@ def update_order_status(sale_id):
         # Note: Marking sale 'Completed' does NOT automatically mark it as paid here.
         # Use the '/mark_paid' endpoint for that.
 
+        event = sale_payload(sale, previous_status=old_status)
         db.session.commit()
+        order_events.publish('status_changed', event)
 
         return jsonify({'success': True, 'message': f'Sale #{sale_id} status updated to {new_status}.', 'new_status': new_status})
 
@@ -447,7 +651,9 @@ def mark_order_paid(sale_id):
              current_app.logger.info(f"No unpaid Receivable record found for paid order {sale_id}.")
 
         # 3. Commit database changes
+        event = sale_payload(sale)
         db.session.commit()
+        order_events.publish('paid', event)
         current_app.logger.info(f"Order {sale_id} successfully marked as paid and associated records updated")
 
         # Return updated sale details
@@ -1,9 +1,11 @@
 from flask import Blueprint, render_template, request, jsonify, current_app
-from models import db, Dish, SaleDish, Sale
+from models import db, Dish, SaleDish, Sale, DailySalesRollup
 from sqlalchemy import func
 import os
 from werkzeug.utils import secure_filename
 from datetime import datetime, timedelta
+from cache import cached
+from exports import export_response
 
 # 创建两个Blueprint
 product_bp = Blueprint('product_bp', __name__, template_folder='../templates')
@@ -14,24 +16,21 @@ def product_management():
     """渲染产品管理页面"""
     return render_template('product_management.html')
 
+def _filter_products(query, args):
+    """应用产品列表的过滤条件（category、search），列表和导出共用"""
+    category = args.get('category', '')
+    search_term = args.get('search', '')
+    if category:
+        query = query.filter(Dish.Category == category)
+    if search_term:
+        query = query.filter(Dish.Name.ilike(f'%{search_term}%'))
+    return query
+
 @product_api.route('', methods=['GET'])
 def get_products():
     """获取所有产品"""
     try:
-        category = request.args.get('category', '')
-        search_term = request.args.get('search', '')
-        
-        # 构建查询
-        query = Dish.query
-        
-        # 应用过滤条件
-        if category:
-            query = query.filter(Dish.Category == category)
-        
-        if search_term:
-            query = query.filter(Dish.Name.ilike(f'%{search_term}%'))
-        
-        products = query.all()
+        products = _filter_products(Dish.query, request.args).all()
         
         # 转换为JSON格式
         result = []
@@ -72,6 +71,7 @@ def get_categories():
         return jsonify({"success": False, "message": "Failed to retrieve categories"}), 500
 
 @product_api.route('/bestsellers', methods=['GET'])
+@cached('sales', 'dishes')
 def get_bestsellers():
     """获取热销商品数据，基于订单统计"""
     try:
@@ -120,27 +120,26 @@ def get_bestsellers():
         return jsonify({"success": False, "message": "Failed to retrieve bestselling products"}), 500
 
 @product_api.route('/category-stats', methods=['GET'])
+@cached('sales', 'dishes')
 def get_category_stats():
     """获取按类别的销售统计，基于订单统计"""
     try:
         days = request.args.get('days', 30, type=int)
         date_limit = datetime.now() - timedelta(days=days)
         
-        # 基于订单和分类统计
+        # 基于每日销售汇总表按分类统计（成本与天数成正比，而非订单数）
         query = db.session.query(
-            Dish.Category,
-            func.count(SaleDish.SaleID).label('order_count'),
-            func.sum(SaleDish.Quantity).label('total_quantity'),
-            func.sum(SaleDish.Quantity * Dish.Price).label('total_revenue')
-        ).join(
-            SaleDish, Dish.DishID == SaleDish.DishID
-        ).join(
-            Sale, Sale.SaleID == SaleDish.SaleID
+            DailySalesRollup.Category,
+            func.sum(DailySalesRollup.Lines).label('order_count'),
+            func.sum(DailySalesRollup.Units).label('total_quantity'),
+            func.sum(DailySalesRollup.LineRevenue).label('total_revenue')
         ).filter(
-            Sale.SaleDate >= date_limit,
-            Sale.Status == 'Completed'  # 仅计算已完成的订单
+            DailySalesRollup.Day >= date_limit.date(),
+            DailySalesRollup.Status == 'Completed'  # 仅计算已完成的订单
         ).group_by(
-            Dish.Category
+            DailySalesRollup.Category
+        ).having(
+            func.sum(DailySalesRollup.Lines) > 0
         )
         
         sales_data = query.all()
@@ -292,40 +291,13 @@ def delete_product(product_id):
 
 @product_api.route('/export', methods=['GET'])
 def export_products():
-    """导出产品数据"""
+    """导出产品数据（CSV/XLSX 流式输出，过滤条件同产品列表）"""
     try:
-        from flask import Response
-        import csv
-        import io
-        
-        # 查询所有产品
-        products = Dish.query.all()
-        
-        # 创建CSV文件
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # 写入标题行
-        writer.writerow(['ID', 'Name', 'Category', 'Price', 'Description', 'Status', 'Image'])
-        
-        # 写入产品数据
-        for product in products:
-            writer.writerow([
-                product.DishID,
-                product.Name,
-                product.Category,
-                product.Price,
-                product.Description,
-                product.Status,
-                product.ImageURL
-            ])
-        
-        # 返回CSV文件
-        return Response(
-            output.getvalue(),
-            mimetype="text/csv",
-            headers={"Content-Disposition": "attachment;filename=products.csv"}
+        query = db.session.query(
+            Dish.DishID, Dish.Name, Dish.Category, Dish.Price, Dish.Description, Dish.Status, Dish.ImageURL
         )
+        query = _filter_products(query, request.args).order_by(Dish.DishID)
+        return export_response('products', ['ID', 'Name', 'Category', 'Price', 'Description', 'Status', 'Image'], query)
     
     except Exception as e:
         current_app.logger.error(f"Error exporting products: {str(e)}")
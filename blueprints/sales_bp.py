@@ -1,12 +1,15 @@
 from flask import Blueprint, jsonify, request
 from sqlalchemy import func, extract
 from datetime import datetime, timedelta, date
-from models import db, Sale, SaleDish, Dish, Customer, Staff
+from models import db, Sale, SaleDish, Dish, Customer, Staff, DailySalesRollup
+from cache import cached
+from order_events import order_events, sale_payload
 
 # 创建销售API蓝图
 sales_api = Blueprint('sales_api', __name__, url_prefix='/api/sales')
 
 @sales_api.route('/top_dishes')
+@cached('sales', 'dishes')
 def top_dishes():
     """获取最畅销菜品数据"""
     # 查询最畅销的菜品
@@ -35,15 +38,13 @@ def sales_trend():
     # 创建最近30天的日期列表
     date_range = [(today - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(29, -1, -1)]
     
-    # 查询销售趋势（按天）
+    # 查询销售趋势（按天）- 读取每日汇总表，成本与天数成正比
     sales_by_day = db.session.query(
-        func.date(Sale.SaleDate).label('date'),
-        func.sum(Sale.TotalAmount).label('total_sales')
-    ).filter(Sale.Status == 'Completed')\
-     .filter(func.date(Sale.SaleDate) <= today)\
-     .group_by(func.date(Sale.SaleDate))\
-     .order_by(func.date(Sale.SaleDate).desc())\
-     .limit(30)\
+        DailySalesRollup.Day.label('date'),
+        func.sum(DailySalesRollup.Revenue).label('total_sales')
+    ).filter(DailySalesRollup.Status == 'Completed')\
+     .filter(DailySalesRollup.Day >= today - timedelta(days=29), DailySalesRollup.Day <= today)\
+     .group_by(DailySalesRollup.Day)\
      .all()
 
     # 将查询结果转换为字典，方便按日期查找
@@ -67,12 +68,12 @@ def sales_trend():
 @sales_api.route('/by_channel')
 def sales_by_channel():
     """获取按渠道划分的销售数据"""
-    # 查询按渠道划分的销售数据
+    # 查询按渠道划分的销售数据（来自每日汇总表）
     channel_sales = db.session.query(
-        Sale.Channel,
-        func.sum(Sale.TotalAmount).label('total_sales')
-    ).filter(Sale.Status == 'Completed')\
-     .group_by(Sale.Channel)\
+        DailySalesRollup.Channel,
+        func.sum(DailySalesRollup.Revenue).label('total_sales')
+    ).filter(DailySalesRollup.Status == 'Completed')\
+     .group_by(DailySalesRollup.Channel)\
      .all()
 
     return jsonify({
@@ -81,6 +82,7 @@ def sales_by_channel():
     })
 
 @sales_api.route('/peak_hours')
+@cached('sales')
 def sales_peak_hours():
     """获取销售高峰时段数据"""
     # 查询高峰时段数据
@@ -163,8 +165,11 @@ def update_sale_status(sale_id):
 
     try:
         sale = Sale.query.get_or_404(sale_id)
+        event = sale_payload(sale, previous_status=sale.Status)
         sale.Status = new_status
+        event['Status'] = new_status
         db.session.commit()
+        order_events.publish('status_changed', event)
 
         return jsonify({'success': True, 'message': f'Sale #{sale_id} status updated to {new_status}.', 'new_status': new_status})
 
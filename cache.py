@@ -0,0 +1,142 @@
+# cache.py
+"""In-process response cache for read-only analytics endpoints.
+
+Responses are keyed by request path plus the normalized query string and
+expire after a TTL; the cache is bounded and evicts the least recently used
+entry first. Each entry carries tags (e.g. ``'sales'``, ``'dishes'``);
+TABLE_TAGS maps tables to tags, and after each commit the invalidation bus
+drops the entries whose tables were written.
+
+The cache lives in the worker process, so each worker keeps its own copy;
+the TTL bounds how stale a worker can be if an invalidation is missed.
+"""
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, make_response, request
+
+from invalidation import subscribe
+
+
+class TTLCache:
+    """Thread-safe, size-bounded LRU mapping whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize=512, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict() # key -> (expires_at, tags, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached value for ``key``, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, value, tags=(), ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, frozenset(tags), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *tags):
+        """Drop every entry carrying any of ``tags``; returns the number dropped."""
+        tags = set(tags)
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry[1] & tags]
+            for key in stale:
+                del self._entries[key]
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+# 全局响应缓存；容量和默认 TTL 可通过 app.config 的 RESPONSE_CACHE_* 调整
+response_cache = TTLCache()
+
+
+def init_cache(app):
+    """Apply RESPONSE_CACHE_MAXSIZE / RESPONSE_CACHE_TTL from the app config."""
+    response_cache.maxsize = app.config.get('RESPONSE_CACHE_MAXSIZE', response_cache.maxsize)
+    response_cache.ttl = app.config.get('RESPONSE_CACHE_TTL', response_cache.ttl)
+    response_cache.clear()
+
+
+def _request_key():
+    # 参数顺序不同的同一请求命中同一条缓存
+    args = tuple(sorted(request.args.items(multi=True)))
+    return request.path, args
+
+
+def cached(*tags, ttl=None):
+    """Cache successful (200) responses of a GET view under ``tags``."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = _request_key()
+            hit = response_cache.get(key)
+            if hit is not None:
+                body, mimetype = hit
+                response = current_app.response_class(body, mimetype=mimetype)
+                response.headers['X-Cache'] = 'HIT'
+                return response
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                response_cache.set(key, (response.get_data(), response.mimetype), tags, ttl)
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+
+def invalidate(*tags):
+    """Drop cached responses carrying any of ``tags``."""
+    return response_cache.invalidate(*tags)
+
+
+# 表 -> 受影响的缓存标签
+TABLE_TAGS = {
+    'sale': ('sales',),
+    'sale_dish': ('sales',),
+    'dish': ('dishes',),
+}
+
+
+def _invalidate_changed_tables(session, changes):
+    tags = {tag for table in changes.tables for tag in TABLE_TAGS.get(table, ())}
+    if tags:
+        invalidate(*tags)
+
+
+subscribe(TABLE_TAGS, _invalidate_changed_tables)
@@ -0,0 +1,207 @@
+# costing.py
+"""Ingredient prices and recipe-based dish costs.
+
+Prices are kept as a history in item_price; the price of an item on a given
+day is the latest row effective on or before that day (one lookup on the
+(ItemID, EffectiveDate) index). A dish's unit cost is the sum of its
+DishIngredient quantities times those prices. The per-dish cost vector for a
+day is cached and dropped whenever item_price or dish_ingredient changes.
+
+margin_report() is the COGS engine: for a date range it prices every dish
+sold on every day with the ingredient prices valid that day, in a single
+aggregated query, and caches the result per period.
+"""
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import and_, func, literal, select
+
+from invalidation import on_change
+from models import db, Dish, DishIngredient, ItemPrice, Sale, SaleDish
+
+_DISH_COST_CACHE_MAX = 64
+_dish_cost_cache = {} # as_of date -> {DishID: Decimal unit cost}
+_MARGIN_CACHE_MAX = 64
+_margin_cache = {} # (start date, end date) -> margin report rows
+
+
+def price_as_of(item_id, day):
+    """Scalar subquery: UnitPrice of ``item_id`` effective on ``day``.
+
+    Both arguments may be columns (correlated lookup per row) or plain values.
+    Returns NULL when the item has no price on or before that day.
+    """
+    return select(ItemPrice.UnitPrice) \
+        .where(ItemPrice.ItemID == item_id, ItemPrice.EffectiveDate <= day) \
+        .order_by(ItemPrice.EffectiveDate.desc(), ItemPrice.ItemPriceID.desc()) \
+        .limit(1) \
+        .scalar_subquery()
+
+
+def dish_cost_select(as_of):
+    """SELECT (DishID, UnitCost) of every dish with a recipe, priced as of ``as_of``.
+
+    Ingredients without a price contribute nothing to the cost.
+    """
+    unit_price = price_as_of(DishIngredient.ItemID, as_of)
+    return select(
+        DishIngredient.DishID,
+        func.sum(DishIngredient.Quantity * unit_price).label('UnitCost')
+    ).group_by(DishIngredient.DishID)
+
+
+def get_dish_costs(as_of=None):
+    """Return ``{DishID: Decimal unit cost}`` as of ``as_of`` (default today), cached per day."""
+    as_of = as_of or date.today()
+    costs = _dish_cost_cache.get(as_of)
+    if costs is None:
+        costs = {
+            dish_id: Decimal(str(round(unit_cost, 4)))
+            for dish_id, unit_cost in db.session.execute(dish_cost_select(as_of))
+            if unit_cost is not None
+        }
+        if len(_dish_cost_cache) >= _DISH_COST_CACHE_MAX:
+            _dish_cost_cache.clear()
+        _dish_cost_cache[as_of] = costs
+    return costs
+
+
+@on_change('item_price', 'dish_ingredient')
+def invalidate_dish_costs(session=None, changes=None):
+    """Drop cached dish costs; runs after every commit that changes prices or recipes."""
+    _dish_cost_cache.clear()
+
+
+def _daily_prices(days):
+    """CTE of (ItemID, day, UnitPrice): the price of every item on each of ``days``.
+
+    A price row is valid from its EffectiveDate until the item's next row.
+    Expanding the periods to days lets the sales join on (ItemID, day)
+    equality instead of a range condition.
+    """
+    superseded = func.lead(ItemPrice.EffectiveDate).over(
+        partition_by=ItemPrice.ItemID, order_by=(ItemPrice.EffectiveDate, ItemPrice.ItemPriceID))
+    periods = select(
+        ItemPrice.ItemID,
+        ItemPrice.EffectiveDate.label('valid_from'),
+        func.coalesce(superseded, literal('9999-12-31')).label('valid_to'),
+        ItemPrice.UnitPrice
+    ).cte('price_period')
+    return select(
+        periods.c.ItemID,
+        days.c.day,
+        periods.c.UnitPrice
+    ).join(days, and_(days.c.day >= periods.c.valid_from, days.c.day < periods.c.valid_to)) \
+     .cte('item_day_price').prefix_with('MATERIALIZED')
+
+
+def margin_select(start=None, end=None):
+    """One aggregated SELECT of revenue, units and COGS per dish for completed sales.
+
+    Sales are first collapsed to (dish, day) totals, then joined to the dish's
+    recipe and to each ingredient's price on that day. ``start`` and ``end``
+    are inclusive dates; None leaves that side open.
+    """
+    sale_day = func.date(Sale.SaleDate)
+    daily = select(
+        SaleDish.DishID,
+        sale_day.label('day'),
+        func.sum(SaleDish.Quantity).label('units'),
+        func.sum(SaleDish.Quantity * SaleDish.UnitPrice).label('revenue')
+    ).join(Sale, Sale.SaleID == SaleDish.SaleID) \
+     .where(Sale.Status == 'Completed')
+    if start is not None:
+        daily = daily.where(Sale.SaleDate >= datetime.combine(start, datetime.min.time()))
+    if end is not None:
+        daily = daily.where(Sale.SaleDate < datetime.combine(end + timedelta(days=1), datetime.min.time()))
+    daily = daily.group_by(SaleDish.DishID, sale_day).cte('dish_day')
+
+    # 第一个到最后一个销售日之间的每一天（递归 CTE 生成日历）
+    days = select(func.min(daily.c.day).label('day')).cte('sale_days', recursive=True)
+    days = days.union_all(
+        select(func.date(days.c.day, '+1 day'))
+        .where(days.c.day < select(func.max(daily.c.day)).scalar_subquery())
+    )
+    prices = _daily_prices(days)
+    cogs = select(
+        daily.c.DishID,
+        func.sum(daily.c.units * DishIngredient.Quantity * prices.c.UnitPrice).label('cogs')
+    ).join(DishIngredient, DishIngredient.DishID == daily.c.DishID) \
+     .join(prices, and_(prices.c.ItemID == DishIngredient.ItemID, prices.c.day == daily.c.day)) \
+     .group_by(daily.c.DishID) \
+     .subquery('dish_cogs')
+
+    totals = select(
+        daily.c.DishID,
+        func.sum(daily.c.units).label('units'),
+        func.sum(daily.c.revenue).label('revenue')
+    ).group_by(daily.c.DishID).subquery('dish_totals')
+
+    return select(
+        Dish.DishID,
+        Dish.Name,
+        Dish.Category,
+        totals.c.units,
+        totals.c.revenue,
+        cogs.c.cogs
+    ).join(totals, totals.c.DishID == Dish.DishID) \
+     .outerjoin(cogs, cogs.c.DishID == Dish.DishID)
+
+
+def margin_report(start=None, end=None):
+    """Per-dish revenue, COGS, profit and margin for completed sales in [start, end].
+
+    Results are cached per period and dropped when sales, prices, recipes or
+    dishes change. Dishes without a recipe report ``cogs`` as None.
+    """
+    key = (start, end)
+    rows = _margin_cache.get(key)
+    if rows is not None:
+        return rows
+
+    rows = []
+    for dish_id, name, category, units, revenue, cogs in db.session.execute(margin_select(start, end)):
+        units = int(units or 0)
+        revenue = Decimal(str(revenue or 0)).quantize(Decimal('0.01'))
+        cogs = Decimal(str(cogs)).quantize(Decimal('0.01')) if cogs is not None else None
+        profit = revenue - (cogs or 0)
+        rows.append({
+            'DishID': dish_id,
+            'Name': name,
+            'Category': category,
+            'Units': units,
+            'Revenue': revenue,
+            'COGS': cogs,
+            'Profit': profit,
+            'Margin': (profit / revenue * 100).quantize(Decimal('0.1')) if revenue > 0 else None
+        })
+
+    if len(_margin_cache) >= _MARGIN_CACHE_MAX:
+        _margin_cache.clear()
+    _margin_cache[key] = rows
+    return rows
+
+
+@on_change('sale', 'sale_dish')
+def invalidate_margin_periods(session=None, changes=None):
+    """Drop cached margin reports whose period contains a changed sale."""
+    sales = changes.rows('sale') if changes else []
+    sale_ids = {sale.get('SaleID') for sale in sales}
+    days = {sale['SaleDate'].date() for sale in sales if sale.get('SaleDate')}
+    known = (changes is not None
+             and not changes.is_bulk('sale') and not changes.is_bulk('sale_dish')
+             and changes.keys('sale') <= sale_ids
+             and all(sale.get('SaleDate') for sale in sales)
+             and all(line.get('SaleID') in sale_ids for line in changes.rows('sale_dish')))
+    if not known:
+        _margin_cache.clear()
+        return
+    for start, end in list(_margin_cache):
+        if any((start is None or start <= day) and (end is None or day <= end) for day in days):
+            _margin_cache.pop((start, end), None)
+
+
+@on_change('item_price', 'dish_ingredient', 'dish')
+def invalidate_margin_reports(session=None, changes=None):
+    """Prices, recipes or dish names changed: every cached margin report is stale."""
+    _margin_cache.clear()
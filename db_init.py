@@ -3,7 +3,46 @@ from datetime import datetime, timedelta, date
 from decimal import Decimal # Import Decimal for precise price handling
 from models import db, Dish, Item, Inventory, DishIngredient, Vendor, Purchase, PurchaseItem, Sale, SaleDish, Customer, Staff, Feedback, Payable, Receivable # Ensure Receivable is imported
 from datetime import datetime, timedelta
-from models import BuyList, Item, Vendor
+from models import BuyList, Item, Vendor, DailySalesRollup, ItemPrice, InventoryDepletion, FinancialSnapshot
+from rollup import rebuild_daily_rollup
+from depletion import backfill_depletion_ledger
+
+# 原料初始单价（按 Item.DefaultUnit 计价），初始化及旧库升级时写入 item_price
+DEFAULT_INGREDIENT_PRICES = {
+    "High-Gluten Flour": Decimal("4.50"),
+    "Tomato Sauce": Decimal("3.00"),
+    "Mozzarella Cheese": Decimal("6.80"),
+    "Pepperoni": Decimal("8.00"),
+    "Mushrooms": Decimal("3.50"),
+    "Green Peppers": Decimal("2.80"),
+    "Onions": Decimal("1.50"),
+    "Olive Oil": Decimal("5.20"),
+    "Black Olives": Decimal("4.00"),
+    "Italian Seasoning": Decimal("2.50"),
+    "Ham Slices": Decimal("7.50"),
+    "Pineapple Chunks": Decimal("3.80"),
+    "Basil Leaves": Decimal("1.20")
+}
+# 初始价格的生效日期：早于任何业务数据，历史采购都能取到价格
+INITIAL_PRICE_DATE = date(2000, 1, 1)
+
+def seed_item_prices():
+    """Insert DEFAULT_INGREDIENT_PRICES into item_price for items matched by name.
+
+    The vendor is taken from the item's inventory record when there is one.
+    Returns the number of price rows added.
+    """
+    added = 0
+    for item in Item.query.filter(Item.Name.in_(DEFAULT_INGREDIENT_PRICES)).all():
+        db.session.add(ItemPrice(
+            ItemID=item.ItemID,
+            VendorID=item.inventory.VendorID if item.inventory else None,
+            EffectiveDate=INITIAL_PRICE_DATE,
+            UnitPrice=DEFAULT_INGREDIENT_PRICES[item.Name]
+        ))
+        added += 1
+    db.session.commit()
+    return added
 # init_db_data 函数保持不变，但内部的 Receivable 创建逻辑已修改
 def init_db_data():
     """Initialize the database and fill with sample data (English)"""
@@ -18,11 +57,14 @@ def init_db_data():
     PurchaseItem.query.delete()
     SaleDish.query.delete()
     Feedback.query.delete()
+    InventoryDepletion.query.delete()
+    FinancialSnapshot.query.delete()
     Payable.query.delete()
     Receivable.query.delete()
     Purchase.query.delete()
     Sale.query.delete()
     DishIngredient.query.delete()
+    ItemPrice.query.delete()
     Inventory.query.delete()
     Dish.query.delete()
     Item.query.delete()
@@ -94,6 +136,9 @@ def init_db_data():
     db.session.add_all(inventories)
     db.session.commit()
 
+    # Add initial ingredient prices
+    seed_item_prices()
+
     # Add Dishes (English, Lower Prices)
     dishes = [
         Dish(
@@ -505,6 +550,11 @@ def init_db_data():
         db.session.add_all(feedbacks)
         db.session.commit()
 
+    # Materialize the daily sales rollup for the seeded sales
+    rebuild_daily_rollup()
+    # 样例历史订单不扣减样例库存
+    backfill_depletion_ledger()
+
     print("Data initialization complete!")
 def init_db():
     """Create database tables and initialize data (English)"""
@@ -513,4 +563,35 @@ def init_db():
     print("Database tables created!")
     # Optionally: Automatically populate data after creating tables
     init_db_data()
-    # return "Database initialization successful!" # Return was causing issues with flask cli call
\ No newline at end of file
+    # return "Database initialization successful!" # Return was causing issues with flask cli call
+
+def upgrade_db():
+    """Bring an existing database up to the current models without dropping data.
+
+    create_all() only adds missing tables, so indexes declared on tables that
+    already exist are created here one by one (IF NOT EXISTS semantics).
+    """
+    db.create_all()
+    inspector = db.inspect(db.engine)
+    created = 0
+    for table in db.metadata.sorted_tables:
+        existing = {ix['name'] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=db.engine)
+                print(f"Created index {index.name} on {table.name}")
+                created += 1
+    # 价格历史表为空时写入初始单价
+    if ItemPrice.query.first() is None and Item.query.first() is not None:
+        print(f"Seeded ingredient prices ({seed_item_prices()} items).")
+    # 新建的扣减台账：已有的已完成订单视为已扣减
+    if InventoryDepletion.query.first() is None and Sale.query.first() is not None:
+        print(f"Recorded {backfill_depletion_ledger()} completed sales in the depletion ledger.")
+    # 新建的汇总表需要从已有销售数据回填
+    if DailySalesRollup.query.first() is None and Sale.query.first() is not None:
+        print(f"Backfilled daily sales rollup ({rebuild_daily_rollup()} rows).")
+    # 刷新统计信息，让 SQLite 查询规划器选择新索引
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql('ANALYZE')
+    print(f"Database upgrade complete ({created} new indexes).")
+
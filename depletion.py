@@ -0,0 +1,127 @@
+# depletion.py
+"""Inventory depletion from completed sales.
+
+When a commit moves sales to ``Completed`` they are queued in the
+inventory_depletion ledger (once per sale, so a sale is never deducted
+twice). Applying the queue claims every pending ledger row, computes the
+ingredient consumption of all their line items in one grouped query
+(SaleDish x DishIngredient) and subtracts it from inventory with a single
+``UPDATE ... CASE ItemID``.
+
+By default the queue is applied inside the committing transaction. With
+INVENTORY_DEPLETION_DEFERRED set, a background worker applies it every
+INVENTORY_DEPLETION_INTERVAL seconds instead, coalescing all orders
+completed in between into one update.
+"""
+import logging
+import threading
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import case, func, insert, literal, select, update
+
+from invalidation import mark_changed, on_change
+from models import db, DishIngredient, Inventory, InventoryDepletion, Sale, SaleDish
+
+logger = logging.getLogger(__name__)
+
+
+def queue_completed_sales(session, sale_ids=None):
+    """Add completed sales that are not in the ledger yet; ``None`` checks every sale."""
+    completed = select(Sale.SaleID, literal(datetime.utcnow())) \
+        .where(Sale.Status == 'Completed') \
+        .where(~Sale.SaleID.in_(select(InventoryDepletion.SaleID)))
+    if sale_ids is not None:
+        if not sale_ids:
+            return 0
+        completed = completed.where(Sale.SaleID.in_(sale_ids))
+    result = session.execute(
+        insert(InventoryDepletion).from_select(['SaleID', 'QueuedAt'], completed))
+    return result.rowcount
+
+
+def apply_pending_depletion(session):
+    """Deduct the ingredients of every queued sale from inventory; returns the sales applied.
+
+    Runs in the caller's transaction; the caller commits.
+    """
+    now = datetime.utcnow()
+    # 先认领待处理的台账行，后续查询只看这一批
+    claimed = session.execute(
+        update(InventoryDepletion)
+        .where(InventoryDepletion.DepletedAt.is_(None))
+        .values(DepletedAt=now)
+    ).rowcount
+    if not claimed:
+        return 0
+
+    consumption = dict(session.execute(
+        select(DishIngredient.ItemID, func.sum(SaleDish.Quantity * DishIngredient.Quantity))
+        .join(SaleDish, SaleDish.DishID == DishIngredient.DishID)
+        .join(InventoryDepletion, InventoryDepletion.SaleID == SaleDish.SaleID)
+        .where(InventoryDepletion.DepletedAt == now)
+        .group_by(DishIngredient.ItemID)
+    ).all())
+    if consumption:
+        session.execute(
+            update(Inventory)
+            .where(Inventory.ItemID.in_(consumption))
+            .values(StockLevel=Inventory.StockLevel - case(consumption, value=Inventory.ItemID, else_=0),
+                    last_update=now)
+        )
+        mark_changed(session, Inventory)
+    return claimed
+
+
+def backfill_depletion_ledger():
+    """Record every completed sale as already depleted without touching stock, and commit.
+
+    Used when the ledger is introduced on a database with existing sales, so
+    historic orders are not deducted from today's inventory.
+    """
+    now = datetime.utcnow()
+    completed = select(Sale.SaleID, literal(now).label('QueuedAt'), literal(now).label('DepletedAt')) \
+        .where(Sale.Status == 'Completed') \
+        .where(~Sale.SaleID.in_(select(InventoryDepletion.SaleID)))
+    count = db.session.execute(
+        insert(InventoryDepletion).from_select(['SaleID', 'QueuedAt', 'DepletedAt'], completed)).rowcount
+    db.session.commit()
+    return count
+
+
+@on_change('sale', phase='before_commit')
+def _deplete_completed_sales(session, changes):
+    """Queue the sales completed by this transaction and, unless deferred, apply them."""
+    # 批量 UPDATE 不知道改了哪些订单，检查所有未入台账的已完成订单
+    sale_ids = None if changes.is_bulk('sale') else changes.keys('sale')
+    queued = queue_completed_sales(session, sale_ids)
+    if queued and not current_app.config.get('INVENTORY_DEPLETION_DEFERRED'):
+        apply_pending_depletion(session)
+
+
+def _depletion_worker(app, interval, stop):
+    while not stop.wait(interval):
+        with app.app_context():
+            try:
+                applied = apply_pending_depletion(db.session)
+                db.session.commit()
+                if applied:
+                    logger.info('Applied inventory depletion for %d sales', applied)
+            except Exception:
+                db.session.rollback()
+                logger.exception('Deferred inventory depletion failed')
+            finally:
+                db.session.remove()
+
+
+def init_depletion(app):
+    """Start the deferred depletion worker when INVENTORY_DEPLETION_DEFERRED is set."""
+    if not app.config.get('INVENTORY_DEPLETION_DEFERRED'):
+        return None
+    stop = threading.Event()
+    worker = threading.Thread(
+        target=_depletion_worker, name='inventory-depletion', daemon=True,
+        args=(app, app.config.get('INVENTORY_DEPLETION_INTERVAL', 10), stop))
+    worker.start()
+    app.extensions['inventory_depletion'] = stop
+    return worker
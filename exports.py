@@ -0,0 +1,92 @@
+# exports.py
+"""Streaming CSV and XLSX exports.
+
+csv_response() turns a query into a ``text/csv`` attachment that is written
+while it is sent: rows are fetched with ``yield_per`` and encoded
+EXPORT_BATCH_SIZE rows at a time, so memory use does not depend on the
+number of rows exported. Export queries should select plain columns rather
+than ORM entities, so nothing accumulates in the session either.
+xlsx_response() does the same for .xlsx workbooks (see xlsx.py), one
+worksheet per query, and export_response() picks the format from
+``?format=csv|xlsx`` (csv by default).
+
+The export endpoints live next to the list API they mirror and reuse its
+filter helper, so an export returns the same rows as the list:
+
+* /api/products/export
+* /api/orders/export (one row per line item)
+* /api/customers/export
+* /api/inventory/export
+* /api/finance/receivables/export and /api/finance/payables/export
+* /finance/export (the financial report workbook, .xlsx only)
+"""
+import csv
+import io
+from datetime import date, datetime
+
+from flask import Response, current_app, jsonify, request, stream_with_context
+
+from xlsx import MIMETYPE as XLSX_MIMETYPE, stream_xlsx
+
+EXPORT_FORMATS = ('csv', 'xlsx')
+
+
+def _cell(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.strftime('%Y-%m-%d')
+    return value
+
+
+def stream_csv(header, rows, batch_size=1000):
+    """Yield the CSV text of ``header`` and ``rows``, ``batch_size`` rows per chunk."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for count, row in enumerate(rows, 1):
+        writer.writerow([_cell(value) for value in row])
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def csv_response(filename, header, query, batch_size=None):
+    """Streaming CSV attachment of ``query``'s rows (read with yield_per) under ``header``."""
+    batch_size = batch_size or current_app.config.get('EXPORT_BATCH_SIZE', 1000)
+    rows = query.yield_per(batch_size)
+    # stream_with_context 让生成器在响应发送期间保持请求上下文（和数据库会话）
+    return Response(
+        stream_with_context(stream_csv(header, rows, batch_size)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+
+def xlsx_response(filename, sheets, batch_size=None):
+    """Streaming .xlsx attachment; ``sheets`` is a list of ``(name, header, rows)``.
+
+    ``rows`` may be a query (read with yield_per) or any other iterable of rows.
+    """
+    batch_size = batch_size or current_app.config.get('EXPORT_BATCH_SIZE', 1000)
+    sheets = [
+        (name, header, rows.yield_per(batch_size) if hasattr(rows, 'yield_per') else rows)
+        for name, header, rows in sheets
+    ]
+    return Response(
+        stream_with_context(stream_xlsx(sheets, batch_size)),
+        mimetype=XLSX_MIMETYPE,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+
+def export_response(basename, header, query, sheet_name=None):
+    """CSV or XLSX attachment of ``query`` depending on the request's ``format`` argument."""
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f'Unsupported export format: {export_format}'}), 400
+    if export_format == 'xlsx':
+        return xlsx_response(f'{basename}.xlsx', [(sheet_name or basename, header, query)])
+    return csv_response(f'{basename}.csv', header, query)
@@ -0,0 +1,266 @@
+# extract.py
+"""Columnar analytic extracts of the sales history.
+
+``flask extract-sales`` copies sale, sale_dish, dish and customer into
+compact column files under ANALYTICS_EXTRACT_DIR, so offline analysis reads
+those instead of paging through /api/orders/all against the live database:
+
+    <dir>/manifest.json             schema, high-water marks, parts, dictionaries
+    <dir>/<table>/part-00001.col    one file per appended batch of rows
+
+A part stores every column as zlib-compressed typed buffers:
+
+    int       int64 values
+    float     float64 values (the Numeric money columns)
+    bool      int8 values
+    datetime  int64 microseconds since 1970-01-01 (naive, as stored)
+    date      int32 days since 1970-01-01
+    dict      int32 codes into the column's dictionary in the manifest
+              (Status, Channel, Category, ...)
+    str       int64 end offsets + UTF-8 data, as in Arrow's string layout
+
+plus a one-byte-per-row validity buffer for a column that contains NULLs.
+
+Extracts are append-only: each run adds the rows whose primary key is above
+the table's high-water mark. Rows changed after they were extracted (an
+order completed later, a dish repriced) keep their extracted values until
+``--full`` rebuilds the extract. read_table() loads a table back into
+Python lists.
+"""
+import itertools
+import json
+import os
+import shutil
+import struct
+import sys
+import zlib
+from array import array
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, type_coerce
+
+from models import db, Customer, Dish, Sale, SaleDish
+
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+_MAGIC = b'KPCOL1\n'
+
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_DATE = _EPOCH.date()
+_MICROSECOND = timedelta(microseconds=1)
+
+# 子表在前：先取 sale_dish 的上界再取 sale 的，保证抽出的每条明细的订单、菜品、客户也都在抽取范围内
+EXTRACT_TABLES = (
+    ('sale_dish', SaleDish, (
+        ('SaleDishID', 'int'), ('SaleID', 'int'), ('DishID', 'int'), ('Quantity', 'int'), ('UnitPrice', 'float'),
+    )),
+    ('sale', Sale, (
+        ('SaleID', 'int'), ('SaleDate', 'datetime'), ('TotalAmount', 'float'), ('DiscountAmount', 'float'),
+        ('Status', 'dict'), ('OrderType', 'dict'), ('Channel', 'dict'), ('CustomerID', 'int'),
+        ('PaymentCompleted', 'bool'),
+    )),
+    ('dish', Dish, (
+        ('DishID', 'int'), ('Name', 'str'), ('Category', 'dict'), ('Price', 'float'), ('discount_price', 'float'),
+        ('Status', 'dict'), ('created_at', 'datetime'),
+    )),
+    # 不导出电话、邮箱
+    ('customer', Customer, (
+        ('CustomerID', 'int'), ('Name', 'str'), ('MemLevel', 'dict'), ('BirthDate', 'date'), ('RegDate', 'datetime'),
+        ('last_visit', 'datetime'),
+    )),
+)
+
+# kind -> (array typecode, encode, decode)
+_KINDS = {
+    'int': ('q', int, int),
+    'float': ('d', float, float),
+    'bool': ('b', int, bool),
+    'datetime': ('q', lambda value: (value - _EPOCH) // _MICROSECOND,
+                 lambda value: _EPOCH + value * _MICROSECOND),
+    'date': ('i', lambda value: (value - _EPOCH_DATE).days, lambda value: _EPOCH_DATE + timedelta(days=value)),
+    'dict': ('i', None, None),
+}
+
+
+def _encode_column(kind, values, dictionary):
+    """``{buffer name: bytes}`` for one column of a part; grows ``dictionary`` (value -> code) in place."""
+    buffers = {}
+    if any(value is None for value in values):
+        buffers['validity'] = bytes(value is not None for value in values)
+    if kind == 'str':
+        offsets, data, end = array('q'), bytearray(), 0
+        for value in values:
+            if value is not None:
+                encoded = str(value).encode('utf-8')
+                data += encoded
+                end += len(encoded)
+            offsets.append(end)
+        buffers['offsets'] = offsets.tobytes()
+        buffers['data'] = bytes(data)
+        return buffers
+    typecode, encode, _ = _KINDS[kind]
+    if kind == 'dict':
+        # NULL 编码为 -1
+        codes = (-1 if value is None else dictionary.setdefault(value, len(dictionary)) for value in values)
+        buffers['values'] = array(typecode, codes).tobytes()
+        return buffers
+    buffers['values'] = array(typecode, (0 if value is None else encode(value) for value in values)).tobytes()
+    return buffers
+
+
+def _write_part(path, schema, rows, dictionaries):
+    """Write ``rows`` as one part file (atomically); returns its size in bytes."""
+    columns = list(zip(*rows))
+    header, payload = {'rows': len(rows), 'columns': []}, []
+    for (name, kind), values in zip(schema, columns):
+        buffers = _encode_column(kind, values, dictionaries.get(name))
+        compressed = {key: zlib.compress(buffer) for key, buffer in buffers.items()}
+        header['columns'].append({'name': name, 'buffers': {key: len(data) for key, data in compressed.items()}})
+        payload.extend(compressed.values())
+    header = json.dumps(header).encode('utf-8')
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as part:
+        part.write(_MAGIC)
+        part.write(struct.pack('<I', len(header)))
+        part.write(header)
+        for data in payload:
+            part.write(data)
+    os.replace(temp_path, path)
+    return os.path.getsize(path)
+
+
+def _read_part(path):
+    """``(rows, {column: {buffer name: bytes}})`` of a part file."""
+    with open(path, 'rb') as part:
+        if part.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError(f'{path} is not a column extract part')
+        header_length, = struct.unpack('<I', part.read(4))
+        header = json.loads(part.read(header_length))
+        columns = {}
+        for column in header['columns']:
+            columns[column['name']] = {
+                key: zlib.decompress(part.read(length)) for key, length in column['buffers'].items()
+            }
+    return header['rows'], columns
+
+
+def load_manifest(directory):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {'version': FORMAT_VERSION, 'byteorder': sys.byteorder, 'tables': {}}
+    with open(path, encoding='utf-8') as manifest:
+        return json.load(manifest)
+
+
+def _save_manifest(directory, manifest):
+    path = os.path.join(directory, MANIFEST)
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as temp:
+        json.dump(manifest, temp, ensure_ascii=False, indent=1)
+    os.replace(f'{path}.tmp', path)
+
+
+def extract_sales_history(directory, full=False, batch_size=100_000):
+    """Append the sale, sale_dish, dish and customer rows added since the last run to the extract in ``directory``.
+
+    ``full`` discards the existing extract first. Returns one
+    ``{'table', 'new_rows', 'rows', 'parts', 'bytes'}`` dict per table.
+    """
+    os.makedirs(directory, exist_ok=True)
+    if full:
+        for table, _, _ in EXTRACT_TABLES:
+            shutil.rmtree(os.path.join(directory, table), ignore_errors=True)
+        if os.path.exists(os.path.join(directory, MANIFEST)):
+            os.remove(os.path.join(directory, MANIFEST))
+    manifest = load_manifest(directory)
+    if manifest.get('version') != FORMAT_VERSION or manifest.get('byteorder') != sys.byteorder:
+        raise ValueError('Extract was written by another format version or platform; run with --full')
+
+    # 先固定每张表本次的上界，抽取过程中新写入的行留给下一次
+    upper = {
+        table: db.session.query(func.max(getattr(model, schema[0][0]))).scalar() or 0
+        for table, model, schema in EXTRACT_TABLES
+    }
+
+    results = []
+    for table, model, schema in EXTRACT_TABLES:
+        state = manifest['tables'].setdefault(table, {
+            'columns': [list(column) for column in schema], 'high_water': 0, 'rows': 0, 'bytes': 0,
+            'parts': [], 'dictionaries': {name: [] for name, kind in schema if kind == 'dict'}
+        })
+        if state['columns'] != [list(column) for column in schema]:
+            raise ValueError(f'The {table} columns changed since the last extract; run with --full')
+        os.makedirs(os.path.join(directory, table), exist_ok=True)
+
+        dictionaries = {
+            name: {value: code for code, value in enumerate(values)}
+            for name, values in state['dictionaries'].items()
+        }
+        pk = getattr(model, schema[0][0])
+        columns = [
+            type_coerce(getattr(model, name), db.Float) if kind == 'float' else getattr(model, name)
+            for name, kind in schema
+        ]
+        query = db.session.query(*columns) \
+            .filter(pk > state['high_water'], pk <= upper[table]) \
+            .order_by(pk) \
+            .yield_per(batch_size)
+
+        new_rows = 0
+        rows = iter(query)
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            name = f'part-{len(state["parts"]) + 1:05d}.col'
+            size = _write_part(os.path.join(directory, table, name), schema, batch, dictionaries)
+            state['parts'].append({'file': name, 'rows': len(batch), 'first': batch[0][0], 'last': batch[-1][0]})
+            state['dictionaries'] = {column: list(values) for column, values in dictionaries.items()}
+            state['high_water'] = batch[-1][0]
+            state['rows'] += len(batch)
+            state['bytes'] += size
+            state['updated_at'] = datetime.now().isoformat(timespec='seconds')
+            # 每个分片写完就更新清单，中断后下次从这里续上
+            _save_manifest(directory, manifest)
+            new_rows += len(batch)
+
+        results.append({'table': table, 'new_rows': new_rows, 'rows': state['rows'],
+                        'parts': len(state['parts']), 'bytes': state['bytes']})
+    _save_manifest(directory, manifest)
+    return results
+
+
+def read_table(directory, table, columns=None):
+    """Load an extracted table as ``{column: [values]}``; NULLs come back as None.
+
+    ``columns`` limits the columns decoded (all by default).
+    """
+    manifest = load_manifest(directory)
+    if table not in manifest['tables']:
+        raise KeyError(f'No extract for table {table!r} in {directory}')
+    state = manifest['tables'][table]
+    schema = [(name, kind) for name, kind in state['columns'] if columns is None or name in columns]
+    result = {name: [] for name, kind in schema}
+    for part in state['parts']:
+        row_count, buffers = _read_part(os.path.join(directory, table, part['file']))
+        for name, kind in schema:
+            column = buffers[name]
+            if kind == 'str':
+                offsets = array('q')
+                offsets.frombytes(column['offsets'])
+                data, start, values = column['data'], 0, []
+                for end in offsets:
+                    values.append(data[start:end].decode('utf-8'))
+                    start = end
+            else:
+                typecode, _, decode = _KINDS[kind]
+                raw = array(typecode)
+                raw.frombytes(column['values'])
+                if kind == 'dict':
+                    dictionary = state['dictionaries'][name]
+                    values = [dictionary[code] if code >= 0 else None for code in raw]
+                else:
+                    values = list(map(decode, raw))
+            if 'validity' in column:
+                values = [value if valid else None for value, valid in zip(values, column['validity'])]
+            result[name].extend(values)
+    return result
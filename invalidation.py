@@ -0,0 +1,194 @@
+# invalidation.py
+"""Invalidation bus driven by SQLAlchemy session events.
+
+Every flush records which rows were inserted, updated or deleted, keyed by
+table name. When the transaction commits the accumulated ChangeSet is
+published to the subscribers of the touched tables:
+
+* ``before_commit`` subscribers run inside the transaction, after the final
+  flush, and may write derived data (the daily sales rollup) so that it
+  commits atomically with the change;
+* ``after_commit`` subscribers run once the data is durable and drop
+  in-process state (response caches, cached counts). Their errors are logged,
+  never raised.
+
+Writes that bypass the unit of work (bulk_insert_mappings, Core inserts) must
+report themselves with mark_changed(), with the keys and/or column values of
+the written rows when known so subscribers can stay incremental. ORM bulk
+``query.update()`` / ``query.delete()`` are recorded automatically but
+without primary keys.
+"""
+import logging
+from collections import defaultdict
+
+from sqlalchemy import event, inspect
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+_PENDING_KEY = 'invalidation_changes'
+
+# phase -> [(tables, callback)]
+_subscribers = {'before_commit': [], 'after_commit': []}
+
+
+class ChangeSet:
+    """Tables, primary keys and row snapshots touched by one transaction."""
+
+    def __init__(self):
+        self._keys = defaultdict(set)
+        self._rows = defaultdict(list)
+        self._bulk = set()
+
+    @property
+    def tables(self):
+        return set(self._keys) | self._bulk
+
+    def keys(self, table):
+        """Primary keys known to have changed in ``table``."""
+        return self._keys.get(table, set())
+
+    def rows(self, table):
+        """Column values of the flushed ``table`` rows (new, dirty or deleted), as dicts.
+
+        Values are captured at flush time, so they stay readable after the
+        commit has expired the ORM instances. An updated row appears twice:
+        with its new values, and with the previous values of the changed
+        columns (e.g. the old SaleDate of a moved sale).
+        """
+        return self._rows.get(table, [])
+
+    def is_bulk(self, table):
+        """True if ``table`` was changed by a statement whose rows are unknown."""
+        return table in self._bulk
+
+    def add_instance(self, obj):
+        state = inspect(obj)
+        table = obj.__table__.name
+        # after_flush 时新对象还没有 identity key，直接从实例属性取主键
+        key = state.mapper.primary_key_from_instance(obj)
+        self._keys[table].add(key[0] if len(key) == 1 else tuple(key))
+        row = {attr.key: state.dict[attr.key] for attr in state.mapper.column_attrs if attr.key in state.dict}
+        self._rows[table].append(row)
+        # after_flush 时属性历史还在：改过的列再记一份旧值
+        previous = {}
+        for attr in state.mapper.column_attrs:
+            deleted = state.attrs[attr.key].history.deleted
+            if deleted:
+                previous[attr.key] = deleted[0]
+        if previous:
+            self._rows[table].append({**row, **previous})
+
+    def add_keys(self, table, keys=None, rows=None):
+        if keys is None and rows is None:
+            self._bulk.add(table)
+            return
+        self._keys[table].update(keys or ())
+        if rows is not None:
+            self._rows[table].extend(dict(row) for row in rows)
+
+    def __bool__(self):
+        return bool(self._keys or self._bulk)
+
+    def __repr__(self):
+        return f'<ChangeSet {sorted(self.tables)}>'
+
+
+def subscribe(tables, callback, phase='after_commit'):
+    """Call ``callback(session, changes)`` when a commit touches any of ``tables``."""
+    if phase not in _subscribers:
+        raise ValueError(f'Unknown phase: {phase}')
+    _subscribers[phase].append((frozenset(tables), callback))
+    return callback
+
+
+def on_change(*tables, phase='after_commit'):
+    """Decorator form of subscribe()."""
+    def decorator(callback):
+        return subscribe(tables, callback, phase)
+    return decorator
+
+
+def _pending(session):
+    changes = session.info.get(_PENDING_KEY)
+    if changes is None:
+        changes = session.info[_PENDING_KEY] = ChangeSet()
+    return changes
+
+
+def mark_changed(session, table, keys=None, rows=None):
+    """Record a write the session events cannot see.
+
+    ``table`` is a model class or table name. ``rows`` are the column values
+    of the written rows (dicts keyed like ChangeSet.rows()), for writes whose
+    primary keys are not known, e.g. executemany inserts. Without keys or
+    rows the affected rows are unknown and the table is marked as bulk.
+    """
+    if not isinstance(table, str):
+        table = table.__table__.name
+    _pending(session).add_keys(table, keys, rows)
+
+
+def _table_of(statement_context):
+    mapper = statement_context.mapper
+    return mapper.local_table.name if mapper is not None else None
+
+
+@event.listens_for(db.session, 'after_flush')
+def _record_flush(session, flush_context):
+    changes = _pending(session)
+    for obj in session.new:
+        changes.add_instance(obj)
+    for obj in session.deleted:
+        changes.add_instance(obj)
+    for obj in session.dirty:
+        if session.is_modified(obj, include_collections=False):
+            changes.add_instance(obj)
+
+
+@event.listens_for(db.session, 'after_bulk_update')
+def _record_bulk_update(update_context):
+    table = _table_of(update_context)
+    if table:
+        mark_changed(update_context.session, table)
+
+
+@event.listens_for(db.session, 'after_bulk_delete')
+def _record_bulk_delete(delete_context):
+    table = _table_of(delete_context)
+    if table:
+        mark_changed(delete_context.session, table)
+
+
+def _subscribers_for(phase, changes):
+    touched = changes.tables
+    return [callback for tables, callback in _subscribers[phase] if tables & touched]
+
+
+@event.listens_for(db.session, 'before_commit')
+def _publish_before_commit(session):
+    # 先把未刷新的改动刷进事务，变更集才完整
+    session.flush()
+    changes = session.info.get(_PENDING_KEY)
+    if not changes:
+        return
+    for callback in _subscribers_for('before_commit', changes):
+        callback(session, changes)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _publish_after_commit(session):
+    changes = session.info.pop(_PENDING_KEY, None)
+    if not changes:
+        return
+    for callback in _subscribers_for('after_commit', changes):
+        try:
+            callback(session, changes)
+        except Exception:
+            logger.exception('Invalidation subscriber %r failed for %r', callback, changes)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_on_rollback(session):
+    session.info.pop(_PENDING_KEY, None)
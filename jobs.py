@@ -0,0 +1,164 @@
+# jobs.py
+"""Background job runner backed by the job table.
+
+A job kind is registered with register_job(kind, chunk, total=None):
+
+* ``chunk(session, cursor, chunk_size, **params)`` does one unit of work
+  after ``cursor`` (None on the first call) and returns
+  ``(next_cursor, rows_created)``; ``next_cursor`` None means finished;
+* ``total(**params)`` optionally returns the number of rows expected, for
+  the progress percentage.
+
+enqueue() stores a queued row and hands the id to a thread pool. Each chunk
+commits together with the job's new Cursor and Processed count, so a job
+interrupted by a restart resumes after the last committed chunk:
+resume_unfinished(), called when the server starts, resubmits queued jobs
+and running jobs whose heartbeat (UpdatedAt) is older than
+JOB_STALE_SECONDS.
+"""
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, or_, update
+from sqlalchemy.exc import OperationalError
+
+from models import db, Job
+
+logger = logging.getLogger(__name__)
+
+_handlers = {} # kind -> (chunk, total)
+
+
+def register_job(kind, chunk, total=None):
+    _handlers[kind] = (chunk, total)
+
+
+def _abandoned(stale_seconds):
+    """Running jobs whose worker stopped sending heartbeats."""
+    return and_(Job.Status == 'running',
+                Job.UpdatedAt < datetime.utcnow() - timedelta(seconds=stale_seconds))
+
+
+def _claim(job_id, stale_seconds):
+    """Atomically move a queued (or abandoned running) job to running; False if someone else has it."""
+    now = datetime.utcnow()
+    claimed = db.session.execute(
+        update(Job)
+        .where(Job.JobID == job_id, or_(Job.Status == 'queued', _abandoned(stale_seconds)))
+        .values(Status='running', StartedAt=func.coalesce(Job.StartedAt, now), UpdatedAt=now)
+    ).rowcount
+    db.session.commit()
+    return claimed == 1
+
+
+def _finish(job_id, status, error=None):
+    now = datetime.utcnow()
+    db.session.execute(update(Job).where(Job.JobID == job_id)
+                       .values(Status=status, Error=error, UpdatedAt=now, FinishedAt=now))
+    db.session.commit()
+
+
+def run_job(job_id, chunk_size=1000, stale_seconds=60):
+    """Run (or resume) one job to completion in the current app context."""
+    if not _claim(job_id, stale_seconds):
+        return
+    job = Job.query.get(job_id)
+    kind = job.Kind
+    try:
+        chunk, total = _handlers[kind]
+        params = json.loads(job.Params or '{}')
+        if job.Total is None and total is not None:
+            job.Total = total(**params)
+            db.session.commit()
+
+        cursor = job.Cursor
+        while True:
+            next_cursor, created = chunk(db.session, cursor, chunk_size, **params)
+            # 进度和本块数据在同一事务里提交，中断后从 Cursor 继续不会重复
+            db.session.execute(
+                update(Job).where(Job.JobID == job_id)
+                .values(Cursor=next_cursor if next_cursor is not None else cursor,
+                        Processed=Job.Processed + created, UpdatedAt=datetime.utcnow())
+            )
+            db.session.commit()
+            if next_cursor is None:
+                break
+            cursor = next_cursor
+        _finish(job_id, 'completed')
+    except Exception as e:
+        db.session.rollback()
+        logger.exception('Job %s (%s) failed', job_id, kind)
+        _finish(job_id, 'failed', str(e))
+
+
+class JobRunner:
+    """Thread pool that executes jobs inside the Flask app context."""
+
+    def __init__(self):
+        self.app = None
+        self._executor = None
+
+    def init_app(self, app):
+        """Configure from JOB_WORKERS / JOB_CHUNK_SIZE / JOB_STALE_SECONDS; no thread starts until a job is submitted."""
+        self.app = app
+        self._executor = ThreadPoolExecutor(max_workers=app.config.get('JOB_WORKERS', 1),
+                                            thread_name_prefix='job')
+        app.extensions['job_runner'] = self
+
+    def resume_unfinished(self):
+        """Resubmit queued and abandoned jobs (in the background); call once when the server starts."""
+        self._executor.submit(self._resume_unfinished)
+
+    def enqueue(self, kind, **params):
+        """Store a queued job and schedule it; returns the Job."""
+        if kind not in _handlers:
+            raise ValueError(f'Unknown job kind: {kind}')
+        job = Job(Kind=kind, Status='queued', Params=json.dumps(params), Processed=0)
+        db.session.add(job)
+        db.session.commit()
+        self.submit(job.JobID)
+        return job
+
+    def resume(self, job_id):
+        """Requeue a failed or abandoned job; it continues after its last committed chunk."""
+        stale_seconds = self.app.config.get('JOB_STALE_SECONDS', 60)
+        resumed = db.session.execute(
+            update(Job).where(Job.JobID == job_id, or_(Job.Status == 'failed', _abandoned(stale_seconds)))
+            .values(Status='queued', Error=None, FinishedAt=None)
+        ).rowcount
+        db.session.commit()
+        if resumed:
+            self.submit(job_id)
+        return bool(resumed)
+
+    def submit(self, job_id):
+        self._executor.submit(self._run, job_id)
+
+    def _run(self, job_id):
+        with self.app.app_context():
+            try:
+                run_job(job_id, self.app.config.get('JOB_CHUNK_SIZE', 1000),
+                        self.app.config.get('JOB_STALE_SECONDS', 60))
+            except Exception:
+                logger.exception('Job runner error for job %s', job_id)
+            finally:
+                db.session.remove()
+
+    def _resume_unfinished(self):
+        stale_seconds = self.app.config.get('JOB_STALE_SECONDS', 60)
+        with self.app.app_context():
+            try:
+                job_ids = [job_id for (job_id,) in db.session.query(Job.JobID).filter(
+                    or_(Job.Status == 'queued', _abandoned(stale_seconds)))]
+            except OperationalError:
+                # 旧数据库还没有 job 表（flask upgrade-db 后即可）
+                job_ids = []
+            finally:
+                db.session.remove()
+        for job_id in job_ids:
+            self.submit(job_id)
+
+
+job_runner = JobRunner()
@@ -112,7 +112,7 @@ class BuyList(db.Model):
 class Inventory(db.Model):
     __tablename__ = 'inventory'
     InventoryID = db.Column(db.Integer, primary_key=True)
-    ItemID = db.Column(db.Integer, db.ForeignKey('item.ItemID'), nullable=False)
+    ItemID = db.Column(db.Integer, db.ForeignKey('item.ItemID'), nullable=False, index=True)
     StockLevel = db.Column(db.Float, default=0)
     ReorderLevel = db.Column(db.Float, default=10)
     last_purchase_date = db.Column(db.DateTime)
@@ -146,11 +146,19 @@ class Inventory(db.Model):
         }
 
 
+# 库存扣减台账：已完成订单入队一次，扣减库存后记录 DepletedAt，保证同一订单只扣一次
+class InventoryDepletion(db.Model):
+    __tablename__ = 'inventory_depletion'
+    SaleID = db.Column(db.Integer, db.ForeignKey('sale.SaleID'), primary_key=True)
+    QueuedAt = db.Column(db.DateTime, default=datetime.utcnow)
+    DepletedAt = db.Column(db.DateTime, nullable=True, index=True) # NULL = waiting to be applied
+
+
 # 菜品原料关系
 class DishIngredient(db.Model):
     __tablename__ = 'dish_ingredient'
     DishIngredientID = db.Column(db.Integer, primary_key=True)
-    DishID = db.Column(db.Integer, db.ForeignKey('dish.DishID'), nullable=False)
+    DishID = db.Column(db.Integer, db.ForeignKey('dish.DishID'), nullable=False, index=True)
     ItemID = db.Column(db.Integer, db.ForeignKey('item.ItemID'), nullable=False)
     Quantity = db.Column(db.Float, nullable=False) # Amount of item per dish
 
@@ -169,6 +177,33 @@ class DishIngredient(db.Model):
         }
 
 
+# 原料价格历史：调价时新增一行，某天的价格取该天及之前最近生效的一行
+class ItemPrice(db.Model):
+    __tablename__ = 'item_price'
+    __table_args__ = (
+        db.Index('ix_item_price_item_effective', 'ItemID', 'EffectiveDate'),
+    )
+    ItemPriceID = db.Column(db.Integer, primary_key=True)
+    ItemID = db.Column(db.Integer, db.ForeignKey('item.ItemID'), nullable=False)
+    VendorID = db.Column(db.Integer, db.ForeignKey('vendor.VendorID'), nullable=True)
+    EffectiveDate = db.Column(db.Date, nullable=False, default=date.today)
+    UnitPrice = db.Column(db.Numeric(10, 2), nullable=False) # Price per Item.DefaultUnit
+    CreatedAt = db.Column(db.DateTime, default=datetime.utcnow)
+
+    item = db.relationship('Item', backref=db.backref('prices', lazy=True))
+    vendor = db.relationship('Vendor')
+
+    def to_dict(self):
+        return {
+            'ItemPriceID': self.ItemPriceID,
+            'ItemID': self.ItemID,
+            'VendorID': self.VendorID,
+            'VendorName': self.vendor.Name if self.vendor else None,
+            'EffectiveDate': self.EffectiveDate.strftime('%Y-%m-%d') if self.EffectiveDate else None,
+            'UnitPrice': float(self.UnitPrice) if self.UnitPrice is not None else None
+        }
+
+
 # 供应商模型
 class Vendor(db.Model):
     __tablename__ = 'vendor'
@@ -215,6 +250,10 @@ class Vendor(db.Model):
 # 采购模型
 class Purchase(db.Model):
     __tablename__ = 'purchase'
+    __table_args__ = (
+        # 月度采购支出按状态 + 日期范围过滤
+        db.Index('ix_purchase_status_orderdate', 'Status', 'OrderDate'),
+    )
     PurchaseID = db.Column(db.Integer, primary_key=True)
     OrderDate = db.Column(db.DateTime, default=datetime.utcnow)
     DeliveryDate = db.Column(db.DateTime, nullable=True) # Can be null initially
@@ -282,6 +321,13 @@ class PurchaseItem(db.Model):
 # 销售模型
 class Sale(db.Model):
     __tablename__ = 'sale'
+    __table_args__ = (
+        # 分析类查询几乎都按 Status + SaleDate 范围过滤
+        db.Index('ix_sale_status_saledate', 'Status', 'SaleDate'),
+        db.Index('ix_sale_customerid_saledate', 'CustomerID', 'SaleDate'),
+        # 不区分状态的日期范围（今日订单数、订单列表排序）
+        db.Index('ix_sale_saledate', 'SaleDate'),
+    )
     SaleID = db.Column(db.Integer, primary_key=True)
     SaleDate = db.Column(db.DateTime, default=datetime.utcnow)
     TotalAmount = db.Column(db.Numeric(10, 2), default=0.00) # Use Numeric
@@ -355,8 +401,8 @@ class Sale(db.Model):
 class SaleDish(db.Model):
     __tablename__ = 'sale_dish'
     SaleDishID = db.Column(db.Integer, primary_key=True)
-    SaleID = db.Column(db.Integer, db.ForeignKey('sale.SaleID'), nullable=False)
-    DishID = db.Column(db.Integer, db.ForeignKey('dish.DishID'), nullable=False)
+    SaleID = db.Column(db.Integer, db.ForeignKey('sale.SaleID'), nullable=False, index=True)
+    DishID = db.Column(db.Integer, db.ForeignKey('dish.DishID'), nullable=False, index=True)
     Quantity = db.Column(db.Integer, default=1)
     UnitPrice = db.Column(db.Numeric(10, 2), nullable=False) # Use Numeric
 
@@ -379,11 +425,90 @@ class SaleDish(db.Model):
             'Subtotal': float(subtotal_val) # Convert to float for JSON
         }
 
+# 每日销售汇总模型（物化表，由 rollup.py 在订单写入时按天增量维护）
+class DailySalesRollup(db.Model):
+    __tablename__ = 'daily_sales_rollup'
+    __table_args__ = (
+        db.UniqueConstraint('Day', 'Channel', 'Status', 'Category', name='uq_daily_sales_rollup_key'),
+    )
+    RollupID = db.Column(db.Integer, primary_key=True)
+    Day = db.Column(db.Date, nullable=False)
+    Channel = db.Column(db.String(20))
+    Status = db.Column(db.String(20))
+    Category = db.Column(db.String(50)) # Dish category; NULL for orders without line items
+    # Order TotalAmount/DiscountAmount split across categories by line subtotal
+    Revenue = db.Column(db.Numeric(12, 2), default=0)
+    Discount = db.Column(db.Numeric(12, 2), default=0)
+    LineRevenue = db.Column(db.Numeric(12, 2), default=0) # Sum of UnitPrice * Quantity
+    Orders = db.Column(db.Integer, default=0) # Distinct orders containing this category
+    Lines = db.Column(db.Integer, default=0) # SaleDish rows
+    Units = db.Column(db.Integer, default=0) # Sum of SaleDish.Quantity
+
+    def to_dict(self):
+        return {
+            'Day': self.Day.strftime('%Y-%m-%d') if self.Day else None,
+            'Channel': self.Channel,
+            'Status': self.Status,
+            'Category': self.Category,
+            'Revenue': float(self.Revenue) if self.Revenue else 0.0,
+            'Discount': float(self.Discount) if self.Discount else 0.0,
+            'LineRevenue': float(self.LineRevenue) if self.LineRevenue else 0.0,
+            'Orders': self.Orders,
+            'Lines': self.Lines,
+            'Units': self.Units
+        }
+
+
+# 后台任务：分块执行，每块提交时同时记录 Cursor 和进度，中断后可从 Cursor 继续
+class Job(db.Model):
+    __tablename__ = 'job'
+    JobID = db.Column(db.Integer, primary_key=True)
+    Kind = db.Column(db.String(50), nullable=False) # e.g. create-receivables
+    Status = db.Column(db.String(20), default='queued', index=True) # queued, running, completed, failed
+    Params = db.Column(db.Text) # JSON
+    Cursor = db.Column(db.Integer) # Last source key processed (keyset chunking)
+    Total = db.Column(db.Integer) # Rows expected when the job started
+    Processed = db.Column(db.Integer, default=0) # Rows created so far
+    Error = db.Column(db.Text)
+    CreatedAt = db.Column(db.DateTime, default=datetime.utcnow)
+    StartedAt = db.Column(db.DateTime)
+    UpdatedAt = db.Column(db.DateTime, default=datetime.utcnow) # Heartbeat, bumped after every chunk
+    FinishedAt = db.Column(db.DateTime)
+
+    def to_dict(self):
+        progress = None
+        if self.Status == 'completed':
+            progress = 100.0
+        elif self.Total:
+            progress = round(min(self.Processed or 0, self.Total) * 100.0 / self.Total, 1)
+        return {
+            'JobID': self.JobID,
+            'Kind': self.Kind,
+            'Status': self.Status,
+            'Total': self.Total,
+            'Processed': self.Processed or 0,
+            'Progress': progress,
+            'Error': self.Error,
+            'CreatedAt': self.CreatedAt.strftime('%Y-%m-%d %H:%M:%S') if self.CreatedAt else None,
+            'StartedAt': self.StartedAt.strftime('%Y-%m-%d %H:%M:%S') if self.StartedAt else None,
+            'FinishedAt': self.FinishedAt.strftime('%Y-%m-%d %H:%M:%S') if self.FinishedAt else None
+        }
+
+
+# 财务报表快照：财务页面直接读取最新一份，由后台定时或 flask rebuild-financial-snapshot 重建
+class FinancialSnapshot(db.Model):
+    __tablename__ = 'financial_snapshot'
+    SnapshotID = db.Column(db.Integer, primary_key=True)
+    GeneratedAt = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True) # Local time
+    AsOf = db.Column(db.Date, nullable=False) # Day the summary was computed for
+    BuildMs = db.Column(db.Float) # Time taken to compute the summary
+    Summary = db.Column(db.Text, nullable=False) # JSON of get_financial_summary()
+
 # 客户模型
 class Customer(db.Model):
     __tablename__ = 'customer'
     CustomerID = db.Column(db.Integer, primary_key=True)
-    Name = db.Column(db.String(100), nullable=False)
+    Name = db.Column(db.String(100), nullable=False, index=True) # 订单列表可按客户名排序
     BirthDate = db.Column(db.Date, nullable=True)
     PhoneNum = db.Column(db.String(20), unique=True)
     Email = db.Column(db.String(100))
@@ -396,10 +521,17 @@ class Customer(db.Model):
     feedback = db.relationship('Feedback', backref='customer', lazy=True)
     receivables = db.relationship('Receivable', backref='customer', lazy=True)
 
-    def to_dict(self):
+    def to_dict(self, total_orders=None):
+        """Serialize the customer.
+
+        Bulk callers should pass ``total_orders`` (completed order count) from a
+        grouped query; otherwise it is counted here with one COUNT query.
+        """
         inactive_days = (datetime.utcnow() - self.last_visit).days if self.last_visit else None
-        # Correctly count sales using the backref
-        total_orders = len([sale for sale in self.sales if sale.Status == 'Completed'])
+        if total_orders is None:
+            total_orders = db.session.query(func.count(Sale.SaleID))\
+                .filter(Sale.CustomerID == self.CustomerID, Sale.Status == 'Completed')\
+                .scalar()
 
         # Calculate age if birthdate is provided
         age = None
@@ -487,11 +619,18 @@ class Feedback(db.Model):
 # 应付款模型
 class Payable(db.Model):
     __tablename__ = 'payable'
+    __table_args__ = (
+        # 账龄报表：只收录未结清单据，按供应商顺序读索引，不回表
+        db.Index('ix_payable_open_aging', 'VendorID', 'PayableDate', 'PayableAmount', 'PayableStatus',
+                 sqlite_where=db.text("PayableStatus != 'Paid'")),
+        # 应付列表：按状态过滤、按到期日排序
+        db.Index('ix_payable_status_date', 'PayableStatus', 'PayableDate'),
+    )
     PayableID = db.Column(db.Integer, primary_key=True)
     PayableStatus = db.Column(db.String(20), default='Unpaid') # Unpaid, Paid, Overdue
     PayableDate = db.Column(db.DateTime) # Due date
     PayableAmount = db.Column(db.Numeric(10, 2)) # Use Numeric
-    PurchaseID = db.Column(db.Integer, db.ForeignKey('purchase.PurchaseID'), nullable=True) # Can be non-purchase related
+    PurchaseID = db.Column(db.Integer, db.ForeignKey('purchase.PurchaseID'), nullable=True, index=True) # Can be non-purchase related
     VendorID = db.Column(db.Integer, db.ForeignKey('vendor.VendorID'))
     PaidDate = db.Column(db.DateTime, nullable=True) # Actual payment date
     CreatedAt = db.Column(db.DateTime, default=datetime.utcnow)
@@ -517,11 +656,18 @@ class Payable(db.Model):
 # 应收款模型
 class Receivable(db.Model):
     __tablename__ = 'receivable'
+    __table_args__ = (
+        # 账龄报表：只收录未结清单据，按客户顺序读索引，不回表也不排序
+        db.Index('ix_receivable_open_aging', 'CustomerID', 'ReceivableDate', 'ReceivableAmount', 'Status',
+                 sqlite_where=db.text("Status != 'Paid'")),
+        # 应收列表：按状态过滤、按到期日排序
+        db.Index('ix_receivable_status_date', 'Status', 'ReceivableDate'),
+    )
     ReceivableID = db.Column(db.Integer, primary_key=True)
     ReceivableDate = db.Column(db.DateTime, nullable=False) # Due date
     Status = db.Column(db.String(20), default='Unpaid') # Unpaid, Paid, Overdue, Cancelled
     ReceivableAmount = db.Column(db.Numeric(10, 2), nullable=False) # Use Numeric
-    SaleID = db.Column(db.Integer, db.ForeignKey('sale.SaleID'), nullable=False) # Must be linked to a sale
+    SaleID = db.Column(db.Integer, db.ForeignKey('sale.SaleID'), nullable=False, index=True) # Must be linked to a sale
     CustomerID = db.Column(db.Integer, db.ForeignKey('customer.CustomerID'), nullable=False) # Must be linked to a customer
     # --- 已注释掉 PaidDate 字段 ---
     # PaidDate = db.Column(db.DateTime, nullable=True) # Actual payment date
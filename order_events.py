@@ -0,0 +1,105 @@
+# order_events.py
+"""In-process broker for the live order event stream (server-sent events).
+
+order_api publishes a small delta after each committed order write
+(``order_created``, ``status_changed``, ``paid``); every connected
+/api/orders/stream client has its own bounded queue. Events are formatted
+once, numbered, and the most recent ones are kept so a reconnecting
+EventSource can resume from its Last-Event-ID.
+
+Like the response cache, the broker lives in the worker process: run a
+single worker (or put a shared pub/sub in front) if screens must see writes
+made through other workers.
+"""
+import itertools
+import json
+import queue
+import threading
+from collections import deque
+
+KEEPALIVE_SECONDS = 15
+CLIENT_QUEUE_SIZE = 256
+BACKLOG_SIZE = 500
+
+
+class EventBroker:
+    """Fan-out of formatted SSE messages to per-client queues."""
+
+    def __init__(self, backlog_size=BACKLOG_SIZE, queue_size=CLIENT_QUEUE_SIZE):
+        self._ids = itertools.count(1)
+        self._backlog = deque(maxlen=backlog_size) # (event id, message)
+        self._clients = set()
+        self._lock = threading.Lock()
+        self.queue_size = queue_size
+
+    def publish(self, event_type, data):
+        """Send ``data`` (JSON-serialisable) as an ``event_type`` event to every client."""
+        with self._lock:
+            event_id = next(self._ids)
+            message = f'id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n'
+            self._backlog.append((event_id, message))
+            clients = list(self._clients)
+        for client in clients:
+            try:
+                client.put_nowait(message)
+            except queue.Full:
+                # 客户端跟不上就断开它，EventSource 会带 Last-Event-ID 重连补齐
+                self.unsubscribe(client)
+                with client.mutex:
+                    client.queue.clear()
+                client.put_nowait(None)
+        return event_id
+
+    def subscribe(self, last_event_id=None):
+        """Register a client; returns ``(queue, missed messages since last_event_id)``."""
+        client = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._clients.add(client)
+            missed = [message for event_id, message in self._backlog
+                      if last_event_id is not None and event_id > last_event_id]
+        return client, missed
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    @property
+    def client_count(self):
+        with self._lock:
+            return len(self._clients)
+
+    def stream(self, last_event_id=None):
+        """Generator of SSE text for one client; ends when the client is dropped."""
+        client, missed = self.subscribe(last_event_id)
+        try:
+            yield 'retry: 5000\n\n'
+            yield from missed
+            while True:
+                try:
+                    message = client.get(timeout=KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ': keepalive\n\n' # 防止代理因空闲关闭连接
+                    continue
+                if message is None:
+                    break
+                yield message
+        finally:
+            self.unsubscribe(client)
+
+
+def sale_payload(sale, **extra):
+    """Fields of a Sale sent with every order event, plus ``extra``."""
+    payload = {
+        'SaleID': sale.SaleID,
+        'SaleDate': sale.SaleDate.strftime('%Y-%m-%d %H:%M:%S') if sale.SaleDate else None,
+        'Status': sale.Status,
+        'Channel': sale.Channel,
+        'OrderType': sale.OrderType,
+        'TotalAmount': float(sale.TotalAmount or 0.0),
+        'PaymentCompleted': sale.PaymentCompleted
+    }
+    payload.update(extra)
+    return payload
+
+
+order_events = EventBroker()
@@ -0,0 +1,107 @@
+# query_plan_check.py
+"""Query regression checks for the hot endpoints.
+
+Each endpoint is requested through the Flask test client while the SQL it
+issues is captured. check_query_plans() re-runs every captured SELECT under
+EXPLAIN QUERY PLAN; a bare ``SCAN <table>`` step on one of the large tables
+means a filter stopped using its index. check_query_counts() compares the
+number of statements against a fixed per-endpoint budget, which catches
+N+1 lazy loading as soon as a table holds more rows than the budget.
+"""
+import re
+
+from sqlalchemy import event
+
+from cache import response_cache
+from models import db
+
+# 每个仪表盘标签页都会轮询的接口
+HOT_ENDPOINTS = [
+    '/api/dashboard/sales_summary',
+    '/dashboard/sales',
+    '/api/dashboard/sales_distribution',
+    '/api/sales/trend',
+    '/api/products/bestsellers',
+    '/api/products/category-stats',
+    '/api/finance/receivables?status=Unpaid',
+    '/api/finance/payables?status=Unpaid',
+]
+
+# 随业务增长的表；其余小表（dish、customer 等）全表扫描可以接受
+WATCHED_TABLES = ('sale', 'sale_dish', 'receivable', 'payable')
+
+# 列表接口允许的最大 SQL 语句数；与行数无关
+QUERY_BUDGETS = {
+    '/api/item/all': 1,
+    '/api/customers': 1,
+    '/api/inventory/all': 1,
+    '/api/inventory/low_stock': 1,
+    # 总数 + 一页记录（客户/供应商 JOIN 进同一条语句）
+    '/api/finance/receivables': 2,
+    '/api/finance/payables': 2,
+}
+
+# SQLite >= 3.36 输出 "SCAN sale"，旧版本输出 "SCAN TABLE sale"；带 USING INDEX 的不算
+_FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$')
+
+
+def explain(conn, statement, parameters=()):
+    """Return the EXPLAIN QUERY PLAN detail lines for a raw SQL statement."""
+    rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+    return [row[-1] for row in rows]
+
+
+def capture_statements(app, endpoint):
+    """Request ``endpoint`` and return ``(response, [(statement, parameters), ...])``."""
+    statements = []
+
+    def _capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    # 缓存命中时不会发出 SQL，先清空才能检查真实查询
+    response_cache.clear()
+    event.listen(db.engine, 'before_cursor_execute', _capture)
+    try:
+        response = app.test_client().get(endpoint)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', _capture)
+    return response, statements
+
+
+def check_query_plans(app, endpoints=None):
+    """Request each hot endpoint and report statements that full-scan a watched table.
+
+    Returns a list of ``(endpoint, statement, detail)`` tuples; an empty list
+    means every captured query was answered from an index.
+    """
+    failures = []
+    with app.app_context():
+        for endpoint in endpoints or HOT_ENDPOINTS:
+            response, statements = capture_statements(app, endpoint)
+            if response.status_code >= 400:
+                failures.append((endpoint, None, f'HTTP {response.status_code}'))
+                continue
+
+            with db.engine.connect() as conn:
+                for statement, parameters in statements:
+                    if not statement.lstrip().upper().startswith('SELECT'):
+                        continue
+                    for detail in explain(conn, statement, parameters):
+                        match = _FULL_SCAN.match(detail)
+                        if match and match.group(1) in WATCHED_TABLES:
+                            failures.append((endpoint, statement, detail))
+    return failures
+
+
+def check_query_counts(app, budgets=None):
+    """Request each budgeted endpoint and report those issuing too many statements.
+
+    Returns a list of ``(endpoint, statement_count, budget)`` tuples.
+    """
+    failures = []
+    with app.app_context():
+        for endpoint, budget in (budgets or QUERY_BUDGETS).items():
+            response, statements = capture_statements(app, endpoint)
+            if response.status_code >= 400 or len(statements) > budget:
+                failures.append((endpoint, len(statements), budget))
+    return failures
@@ -0,0 +1,118 @@
+# rollup.py
+"""Maintenance of the daily_sales_rollup materialized table.
+
+Each rollup row aggregates one (day, channel, status, dish category) group.
+The rollup subscribes to sale and sale_dish changes on the invalidation bus:
+just before a commit the days touched by the transaction are recomputed in
+that same transaction. rebuild_daily_rollup() recomputes the whole table.
+"""
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import and_, case, event, func, or_, select
+
+from invalidation import on_change
+from models import db, Sale, SaleDish, Dish, DailySalesRollup
+
+_ROLLUP_COLUMNS = ['Day', 'Channel', 'Status', 'Category', 'Revenue', 'Discount',
+                   'LineRevenue', 'Orders', 'Lines', 'Units']
+
+
+def _rollup_select(days=None):
+    """Build the SELECT that aggregates raw sales into rollup rows.
+
+    When ``days`` is given only sales on those days are read, using
+    half-open SaleDate ranges so the SaleDate index is used.
+    """
+    line_total = SaleDish.UnitPrice * SaleDish.Quantity
+    lines = select(
+        Sale.SaleID,
+        func.date(Sale.SaleDate).label('day'),
+        Sale.Channel,
+        Sale.Status,
+        Sale.TotalAmount,
+        Sale.DiscountAmount,
+        Dish.Category,
+        SaleDish.SaleDishID,
+        SaleDish.Quantity,
+        line_total.label('line_total'),
+        func.sum(line_total).over(partition_by=Sale.SaleID).label('order_total'),
+        func.count().over(partition_by=Sale.SaleID).label('line_count')
+    ).select_from(Sale)\
+     .outerjoin(SaleDish, SaleDish.SaleID == Sale.SaleID)\
+     .outerjoin(Dish, Dish.DishID == SaleDish.DishID)
+    if days is not None:
+        lines = lines.where(or_(*[
+            and_(Sale.SaleDate >= datetime.combine(day, time.min),
+                 Sale.SaleDate < datetime.combine(day + timedelta(days=1), time.min))
+            for day in days
+        ]))
+    lines = lines.subquery()
+
+    # 订单金额按行小计比例分摊到各分类；没有行项目（或小计为 0）的订单平均分摊
+    share = case((lines.c.order_total > 0, lines.c.line_total / lines.c.order_total),
+                 else_=1.0 / lines.c.line_count)
+    return select(
+        lines.c.day,
+        lines.c.Channel,
+        lines.c.Status,
+        lines.c.Category,
+        func.coalesce(func.sum(lines.c.TotalAmount * share), 0),
+        func.coalesce(func.sum(lines.c.DiscountAmount * share), 0),
+        func.coalesce(func.sum(lines.c.line_total), 0),
+        func.count(func.distinct(lines.c.SaleID)),
+        func.count(lines.c.SaleDishID),
+        func.coalesce(func.sum(lines.c.Quantity), 0)
+    ).group_by(lines.c.day, lines.c.Channel, lines.c.Status, lines.c.Category)
+
+
+def refresh_daily_rollup(days):
+    """Recompute the rollup rows for ``days`` in the current transaction.
+
+    ``days`` is an iterable of dates or datetimes. Pending session changes are
+    flushed first; the caller is responsible for committing. Normal writes do
+    not need to call this; the bus subscriber below does it on commit.
+    """
+    days = sorted({day.date() if isinstance(day, datetime) else day for day in days if day})
+    if not days:
+        return
+    db.session.flush()
+    DailySalesRollup.query.filter(DailySalesRollup.Day.in_(days)).delete(synchronize_session=False)
+    db.session.execute(DailySalesRollup.__table__.insert().from_select(_ROLLUP_COLUMNS, _rollup_select(days)))
+
+
+def _recompute_all():
+    DailySalesRollup.query.delete(synchronize_session=False)
+    db.session.execute(DailySalesRollup.__table__.insert().from_select(_ROLLUP_COLUMNS, _rollup_select()))
+
+
+def rebuild_daily_rollup():
+    """Recompute the whole rollup table from raw sales and commit."""
+    _recompute_all()
+    db.session.commit()
+    return DailySalesRollup.query.count()
+
+
+# 实例过期后改 SaleDate 时也先加载旧值，变更集里才有原来那一天
+@event.listens_for(Sale.SaleDate, 'set', active_history=True)
+def _keep_previous_sale_date(target, value, oldvalue, initiator):
+    pass
+
+
+@on_change('sale', 'sale_dish', phase='before_commit')
+def _refresh_changed_days(session, changes):
+    """Recompute the rollup for the days of every sale touched by the transaction (old and new day of a moved sale)."""
+    if changes.is_bulk('sale') or changes.is_bulk('sale_dish'):
+        # 批量 UPDATE/DELETE 无法得知涉及哪些天，直接全量重算
+        _recompute_all()
+        return
+
+    dated = [sale for sale in changes.rows('sale') if sale.get('SaleDate')]
+    days = {sale['SaleDate'] for sale in dated}
+    # 其余涉及的订单（只改了明细、或快照里没有 SaleDate）按 ID 查日期
+    sale_ids = changes.keys('sale') | {line.get('SaleID') for line in changes.rows('sale_dish')}
+    sale_ids -= {sale['SaleID'] for sale in dated}
+    sale_ids.discard(None)
+    if sale_ids:
+        days.update(sale_date for (sale_date,) in
+                    session.query(Sale.SaleDate).filter(Sale.SaleID.in_(sale_ids)))
+    refresh_daily_rollup(days)
@@ -0,0 +1,104 @@
+# snapshot.py
+"""Precomputed financial summary snapshots for the /finance page.
+
+rebuild_financial_snapshot() runs the full get_financial_summary()
+(revenue, discounts, purchases, AR/AP, monthly stats, top items, margins)
+once and stores the result as JSON in the financial_snapshot table; the page
+renders the latest snapshot instead of recomputing on every load. Snapshots
+are rebuilt by a background refresher every FINANCIAL_SNAPSHOT_INTERVAL
+seconds (0 disables it) and on demand with ``flask
+rebuild-financial-snapshot``. Only the newest FINANCIAL_SNAPSHOT_KEEP rows
+are kept.
+"""
+import json
+import logging
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+from models import db, FinancialSnapshot
+
+logger = logging.getLogger(__name__)
+
+# 模板需要 date 对象的字段（JSON 里存为 YYYY-MM-DD）
+_RECORD_DATE_FIELDS = {'receivables': 'ReceivableDate', 'payables': 'PayableDate'}
+
+
+def _encode(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _decode(summary):
+    for section, field in _RECORD_DATE_FIELDS.items():
+        for record in summary.get(section, {}).get('records', []):
+            if record.get(field):
+                record[field] = date.fromisoformat(record[field][:10])
+    return summary
+
+
+def rebuild_financial_snapshot(keep=None):
+    """Compute the financial summary, store it as a new snapshot and commit; returns the snapshot."""
+    from blueprints.financial_bp import get_financial_summary
+
+    as_of = date.today()
+    started = time.perf_counter()
+    summary = get_financial_summary(as_of)
+    snapshot = FinancialSnapshot(
+        GeneratedAt=datetime.now(),
+        AsOf=as_of,
+        BuildMs=round((time.perf_counter() - started) * 1000, 1),
+        Summary=json.dumps(summary, default=_encode)
+    )
+    db.session.add(snapshot)
+    db.session.flush()
+    if keep:
+        # 只保留最近 keep 份
+        stale = db.session.query(FinancialSnapshot.SnapshotID) \
+            .order_by(FinancialSnapshot.GeneratedAt.desc(), FinancialSnapshot.SnapshotID.desc()) \
+            .offset(keep).subquery()
+        FinancialSnapshot.query.filter(FinancialSnapshot.SnapshotID.in_(db.session.query(stale.c.SnapshotID))) \
+            .delete(synchronize_session=False)
+    db.session.commit()
+    return snapshot
+
+
+def latest_financial_snapshot():
+    """``(summary, generated_at)`` of the newest snapshot, or None when there is none."""
+    snapshot = FinancialSnapshot.query \
+        .order_by(FinancialSnapshot.GeneratedAt.desc(), FinancialSnapshot.SnapshotID.desc()) \
+        .first()
+    if snapshot is None:
+        return None
+    return _decode(json.loads(snapshot.Summary)), snapshot.GeneratedAt
+
+
+def _snapshot_worker(app, interval, keep, stop):
+    while not stop.wait(interval):
+        with app.app_context():
+            try:
+                snapshot = rebuild_financial_snapshot(keep)
+                logger.info('Financial snapshot %s rebuilt in %s ms', snapshot.SnapshotID, snapshot.BuildMs)
+            except Exception:
+                db.session.rollback()
+                logger.exception('Financial snapshot refresh failed')
+            finally:
+                db.session.remove()
+
+
+def init_financial_snapshots(app):
+    """Start the snapshot refresher unless FINANCIAL_SNAPSHOT_INTERVAL is 0."""
+    interval = app.config.get('FINANCIAL_SNAPSHOT_INTERVAL', 300)
+    if not interval:
+        return None
+    stop = threading.Event()
+    worker = threading.Thread(
+        target=_snapshot_worker, name='financial-snapshot', daemon=True,
+        args=(app, interval, app.config.get('FINANCIAL_SNAPSHOT_KEEP', 24), stop))
+    worker.start()
+    app.extensions['financial_snapshot'] = stop
+    return worker
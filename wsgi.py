@@ -0,0 +1,8 @@
+# wsgi.py
+"""WSGI entry point, e.g. ``gunicorn wsgi:app``.
+
+Unlike importing app.py, this starts the background workers.
+"""
+from app import app, start_background_workers
+
+start_background_workers()
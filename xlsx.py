@@ -0,0 +1,230 @@
+# xlsx.py
+"""Minimal streaming XLSX writer (no third-party dependencies).
+
+stream_xlsx() yields the bytes of an .xlsx workbook while rows are still
+being produced: every worksheet is written straight into its deflated zip
+entry, and the zip container goes to a non-seekable sink that is drained
+after each batch of rows. Only one batch is held in memory at a time.
+
+Cells use inline strings (no shared-string table, which would need every
+value up front). Numbers and booleans keep their type, and dates and
+datetimes are written as Excel serial numbers with a date format. The
+header row is bold and frozen.
+"""
+import math
+import re
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+_EXCEL_EPOCH = datetime(1899, 12, 30)
+# XML 1.0 不允许的控制字符
+_ILLEGAL_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_ILLEGAL_SHEET_NAME = re.compile(r'[\[\]:*?/\\]')
+
+# cellXfs 下标
+_STYLE_DATE = 1
+_STYLE_DATETIME = 2
+_STYLE_HEADER = 3
+
+_XML_HEAD = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+_MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_PKG_REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+
+_SHEET_START = (
+    f'{_XML_HEAD}<worksheet xmlns="{_MAIN_NS}">'
+    '<sheetViews><sheetView workbookViewId="0">'
+    '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+    '</sheetView></sheetViews><sheetData>'
+)
+_SHEET_END = '</sheetData></worksheet>'
+
+_STYLES = (
+    f'{_XML_HEAD}<styleSheet xmlns="{_MAIN_NS}">'
+    '<numFmts count="2"><numFmt numFmtId="164" formatCode="yyyy-mm-dd"/>'
+    '<numFmt numFmtId="165" formatCode="yyyy-mm-dd hh:mm:ss"/></numFmts>'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="4"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+    '</styleSheet>'
+)
+
+
+class _Sink:
+    """Write-only, non-seekable file object that buffers zip output until drained."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _text_cell(value):
+    text = escape(_ILLEGAL_XML.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _number_cell(value):
+    return f'<c><v>{value}</v></c>'
+
+
+def _float_cell(value):
+    return f'<c><v>{value!r}</v></c>' if math.isfinite(value) else _text_cell(value)
+
+
+def _bool_cell(value):
+    return f'<c t="b"><v>{int(value)}</v></c>'
+
+
+def _datetime_cell(value):
+    serial = (value.replace(tzinfo=None) - _EXCEL_EPOCH).total_seconds() / 86400
+    return f'<c s="{_STYLE_DATETIME}"><v>{serial!r}</v></c>'
+
+
+def _date_cell(value):
+    return f'<c s="{_STYLE_DATE}"><v>{(value - _EXCEL_EPOCH.date()).days}</v></c>'
+
+
+# 按精确类型分派；子类（IntEnum、Markup 等）在 _cell 里按此顺序 isinstance 回退（datetime 先于 date）
+_CELL_WRITERS = {
+    str: _text_cell,
+    int: _number_cell,
+    float: _float_cell,
+    Decimal: _number_cell,
+    bool: _bool_cell,
+    datetime: _datetime_cell,
+    date: _date_cell,
+    type(None): lambda value: '<c/>',
+}
+
+
+def _cell(value):
+    """One ``<c>`` element. Cells carry no ``r`` reference: they are positional,
+    so an empty ``<c/>`` keeps the columns of a None aligned."""
+    writer = _CELL_WRITERS.get(type(value))
+    if writer is None:
+        writer = next((writer for kind, writer in _CELL_WRITERS.items()
+                       if kind is not str and isinstance(value, kind)), _text_cell)
+    return writer(value)
+
+
+def _row(values):
+    return f'<row>{"".join(map(_cell, values))}</row>'
+
+
+def _header_row(header):
+    cells = ''.join(
+        f'<c t="inlineStr" s="{_STYLE_HEADER}"><is><t>{escape(str(name))}</t></is></c>' for name in header
+    )
+    return f'<row>{cells}</row>'
+
+
+def _sheet_name(name, used):
+    """Excel sheet names: at most 31 characters, no []:*?/\\ and unique in the workbook."""
+    base = _ILLEGAL_SHEET_NAME.sub('_', str(name)).strip("'")[:31] or 'Sheet'
+    candidate, suffix = base, 1
+    while candidate.lower() in used:
+        suffix += 1
+        candidate = f'{base[:31 - len(str(suffix)) - 1]}_{suffix}'
+    used.add(candidate.lower())
+    return candidate
+
+
+def _package_parts(sheet_names):
+    """The fixed workbook parts that reference ``sheet_names``."""
+    sheet_overrides = ''.join(
+        f'<Override PartName="/xl/worksheets/sheet{index}.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for index in range(1, len(sheet_names) + 1)
+    )
+    sheets = ''.join(
+        f'<sheet name="{escape(name, {chr(34): "&quot;"})}" sheetId="{index}" r:id="rId{index}"/>'
+        for index, name in enumerate(sheet_names, 1)
+    )
+    sheet_rels = ''.join(
+        f'<Relationship Id="rId{index}" Type="{_REL_NS}/worksheet" Target="worksheets/sheet{index}.xml"/>'
+        for index in range(1, len(sheet_names) + 1)
+    )
+    styles_id = len(sheet_names) + 1
+    return {
+        '[Content_Types].xml': (
+            f'{_XML_HEAD}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/styles.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            f'{sheet_overrides}</Types>'
+        ),
+        '_rels/.rels': (
+            f'{_XML_HEAD}<Relationships xmlns="{_PKG_REL_NS}">'
+            f'<Relationship Id="rId1" Type="{_REL_NS}/officeDocument" Target="xl/workbook.xml"/>'
+            '</Relationships>'
+        ),
+        'xl/workbook.xml': (
+            f'{_XML_HEAD}<workbook xmlns="{_MAIN_NS}" xmlns:r="{_REL_NS}">'
+            f'<sheets>{sheets}</sheets></workbook>'
+        ),
+        'xl/_rels/workbook.xml.rels': (
+            f'{_XML_HEAD}<Relationships xmlns="{_PKG_REL_NS}">{sheet_rels}'
+            f'<Relationship Id="rId{styles_id}" Type="{_REL_NS}/styles" Target="styles.xml"/>'
+            '</Relationships>'
+        ),
+        'xl/styles.xml': _STYLES,
+    }
+
+
+def stream_xlsx(sheets, batch_size=1000):
+    """Yield the bytes of a workbook built from ``sheets``.
+
+    ``sheets`` is an iterable of ``(name, header, rows)``; ``rows`` may be any
+    iterable (a yield_per query, a generator) and is consumed lazily,
+    ``batch_size`` rows between yields.
+    """
+    sink = _Sink()
+    sheet_names = []
+    used = set()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as book:
+        for index, (name, header, rows) in enumerate(sheets, 1):
+            sheet_names.append(_sheet_name(name, used))
+            with book.open(f'xl/worksheets/sheet{index}.xml', 'w') as sheet:
+                batch = [_SHEET_START, _header_row(header)]
+                for values in rows:
+                    batch.append(_row(values))
+                    if len(batch) >= batch_size:
+                        sheet.write(''.join(batch).encode('utf-8'))
+                        batch = []
+                        yield sink.drain()
+                batch.append(_SHEET_END)
+                sheet.write(''.join(batch).encode('utf-8'))
+            yield sink.drain()
+        for part, content in _package_parts(sheet_names).items():
+            book.writestr(part, content)
+    yield sink.drain()